@@ -0,0 +1,73 @@
+"""Compare two bench/run.py result files and flag regressions.
+
+    python bench/compare.py baseline.json candidate.json [--threshold 0.1]
+
+Median timings (``median_s``, ``ttft_median_s``) that grew and rates
+(``*_per_s``) that dropped by more than the threshold are reported as
+regressions; the exit status is 1 when there are any.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("median_s", "ttft_median_s")
+HIGHER_IS_BETTER_SUFFIX = "_per_s"
+
+
+def flatten(node, prefix=""):
+    """Yield (path, value) for every numeric leaf; list items are keyed by their size field."""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(node, list):
+        for i, item in enumerate(node):
+            label = i
+            if isinstance(item, dict):
+                label = next((f"{k}={item[k]}" for k in ("messages", "files") if k in item), i)
+            yield from flatten(item, f"{prefix}[{label}]")
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+
+def compare(baseline, candidate, threshold):
+    old = dict(flatten(baseline["results"]))
+    rows = []
+    for path, new_value in flatten(candidate["results"]):
+        old_value = old.get(path)
+        leaf = path.rsplit(".", 1)[-1]
+        if not old_value:
+            continue
+        if leaf in LOWER_IS_BETTER:
+            change = new_value / old_value - 1
+        elif leaf.endswith(HIGHER_IS_BETTER_SUFFIX) and leaf != "rate_per_s":
+            change = old_value / new_value - 1 if new_value else float("inf")
+        else:
+            continue
+        rows.append((path, old_value, new_value, change, change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown that counts (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.candidate) as file:
+        candidate = json.load(file)
+
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{baseline['version']} -> {candidate['version']}")
+    for path, old_value, new_value, change, regressed in rows:
+        marker = "REGRESSION" if regressed else ""
+        print(f"{path:60} {old_value:12.6g} {new_value:12.6g} {change:+8.1%} {marker}")
+    regressions = sum(1 for row in rows if row[4])
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Local stand-in for the Ollama HTTP API, for benchmarks.
+
+Streams NDJSON on /api/generate and /api/chat like Ollama does: one chunk per
+token, then a final ``done`` chunk with the timing fields. Token count, token
+size and token rate come from the server defaults and can be overridden per
+request through ``options`` (``mock_tokens``, ``mock_token_size``,
+``mock_rate`` tokens/s, 0 = as fast as possible). /api/embed, /api/version
+and /api/tags are answered too, so health checks and the semantic cache work.
+
+    python bench/mock_ollama.py --port 11435 --tokens 500 --rate 50
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TOKENS = 200
+DEFAULT_TOKEN_SIZE = 4
+DEFAULT_RATE = 0
+EMBEDDING_SIZE = 64
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self._send_json({"version": "mock"})
+        elif self.path == "/api/tags":
+            self._send_json({"models": []})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path in ("/api/generate", "/api/chat"):
+            self._stream(body, chat=self.path == "/api/chat")
+        elif self.path == "/api/embed":
+            self._send_json({"embeddings": [embedding(str(body.get("input", "")))]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _stream(self, body, chat):
+        options = body.get("options") or {}
+        tokens = int(options.get("mock_tokens", self.server.tokens))
+        token_size = int(options.get("mock_token_size", self.server.token_size))
+        rate = float(options.get("mock_rate", self.server.rate))
+        model = body.get("model", "mock")
+
+        if body.get("stream") is False:
+            text = "".join(token_text(i, token_size) for i in range(tokens))
+            final = final_chunk(model, tokens, time.perf_counter_ns())
+            final.update({"message": {"role": "assistant", "content": text}} if chat else {"response": text})
+            self._send_json(final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        started = time.perf_counter_ns()
+        try:
+            for i in range(tokens):
+                if rate:
+                    delay = started / 1e9 + (i + 1) / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                token = token_text(i, token_size)
+                chunk = {"model": model, "done": False}
+                if chat:
+                    chunk["message"] = {"role": "assistant", "content": token}
+                else:
+                    chunk["response"] = token
+                self._write_chunk(json.dumps(chunk).encode() + b"\n")
+            self._write_chunk(json.dumps(final_chunk(model, tokens, started)).encode() + b"\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            pass
+
+    def _write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def token_text(i, size):
+    word = f"w{i} "
+    return (word * (size // len(word) + 1))[:size]
+
+
+def final_chunk(model, tokens, started_ns):
+    elapsed = time.perf_counter_ns() - started_ns
+    return {
+        "model": model, "done": True, "response": "", "context": list(range(min(tokens, 64))),
+        "total_duration": elapsed, "load_duration": 0,
+        "prompt_eval_count": 16, "prompt_eval_duration": 1_000_000,
+        "eval_count": tokens, "eval_duration": max(elapsed, 1),
+    }
+
+
+def embedding(text):
+    """Deterministic pseudo-embedding: equal texts map to equal vectors."""
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(EMBEDDING_SIZE)]
+
+
+def start(port=0, tokens=DEFAULT_TOKENS, token_size=DEFAULT_TOKEN_SIZE, rate=DEFAULT_RATE):
+    """Start the server in a daemon thread and return it; its URL is ``server.url``."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockOllamaHandler)
+    server.daemon_threads = True
+    server.tokens, server.token_size, server.rate = tokens, token_size, rate
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, name="mock-ollama", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKENS)
+    parser.add_argument("--token-size", type=int, default=DEFAULT_TOKEN_SIZE)
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE, help="tokens per second, 0 = unlimited")
+    args = parser.parse_args()
+    server = start(args.port, args.tokens, args.token_size, args.rate)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""Benchmarks for the chat, persistence and editor hot paths.
+
+Everything runs locally against bench/mock_ollama.py and temporary
+directories, so the numbers are repeatable on one machine:
+
+    python bench/run.py                  # full run, writes bench/results/<version>-<time>.json
+    python bench/run.py --quick          # smaller sizes, for a smoke check
+    python bench/run.py --only history   # just some benchmarks
+    python bench/compare.py old.json new.json
+
+Timings are in seconds (keys ending in ``_s``), rates per second (``_per_s``).
+Each timing is the median of ``--repeat`` runs after one warm-up run.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import mock_ollama  # noqa: E402
+
+# The client modules read OLLAMA_API_URL at import time: start the mock first
+_server = mock_ollama.start()
+os.environ["OLLAMA_API_URL"] = _server.url
+
+import chat_store  # noqa: E402
+import code_runner  # noqa: E402
+import file_index  # noqa: E402
+import file_viewer  # noqa: E402
+import generation_manager  # noqa: E402
+import history_catalog  # noqa: E402
+import ollama_client  # noqa: E402
+import stream_renderer  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# As in main.py and chat.py; TOKEN_RATE is a typical local model's speed
+RENDER_INTERVAL = 0.1
+RENDER_BYTES = 1024
+TOKEN_RATE = 50
+
+
+def measure(fn, repeat):
+    """Run ``fn`` once to warm up, then ``repeat`` times; return timing stats in seconds."""
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "median_s": statistics.median(samples),
+        "min_s": samples[0],
+        "p95_s": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "repeat": repeat,
+    }
+
+
+class _BytesResponse:
+    """Just enough of requests.Response for ollama_client.iter_ndjson."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+
+class _Placeholder:
+    """Stands in for st.empty(); rendering cost is modelled as copying the text."""
+
+    def __init__(self):
+        self.renders = 0
+        self.bytes = 0
+
+    def markdown(self, text):
+        self.renders += 1
+        self.bytes += len(text.encode("utf-8"))
+
+
+def bench_stream_decode(sizes, repeat):
+    tokens = sizes["tokens"]
+    lines = [json.dumps({"model": "m", "response": mock_ollama.token_text(i, 4), "done": False}) for i in range(tokens)]
+    blob = ("\n".join(lines) + "\n").encode()
+
+    def decode_memory():
+        for _ in ollama_client.iter_ndjson(_BytesResponse(blob)):
+            pass
+
+    payload = {"model": "m", "prompt": "bench", "options": {"mock_tokens": tokens}}
+
+    def decode_http():
+        for _ in ollama_client.generate_stream(payload, base_url=_server.url):
+            pass
+
+    memory = measure(decode_memory, repeat)
+    http = measure(decode_http, repeat)
+    return {
+        "tokens": tokens,
+        "memory": dict(memory, tokens_per_s=tokens / memory["median_s"], mb_per_s=len(blob) / 1e6 / memory["median_s"]),
+        "http": dict(http, tokens_per_s=tokens / http["median_s"]),
+    }
+
+
+def bench_render(sizes, repeat):
+    """
+    Cost of showing a streamed reply, tick by tick as the page does it.
+
+    The reply fragment reruns every RENDER_INTERVAL and, in a fresh
+    placeholder, shows what arrived in the job buffer so far. Tokens arrive
+    at TOKEN_RATE on a simulated clock, so idle ticks are included. Compared:
+    the app's path (one StreamRenderer per reply fed from job.read()), a new
+    renderer over the full job.text() every tick, and one render per token.
+    """
+    tokens = [mock_ollama.token_text(i, 4) for i in range(sizes["tokens"])]
+    per_tick = TOKEN_RATE * RENDER_INTERVAL
+    result = {"tokens": len(tokens), "ticks": math.ceil(len(tokens) / per_tick)}
+
+    def ticks():
+        """Yield (job, final) once per tick while the tokens stream into the job's buffer."""
+        job = generation_manager.GenerationJob("/api/generate", {"model": "bench"})
+        arrived = 0.0
+        while len(job.chunks) < len(tokens):
+            arrived += per_tick
+            job.chunks.extend(tokens[len(job.chunks):int(arrived)])
+            yield job, len(job.chunks) == len(tokens)
+
+    def app_path():
+        clock, placeholders = [0.0], []
+        renderer = stream_renderer.StreamRenderer(
+            None, min_interval=RENDER_INTERVAL, min_bytes=RENDER_BYTES, clock=lambda: clock[0]
+        )
+        offset = 0
+        for job, final in ticks():
+            clock[0] += RENDER_INTERVAL
+            placeholders.append(_Placeholder())
+            chunks, offset = job.read(offset)
+            renderer.tick(placeholders[-1], chunks, final=final)
+        result["app_path_renders"] = renderer.renders
+        result["app_path_mb"] = sum(placeholder.bytes for placeholder in placeholders) / 1e6
+
+    def full_text():
+        placeholders = []
+        for job, final in ticks():
+            placeholders.append(_Placeholder())
+            renderer = stream_renderer.StreamRenderer(placeholders[-1])
+            renderer.write(job.text())
+            renderer.close()
+        result["full_text_mb"] = sum(placeholder.bytes for placeholder in placeholders) / 1e6
+
+    def per_token():
+        placeholder, text = _Placeholder(), ""
+        for token in tokens:
+            text += token
+            placeholder.markdown(text)
+        result["per_token_renders"] = placeholder.renders
+
+    result["app_path"] = measure(app_path, repeat)
+    result["full_text_per_tick"] = measure(full_text, repeat)
+    result["per_token"] = measure(per_token, repeat)
+    return result
+
+
+def bench_generation(sizes, repeat):
+    """End to end through GenerationManager at a fixed token rate: time to first token and total."""
+    manager = generation_manager.get_manager()
+    tokens, rate = sizes["rate_tokens"], 200
+    payload = {"model": "m", "prompt": "bench", "options": {"mock_tokens": tokens, "mock_rate": rate}}
+    ttft = []
+
+    def run():
+        job = manager.start("bench", "/api/generate", payload)
+        job.wait(timeout=60)
+        ttft.append(job.metrics.live()["ttft"])
+        manager.pop("bench")
+
+    timing = measure(run, repeat)
+    return {
+        "tokens": tokens, "rate_per_s": rate,
+        "ttft_median_s": statistics.median(ttft), "total": timing,
+        "overhead_s": timing["median_s"] - tokens / rate,
+    }
+
+
+def bench_history(sizes, repeat):
+    """Saving one turn and loading the newest page, versus history length."""
+    results = []
+    for length in sizes["history"]:
+        directory = tempfile.mkdtemp(prefix="bench-history-")
+        try:
+            path = os.path.join(directory, "bench.jsonl")
+            turn = [{"role": "user", "message": "question " * 20}, {"role": "assistant", "message": "answer " * 200}]
+            for _ in range(length // 2):
+                chat_store.append_messages(path, turn, model="m", emoji="🧪")
+            chat_store.flush_all()
+            catalog = history_catalog.HistoryCatalog(directory)
+
+            def save():
+                added = chat_store.append_messages(path, turn, model="m", emoji="🧪")
+                catalog.record_save("bench.jsonl", "bench", "🧪", None, len(turn), added)
+                chat_store.flush_all()
+
+            def load_cold():
+                chat_store._remove_index(path)
+                chat_store.read_tail(path, 50)
+
+            def load_warm():
+                chat_store.read_tail(path, 50)
+
+            def load_full():
+                chat_store.read_session(path)
+
+            results.append({
+                "messages": length,
+                "save": measure(save, repeat),
+                "load_tail_cold": measure(load_cold, repeat),
+                "load_tail_warm": measure(load_warm, repeat),
+                "load_full": measure(load_full, max(1, repeat // 2)),
+            })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_sidebar(sizes, repeat):
+    """Editor file explorer and chat history sidebar, versus number of files."""
+    results = []
+    for count in sizes["files"]:
+        directory = tempfile.mkdtemp(prefix="bench-files-")
+        try:
+            per_folder = 100
+            for i in range(count):
+                folder = os.path.join(directory, f"folder{i // per_folder:04d}")
+                os.makedirs(folder, exist_ok=True)
+                open(os.path.join(folder, f"file_{i:06d}.py"), "w").close()
+
+            def cold():
+                file_index.FileIndex(directory, watch=False).list_dir("")
+
+            index = file_index.FileIndex(directory, watch=False)
+
+            def cached():
+                index.list_dir("")
+
+            def fuzzy():
+                index.fuzzy_filter("fl12")
+
+            catalog = history_catalog.HistoryCatalog(directory)
+            for i in range(count):
+                catalog.record_save(f"chat{i}.jsonl", f"chat {i}", "🧪", None, 2, 1000)
+
+            def history_page():
+                catalog.page("Newest")
+
+            results.append({
+                "files": count,
+                "explorer_cold": measure(cold, repeat),
+                "explorer_cached": measure(cached, repeat),
+                "fuzzy_filter": measure(fuzzy, repeat),
+                "history_page": measure(history_page, repeat),
+            })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_viewer(sizes, repeat):
+    """
+    Paging a growing log in the editor's file viewer: full index, refresh after an append, seek.
+
+    The log first ends exactly on a checkpoint boundary, then grows; every
+    line read back is checked, so a misplaced checkpoint fails the run.
+    """
+    lines = sizes["log_lines"]
+    directory = tempfile.mkdtemp(prefix="bench-viewer-")
+    try:
+        path = os.path.join(directory, "app.log")
+
+        def write(start, stop, mode):
+            with open(path, mode) as file:
+                file.writelines(f"line{i}\n" for i in range(start, stop))
+
+        def check(index, total):
+            for number in sorted({0, file_viewer.CHECKPOINT - 1, file_viewer.CHECKPOINT, lines - 1, lines,
+                                  lines + file_viewer.CHECKPOINT // 2, total - 1}):
+                if number < total and index.read_lines(number, 1) != [f"line{number}"]:
+                    raise AssertionError(f"line {number}: {index.read_lines(number, 1)}")
+
+        def grow():
+            write(0, lines, "w")
+            index = file_viewer.LineIndex(path).refresh()
+            check(index, lines)
+            write(lines, lines * 2, "a")
+            check(index.refresh(), lines * 2)
+
+        write(0, lines * 2, "w")
+        index = file_viewer.LineIndex(path)
+
+        def full_index():
+            file_viewer.LineIndex(path).refresh()
+
+        def seek():
+            index.read_lines(lines * 2 - 100, 50)
+
+        def append():
+            with open(path, "a") as file:
+                file.write("appended\n")
+            index.refresh()
+
+        index.refresh()
+        return {
+            "lines": lines * 2,
+            "grow_and_check": measure(grow, max(1, repeat // 2)),
+            "full_index": measure(full_index, repeat),
+            "seek": measure(seek, repeat),
+            "refresh_after_append": measure(append, repeat),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_code_exec(sizes, repeat):
+    """Latency of running a generated script: warm worker pool vs a fresh interpreter."""
+    directory = tempfile.mkdtemp(prefix="bench-exec-")
+    try:
+        scripts = {"hello": "print('hello')\n"}
+        try:
+            import numpy  # noqa: F401
+            scripts["numpy"] = "import numpy\nprint(numpy.arange(10).sum())\n"
+        except ImportError:
+            pass
+        results = {}
+        pool = code_runner.WorkerPool(size=1, preload=["numpy"]) if code_runner.supported() else None
+        try:
+            for name, source in scripts.items():
+                path = os.path.join(directory, f"{name}.py")
+                with open(path, "w") as file:
+                    file.write(source)
+                entry = {"cold": measure(lambda: subprocess.run([sys.executable, path], capture_output=True), repeat)}
+                if pool is not None:
+                    entry["warm_pool"] = measure(lambda: pool.run(path), repeat)
+                results[name] = entry
+        finally:
+            if pool is not None:
+                pool.close()
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+BENCHMARKS = {
+    "stream_decode": bench_stream_decode,
+    "render": bench_render,
+    "generation": bench_generation,
+    "history": bench_history,
+    "sidebar": bench_sidebar,
+    "viewer": bench_viewer,
+    "code_exec": bench_code_exec,
+}
+
+SIZES = {
+    "full": {"tokens": 20000, "rate_tokens": 200, "history": [100, 1000, 10000], "files": [100, 1000, 10000],
+             "log_lines": 1048576},
+    "quick": {"tokens": 2000, "rate_tokens": 50, "history": [100, 1000], "files": [100, 1000], "log_lines": 65536},
+}
+
+
+def version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--output", help="result file (default: bench/results/<version>-<time>.json)")
+    args = parser.parse_args()
+
+    sizes = SIZES["quick" if args.quick else "full"]
+    report = {
+        "version": version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": sizes,
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for name in args.only or BENCHMARKS:
+        started = time.perf_counter()
+        report["results"][name] = BENCHMARKS[name](sizes, args.repeat)
+        print(f"{name}: done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['version']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,139 +1,433 @@
+import startup
+
+timer = startup.RerunTimer("chat")
+
 import streamlit as st
-import requests
-import json
 import os
 import random
+import uuid
+
+import chat_store
+import context_builder
+import conversation
+import generation_manager
+import history_catalog
+import history_shards
+import metrics
+import model_compare
+import model_lifecycle
+import response_cache
+import scheduler
+import semantic_cache
+import stream_renderer
+
+timer.mark("imports")
 
 model_api_list = []
-OLLAMA_API_URL = "http://localhost:11434"
+GENERATION_MODEL = "qwen2.5:0.5b"
 
 # Ensure chat history directory exists
 HISTORY_DIR = "chat_history"
-os.makedirs(HISTORY_DIR, exist_ok=True)
+startup.run_once(("makedirs", HISTORY_DIR), os.makedirs, HISTORY_DIR, exist_ok=True)
 
 # Emoji list for random selection
 EMOJI_LIST = ["😀", "🎉", "🤖", "🌟", "🧠", "📚", "💬", "🚀", "📝", "🎨", "✨"]
 
-# Initialize session state
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-if "current_chat_file" not in st.session_state:
-    st.session_state.current_chat_file = None
-if "session_emoji" not in st.session_state:
-    st.session_state.session_emoji = random.choice(EMOJI_LIST)
-if "stop_generation" not in st.session_state:
-    st.session_state.stop_generation = False
-
-
-def generate_response(prompt):
+# Streamed output (the reply and the comparison columns) is redrawn by fragments
+# every RENDER_INTERVAL seconds; a renderer renders at most that often unless
+# RENDER_BYTES of new text are pending
+RENDER_INTERVAL = 0.1
+RENDER_BYTES = 1024
+
+# Messages loaded when a saved chat is opened, and per "Load earlier" click
+HISTORY_PAGE = 50
+# Messages shown before a search result when a chat is opened at it
+SEARCH_CONTEXT = 2
+
+# Initialize session state (factories run only for missing keys)
+startup.init_session_state(st.session_state, {
+    "chat_history": list,
+    "current_chat_file": None,
+    "session_emoji": lambda: random.choice(EMOJI_LIST),
+    "history_cursors": lambda: [None],
+    "last_timing": None,
+    "reply_view": None,
+    "render_stats": None,
+    "conversation_context": None,
+    "history_summary": None,
+    "comparison": None,
+    "token_counts": dict,
+    "history_start": 0,
+    "search_hit": None,
+    "legacy_source": None,
+    "saved_message_count": 0,
+    "session_key": lambda: uuid.uuid4().hex,
+})
+
+
+def current_shard():
+    """The history shard of the current user (anonymous without a login): session files and catalog."""
+    return history_shards.get_shard(HISTORY_DIR, st.session_state.get("current_user"))
+
+
+def generate_response(prompt, use_cache=True):
     """
-    Generate a response using the Ollama API.
+    Start generating a response with the Ollama API in a background worker.
 
     Parameters:
         prompt (str): The user input prompt.
+        use_cache (bool): Replay an identical earlier answer from the response
+            cache; False forces a fresh generation that replaces the entry.
 
-    Yields:
-        str: The generated response in chunks.
+    Returns:
+        GenerationJob: The job whose buffer receives the response chunks.
     """
     system = """You are a Physics book Writer, 
                 given a topic you will 
                 write a planned book."""
+    # Continue from the KV context of the previous turn while it is valid and within the
+    # history budget; otherwise send the recent turns and the rolling summary as text
+    prompt_tokens = model_lifecycle.estimate_tokens(system + prompt)
+    context = conversation.current(st.session_state, GENERATION_MODEL)
+    if context and len(context) > context_builder.history_budget(GENERATION_MODEL, prompt_tokens):
+        context = None
+    history, history_tokens = ("", 0) if context else context_builder.build(
+        st.session_state, GENERATION_MODEL, prompt_tokens
+    )
+    payload = {"model": GENERATION_MODEL,
+               "prompt": history + prompt,
+               "system": system}
+
+    if context:
+        payload["context"] = context
+
+    # Size num_ctx to this request and keep the model resident between turns
+    payload.update(model_lifecycle.request_settings(
+        GENERATION_MODEL, system + prompt, context_tokens=len(context or []), history_tokens=history_tokens
+    ))
+
+    cache = response_cache.get_cache()
+    key = response_cache.cache_key(payload)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is None and semantic_cache.ENABLED and not context and not history:
+            cached = semantic_cache.get_cache().lookup(payload)
+    else:
+        cached = None
+        cache.record_bypass()
+
+    def remember(job):
+        cache.put(key, job.text(), job.final_chunk)
+        if semantic_cache.ENABLED and not context and not history:
+            semantic_cache.get_cache().add(payload, key)
+
+    return generation_manager.get_manager().start(
+        st.session_state.session_key,
+        "/api/generate",
+        payload,
+        replay=response_cache.replay_chunks(cached) if cached else None,
+        on_done=None if cached else remember,
+    )
+
+
+def stop_generation():
+    """Cancel the running generation and close its upstream stream."""
+    job = generation_manager.get_manager().cancel(st.session_state.session_key)
+    if job is not None:
+        job.wait(timeout=1)
 
-    response = requests.post(
-        f"{OLLAMA_API_URL}/api/generate",
-        json={"model": GENERATION_MODEL, 
-              "prompt": prompt, 
-              "system": system,
-              "num_ctx": 100000},
-        stream=True,
+
+def collect_response():
+    """Move a finished background generation into the chat history."""
+    manager = generation_manager.get_manager()
+    job = manager.get(st.session_state.session_key)
+    if job is None or not job.done:
+        return
+    manager.pop(st.session_state.session_key)
+    view = st.session_state.reply_view
+    if view is not None and view["job"] is job:
+        st.session_state.render_stats = view["renderer"].stats()
+    st.session_state.reply_view = None
+
+    if job.status == generation_manager.ERROR:
+        st.error(f"Error generating response: {job.error}")
+    if job.parse_errors:
+        st.error("Error parsing response chunk.")
+    if job.status == generation_manager.CANCELLED:
+        st.warning("Generation stopped by the user.")
+
+    # Add AI's response to chat history
+    st.session_state.chat_history.append({"role": "assistant", "message": job.text()})
+
+    # Auto-save chat history
+    save_chat_history()
+
+    st.session_state.last_timing = model_lifecycle.timing_report(job.final_chunk)
+    context_builder.record_tokens(
+        st.session_state, st.session_state.history_start + len(st.session_state.chat_history) - 1,
+        st.session_state.chat_history[-1], (job.final_chunk or {}).get("eval_count"),
     )
-    if response.status_code == 200:
-        for chunk in response.iter_lines():
-            if st.session_state.stop_generation:
-                st.session_state.stop_generation = False
-                break
-            if chunk:
-                try:
-                    chunk_data = json.loads(chunk.decode("utf-8"))
-                    if "response" in chunk_data:
-                        yield chunk_data["response"]
-                except json.JSONDecodeError:
-                    st.error("Error parsing response chunk.")
+
+    file_path = current_shard().path(st.session_state.current_chat_file)
+    if job.status == generation_manager.DONE:
+        conversation.update(st.session_state, job.payload["model"], job.final_chunk, file_path)
     else:
-        st.error(f"Error generating response: {response.text}")
-        yield ""
+        conversation.invalidate(st.session_state, file_path)
+    # Fold turns that left the history window into the summary before the next prompt
+    context_builder.summarize_in_background(st.session_state, job.payload["model"], file_path, user=st.session_state.get("current_user"))
+
+
+@st.fragment(run_every=RENDER_INTERVAL)
+def render_response():
+    """Show the in-flight response from its background buffer, redrawn every RENDER_INTERVAL."""
+    job = generation_manager.get_manager().get(st.session_state.session_key)
+    if job is None:
+        return
+    # One renderer and read offset per job, kept across the fragment's reruns
+    view = st.session_state.reply_view
+    if view is None or view["job"] is not job:
+        renderer = stream_renderer.StreamRenderer(None, min_interval=RENDER_INTERVAL, min_bytes=RENDER_BYTES)
+        view = st.session_state.reply_view = {"job": job, "offset": 0, "renderer": renderer}
+    done = job.done
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        if job.status == generation_manager.QUEUED:
+            placeholder.markdown(f"⏳ Queued, position {job.queue_position()}…")
+        else:
+            # Only the chunks that arrived since the last tick are added
+            chunks, view["offset"] = job.read(view["offset"])
+            view["renderer"].tick(placeholder, chunks, final=done)
+    if done:
+        # Full rerun so collect_response moves the reply into the history
+        st.rerun()
 
 
 def save_chat_history():
-    """Automatically save the current chat history."""
+    """Automatically append the messages not yet saved to the session journal."""
     if not st.session_state.chat_history:
         return
 
     # Generate filename from the first user prompt
     if not st.session_state.current_chat_file:
-        first_prompt = st.session_state.chat_history[0]["message"] if st.session_state.chat_history else "chat"
-        sanitized_filename = "".join(c for c in first_prompt if c.isalnum() or c in (" ", "_", "-")).rstrip()
-        st.session_state.current_chat_file = f"{st.session_state.session_emoji}_{sanitized_filename[:30].replace(' ', '_')}.md"
-
-    file_path = os.path.join(HISTORY_DIR, st.session_state.current_chat_file)
-    with open(file_path, "w") as file:
-        file.write(f"# Chat Session {st.session_state.session_emoji}\n\n")
-        for msg in st.session_state.chat_history:
-            file.write(f"**{msg['role'].capitalize()}:** {msg['message']}\n\n")
-
-
-def load_chat_history(file_name):
-    """Load a saved chat history from the chat_history folder."""
-    file_path = os.path.join(HISTORY_DIR, file_name)
-    with open(file_path, "r") as file:
-        chat_lines = file.readlines()
-
-    st.session_state.chat_history = []
-    current_role = None
-    current_message = ""
-
-    for line in chat_lines:
-        if line.startswith("**User:**"):
-            if current_role and current_message:
-                st.session_state.chat_history.append({"role": current_role, "message": current_message.strip()})
-            current_role = "user"
-            current_message = line.replace("**User:**", "").strip()
-        elif line.startswith("**Assistant:**"):
-            if current_role and current_message:
-                st.session_state.chat_history.append({"role": current_role, "message": current_message.strip()})
-            current_role = "assistant"
-            current_message = line.replace("**Assistant:**", "").strip()
-        else:
-            current_message += line
+        first_prompt = st.session_state.chat_history[0]["message"]
+        st.session_state.current_chat_file = current_shard().new_session_name(
+            st.session_state.session_emoji, first_prompt
+        )
+
+    file_path = current_shard().path(st.session_state.current_chat_file)
+    new_messages = st.session_state.chat_history[st.session_state.saved_message_count:]
+    legacy_source = st.session_state.legacy_source
+    added_bytes = chat_store.append_messages(
+        file_path, new_messages, model=GENERATION_MODEL, emoji=st.session_state.session_emoji,
+        sync=legacy_source is not None,
+    )
+    current_shard().search.add(
+        st.session_state.current_chat_file,
+        st.session_state.history_start + st.session_state.saved_message_count,
+        new_messages,
+    )
+    evicted = current_shard().record_save(
+        st.session_state.current_chat_file,
+        title=st.session_state.chat_history[0]["message"][:60],
+        emoji=st.session_state.session_emoji,
+        added_messages=len(new_messages),
+        added_bytes=added_bytes,
+    )
+    if evicted:
+        st.toast(f"History quota reached: removed {len(evicted)} least recently used chat(s).")
+    st.session_state.saved_message_count = len(st.session_state.chat_history)
+    if legacy_source is not None:
+        # The journal now holds the migrated chat (synced above): drop the markdown original
+        current_shard().delete(legacy_source)
+        st.session_state.legacy_source = None
+
+
+def load_chat_history(file_name, position=None):
+    """Load a saved chat history from the chat_history folder, reaching back to message ``position`` if given."""
+    generation_manager.get_manager().cancel(st.session_state.session_key)
+    generation_manager.get_manager().pop(st.session_state.session_key)
+
+    shard = current_shard()
+    shard.touch(file_name)
+    file_path = shard.path(file_name)
+    if file_name.endswith(chat_store.JOURNAL_EXT):
+        # Only the most recent messages; older ones load on scroll-back
+        include = None if position is None else position - SEARCH_CONTEXT
+        emoji, start, messages = chat_store.read_tail(file_path, HISTORY_PAGE, include=include)
+        st.session_state.current_chat_file = file_name
+        st.session_state.saved_message_count = len(messages)
+        st.session_state.history_start = start
+        st.session_state.legacy_source = None
+    else:
+        # Legacy markdown history: the next save migrates it to a new journal and removes it
+        emoji, messages = chat_store.read_session(file_path)
+        st.session_state.current_chat_file = None
+        st.session_state.saved_message_count = 0
+        st.session_state.history_start = 0
+        st.session_state.legacy_source = file_name
+
+    st.session_state.chat_history = [{"role": msg["role"], "message": msg["message"]} for msg in messages]
+    st.session_state.search_hit = position
+    if emoji:
+        st.session_state.session_emoji = emoji
+
+    if st.session_state.current_chat_file:
+        conversation.load(st.session_state, file_path)
+        context_builder.load(st.session_state, file_path)
+    else:
+        conversation.invalidate(st.session_state)
+        context_builder.reset(st.session_state)
 
-    if current_role and current_message:
-        st.session_state.chat_history.append({"role": current_role, "message": current_message.strip()})
 
-    st.session_state.current_chat_file = file_name
+def load_earlier_messages():
+    """Prepend the previous page of messages of the open chat."""
+    start = st.session_state.history_start
+    new_start = max(0, start - HISTORY_PAGE)
+    file_path = current_shard().path(st.session_state.current_chat_file)
+    older = chat_store.read_range(file_path, new_start, start)
+    st.session_state.chat_history[:0] = [{"role": msg["role"], "message": msg["message"]} for msg in older]
+    st.session_state.saved_message_count += len(older)
+    st.session_state.history_start = new_start
 
 
 def clear_chat():
     """Clear the chat history and reset session state."""
+    generation_manager.get_manager().cancel(st.session_state.session_key)
+    generation_manager.get_manager().pop(st.session_state.session_key)
     st.session_state.chat_history = []
     st.session_state.current_chat_file = None
+    st.session_state.saved_message_count = 0
+    st.session_state.history_start = 0
+    st.session_state.search_hit = None
+    st.session_state.legacy_source = None
     st.session_state.session_emoji = random.choice(EMOJI_LIST)
+    conversation.invalidate(st.session_state)
+    context_builder.reset(st.session_state)
 
 
 def delete_file(file_name):
     """Delete a specific chat history file."""
-    file_path = os.path.join(HISTORY_DIR, file_name)
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    current_shard().delete(file_name)
+    if file_name == st.session_state.legacy_source:
+        st.session_state.legacy_source = None
+    if file_name == st.session_state.current_chat_file:
+        st.session_state.current_chat_file = None
+        st.session_state.saved_message_count = 0
+        st.session_state.history_start = 0
+        conversation.invalidate(st.session_state)
+        context_builder.reset(st.session_state)
 
 
 def delete_all_history():
-    """Delete all saved chat history files."""
-    for file_name in os.listdir(HISTORY_DIR):
+    """Delete all of the current user's saved chat history files."""
+    for file_name in current_shard().catalog.remove_all():
         delete_file(file_name)
+    reset_history_pages()
+
+
+def reset_history_pages():
+    """Go back to the first page of saved chats."""
+    st.session_state.history_cursors = [None]
+
+
+def next_history_page(cursor):
+    st.session_state.history_cursors.append(cursor)
+
+
+def previous_history_page():
+    if len(st.session_state.history_cursors) > 1:
+        st.session_state.history_cursors.pop()
+
+
+def compare_view():
+    """Comparison mode: one prompt to several configured models, streamed side by side."""
+    models = model_compare.available_models()
+    selected = st.multiselect("Models", models, default=models, key="compare_models")
+    prompt = st.chat_input("Prompt for every selected model:")
+    if prompt and selected:
+        if st.session_state.comparison is not None:
+            st.session_state.comparison.close()
+        try:
+            st.session_state.comparison = model_compare.Comparison(
+                st.session_state.session_key, prompt, selected, user=st.session_state.get("current_user")
+            )
+        except scheduler.SchedulerFull as e:
+            st.session_state.comparison = None
+            st.error(f"{e}. Please try again in a moment.")
+    if st.session_state.comparison is None:
+        return
+    if st.session_state.comparison.done:
+        model_compare.render(st, st.session_state.comparison, min_interval=RENDER_INTERVAL, min_bytes=RENDER_BYTES)
+    else:
+        render_comparison()
+
+
+@st.fragment(run_every=RENDER_INTERVAL)
+def render_comparison():
+    """Redraw the running comparison every RENDER_INTERVAL; a full rerun once every model is done."""
+    comparison = st.session_state.comparison
+    if comparison is None:
+        return
+    done = comparison.done
+    model_compare.render(st, comparison, min_interval=RENDER_INTERVAL, min_bytes=RENDER_BYTES)
+    if done:
+        st.rerun()
+
+
+def display_search():
+    """Search box over the user's saved messages; a result opens its chat at that message."""
+    query = st.sidebar.text_input("🔎 Search chats", key="chat_search", placeholder='words, "a phrase", prefix…')
+    if not query.strip():
+        return
+    shard = current_shard()
+    results = shard.search.search(query)
+    if not results:
+        st.sidebar.caption("No matching messages.")
+    for result in results:
+        row = shard.catalog.get(result["file_name"])
+        if row is None:
+            continue
+        key = f"hit_{result['file_name']}_{result['position']}"
+        if st.sidebar.button(f"{row['emoji'] or ''} {row['title']}", key=key, help=f"{result['role']} message"):
+            load_chat_history(result["file_name"], result["position"])
+        st.sidebar.caption(result["snippet"])
+
+
+def display_saved_histories():
+    """List one page of saved chats from the catalog, with delete buttons."""
+    catalog = current_shard().catalog
+    sort = st.sidebar.selectbox(
+        "Sort by", list(history_catalog.SORT_ORDERS), key="history_sort", on_change=reset_history_pages
+    )
+    rows, next_cursor = catalog.page(sort, st.session_state.history_cursors[-1])
+    for row in rows:
+        file_name = row["file_name"]
+        col1, col2 = st.sidebar.columns([0.8, 0.2])
+        label = f"📄 {row['emoji'] or ''} {row['title']}"
+        details = f"{row['message_count']} messages, {row['size'] // 1024} KB"
+        if col1.button(label, key=f"load_{file_name}", help=details):
+            load_chat_history(file_name)
+        if col2.button("❌", key=f"del_{file_name}"):
+            delete_file(file_name)
+
+    col1, col2 = st.sidebar.columns(2)
+    col1.button(
+        "◀ Prev", key="history_prev", on_click=previous_history_page,
+        disabled=len(st.session_state.history_cursors) == 1,
+    )
+    col2.button(
+        "Next ▶", key="history_next", on_click=next_history_page, args=(next_cursor,),
+        disabled=next_cursor is None,
+    )
 
 
 def loop_chat(prompt):
     if prompt:
+        # Finish any generation still running for this session first
+        if generation_manager.get_manager().get(st.session_state.session_key):
+            stop_generation()
+            collect_response()
+
         # Display the user's input
         with st.chat_message("user"):
             st.markdown(prompt)
@@ -141,23 +435,13 @@ def loop_chat(prompt):
         # Add user's message to chat history
         st.session_state.chat_history.append({"role": "user", "message": prompt})
 
-        # Generate the AI's response
-        with st.chat_message("assistant"):
-            response_placeholder = st.empty()
-            full_response = ""
-
-            for chunk in generate_response(prompt):
-                if st.session_state.stop_generation:
-                    st.warning("Generation stopped by the user.")
-                    break
-                full_response += chunk
-                response_placeholder.markdown(full_response)
-
-            # Add AI's response to chat history
-            st.session_state.chat_history.append({"role": "assistant", "message": full_response})
-
-        # Auto-save chat history
-        save_chat_history()
+        # Generate the AI's response in the background; render_response shows it
+        try:
+            generate_response(prompt)
+        except scheduler.SchedulerFull as e:
+            # Load shedding: nothing was queued, so drop the prompt again
+            st.session_state.chat_history.pop()
+            st.error(f"{e}. Please try again in a moment.")
 
 
 def main_chat():
@@ -165,27 +449,53 @@ def main_chat():
 
     # Sidebar: Directory tree and new chat button
     st.sidebar.header("Chat History")
+    cache_stats = response_cache.get_cache().stats
+    st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+    if st.session_state.last_timing:
+        st.sidebar.caption(f"Last reply: {model_lifecycle.format_timing(st.session_state.last_timing)}")
+    with st.sidebar.expander("📊 Generation metrics"):
+        st.caption(metrics.format_summary(metrics.summary()))
+        if st.session_state.render_stats:
+            st.caption(f"Last reply rendering: {stream_renderer.format_stats(st.session_state.render_stats)}")
+    compare_mode = st.sidebar.toggle("🆚 Compare models", key="compare_mode")
     if st.sidebar.button("➕ New Chat"):
         clear_chat()
 
     if st.sidebar.button("🗑️ Delete All History"):
         delete_all_history()
 
+    if st.session_state.current_chat_file and st.sidebar.button("📝 Export Markdown"):
+        chat_store.compact_async(current_shard().path(st.session_state.current_chat_file))
+        st.sidebar.info(f"Exporting to {current_shard().directory}/{chat_store.EXPORT_DIR}/")
+
+    display_search()
+
     # List saved chat histories as buttons with delete buttons
-    saved_histories = os.listdir(HISTORY_DIR)
-    if saved_histories:
-        st.sidebar.markdown("### Saved Chats")
-        for file_name in saved_histories:
-            col1, col2 = st.sidebar.columns([0.8, 0.2])
-            if col1.button(f"📄 {file_name}", key=f"load_{file_name}"):
-                load_chat_history(file_name)
-            if col2.button("❌", key=f"del_{file_name}"):
-                delete_file(file_name)
+    st.sidebar.markdown("### Saved Chats")
+    display_saved_histories()
+
+    # Pick up a response that finished since the last run
+    collect_response()
+    # Keep the compactor away from the chat this session has open
+    if st.session_state.current_chat_file:
+        current_shard().mark_open(st.session_state.current_chat_file)
+
+    if compare_mode:
+        compare_view()
+        return
 
     # Display chat messages from history
-    for chat in st.session_state.chat_history:
+    if st.session_state.current_chat_file and st.session_state.history_start:
+        st.button(
+            f"⬆️ Load earlier messages ({st.session_state.history_start} more)",
+            on_click=load_earlier_messages,
+        )
+    for i, chat in enumerate(st.session_state.chat_history, start=st.session_state.history_start):
         with st.chat_message(chat["role"]):
+            if i == st.session_state.search_hit:
+                st.caption("🔎 Search result")
             st.markdown(chat["message"])
+    chat_slot = st.container()
 
     # Display current session emoji
     st.markdown(f"### Current Chat Emoji: {st.session_state.session_emoji}")
@@ -196,15 +506,23 @@ def main_chat():
     # Place the stop button at the bottom
     col1, col2 = st.columns([0.8, 0.2])
     with col2:
-        stop_button = st.button("⏹️")
-        if stop_button:
-            st.session_state.stop_generation = True
+        st.button("⏹️", on_click=stop_generation)
 
     while prompt:
-        loop_chat(prompt)
+        with chat_slot:
+            loop_chat(prompt)
         prompt = None  # Prevent looping on the same prompt
 
+    if generation_manager.get_manager().get(st.session_state.session_key):
+        with chat_slot:
+            render_response()
+
 
 if __name__ == "__main__":
     st.set_page_config(page_title="AI Chat Assistant", layout="wide")
+    startup.run_once("warm_up", model_lifecycle.warm_up_configured)
+    startup.run_once("metrics_server", metrics.start_http_server)
+    timer.mark("setup")
     main_chat()
+    timer.mark("page")
+    startup.render_report(st, "chat", timer)
@@ -0,0 +1,388 @@
+"""Full-text search over saved chat messages.
+
+Each history shard has an inverted index in ``search.sqlite3`` next to its
+catalog: a ``terms`` table (term -> id and document frequency), a
+``postings`` table (term id, message id -> term frequency) clustered by term
+and newest message first, and ``entries`` with each message's session file,
+position, length and zlib-compressed text for snippets. Saves add only the
+new messages, on a background writer, so the index is never rebuilt;
+deleting, trimming or merging a session re-indexes just that file.
+
+Queries are ranked with BM25 from the stored frequencies, so the cost does not
+grow with how common a word is: candidates come from the postings of the
+rarest query term (its newest CANDIDATES messages at most), the other terms
+are looked up only for those messages. Every word must match; ``"quoted
+phrases"`` must match in order, and the last word also matches as a prefix
+so results show up while typing.
+
+A shard whose index does not exist yet (chats saved before search existed) is
+indexed in the background the first time it is opened.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import chat_store
+
+INDEX_FILE = "search.sqlite3"
+RESULTS = 20
+CANDIDATES = 1000
+PREFIX_EXPANSIONS = 8
+MIN_PREFIX = 2
+SNIPPET_WORDS = 16
+HIGHLIGHT = ("**", "**")
+CACHE_KB = 32 * 1024
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT,
+    length INTEGER NOT NULL,
+    message BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_file_name ON entries (file_name);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE,
+    df INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    doc INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term_id, doc)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    docs INTEGER NOT NULL,
+    tokens INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO stats (id, docs, tokens) VALUES (0, 0, 0);
+"""
+
+_WORD = re.compile(r"\w+")
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-search")
+
+
+def normalize(word):
+    """Case- and accent-insensitive form of a word ("Schrödinger" -> "schrodinger")."""
+    word = word.casefold()
+    if word.isascii():
+        return word
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [normalize(word) for word in _WORD.findall(text)]
+
+
+def parse_query(query):
+    """
+    Split what the user typed into groups that must all match.
+
+    Returns:
+        list: (kind, tokens) with kind "word", "phrase" or "prefix" (the last
+        bare word, when at least MIN_PREFIX characters long).
+    """
+    groups = []
+    for phrase, word in re.findall(r'"([^"]*)"|([^\s"]+)', query):
+        tokens = tokenize(phrase or word)
+        if not tokens:
+            continue
+        if phrase and len(tokens) > 1:
+            groups.append(("phrase", tokens))
+        else:
+            groups.extend(("word", [token]) for token in tokens)
+    if groups and groups[-1][0] == "word" and not query.rstrip().endswith('"') \
+            and len(groups[-1][1][0]) >= MIN_PREFIX:
+        groups[-1] = ("prefix", groups[-1][1])
+    return groups
+
+
+class SearchIndex:
+    """The message index of one history folder."""
+
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        self.path = os.path.join(history_dir, INDEX_FILE)
+        is_new = not os.path.exists(self.path)
+        self._lock = threading.Lock()
+        self._term_ids = {}
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA cache_size = -{CACHE_KB}")
+        self._db.executescript(_SCHEMA)
+        if is_new:
+            _writer.submit(self.rebuild)
+
+    def add(self, file_name, start, messages):
+        """Index ``messages``, the journal messages of ``file_name`` from position ``start`` on."""
+        return _writer.submit(self._insert, file_name, start, messages)
+
+    def reindex(self, file_name):
+        """Replace the entries of ``file_name`` with its current contents (after trim or merge)."""
+        return _writer.submit(self._reindex, file_name)
+
+    def remove(self, file_name):
+        return _writer.submit(self._delete, file_name)
+
+    def search(self, query, limit=RESULTS):
+        """
+        Return the best matches for ``query``.
+
+        Returns:
+            list: Dicts with "file_name", "position", "role", "snippet" and
+            "score" (BM25, higher is better), best first.
+        """
+        groups = parse_query(query)
+        if not groups:
+            return []
+        with self._lock:
+            docs, tokens = self._db.execute("SELECT docs, tokens FROM stats").fetchone()
+            if not docs:
+                return []
+            average = tokens / docs
+            # term id -> df for every group; a group matches if any of its terms does
+            group_terms = [self._group_terms(kind, group_tokens) for kind, group_tokens in groups]
+            if not all(group_terms):
+                return []
+            order = sorted(range(len(groups)), key=lambda i: sum(group_terms[i].values()))
+
+            # Candidates: the newest messages containing the rarest group
+            frequencies = {}
+            for term_id in group_terms[order[0]]:
+                rows = self._db.execute(
+                    "SELECT doc, tf FROM postings WHERE term_id = ? ORDER BY doc DESC LIMIT ?",
+                    (term_id, CANDIDATES),
+                )
+                for doc, tf in rows:
+                    frequencies.setdefault(doc, {})[term_id] = tf
+            candidates = sorted(frequencies, reverse=True)[:CANDIDATES]
+
+            # Every other group must match too; fetch its frequencies for the candidates only
+            for i in order[1:]:
+                if not candidates:
+                    return []
+                found = set()
+                rows = self._db.execute(
+                    f"SELECT term_id, doc, tf FROM postings WHERE term_id IN ({_marks(group_terms[i])}) "
+                    f"AND doc IN ({_marks(candidates)})",
+                    (*group_terms[i], *candidates),
+                )
+                for term_id, doc, tf in rows:
+                    frequencies[doc][term_id] = tf
+                    found.add(doc)
+                candidates = [doc for doc in candidates if doc in found]
+            if not candidates:
+                return []
+
+            lengths = dict(self._db.execute(
+                f"SELECT id, length FROM entries WHERE id IN ({_marks(candidates)})", candidates
+            ))
+        idf = {
+            term_id: math.log(1 + (docs - df + 0.5) / (df + 0.5))
+            for terms in group_terms for term_id, df in terms.items()
+        }
+        scores = []
+        for doc in candidates:
+            norm = K1 * (1 - B + B * lengths.get(doc, average) / average)
+            score = sum(idf[term_id] * tf * (K1 + 1) / (tf + norm) for term_id, tf in frequencies[doc].items())
+            scores.append((score, doc))
+        scores.sort(reverse=True)
+        return self._results(scores, groups, limit)
+
+    def rebuild(self):
+        """Index every journal in the folder from scratch."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+            self._db.execute("DELETE FROM postings")
+            self._db.execute("DELETE FROM terms")
+            self._db.execute("UPDATE stats SET docs = 0, tokens = 0")
+            self._term_ids.clear()
+        for file_name in chat_store.list_sessions(self.history_dir):
+            if file_name.endswith(chat_store.JOURNAL_EXT):
+                self._reindex(file_name)
+
+    def optimize(self):
+        """Drop unused terms and reclaim free pages, keeping the file compact."""
+        return _writer.submit(self._optimize)
+
+    def _group_terms(self, kind, tokens):
+        if kind == "prefix":
+            prefix = tokens[0]
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            rows = self._db.execute(
+                "SELECT id, df FROM terms WHERE term >= ? AND term < ? AND df > 0 ORDER BY df DESC LIMIT ?",
+                (prefix, upper, PREFIX_EXPANSIONS),
+            ).fetchall()
+            return dict(rows)
+        rows = self._db.execute(
+            f"SELECT term, id, df FROM terms WHERE term IN ({_marks(tokens)}) AND df > 0", tokens
+        ).fetchall()
+        if len(rows) < len(set(tokens)):
+            return {}
+        if kind == "word":
+            return {term_id: df for _, term_id, df in rows}
+        # A phrase is looked up by its rarest word; the order is checked on the text
+        _, term_id, df = min(rows, key=lambda row: row[2])
+        return {term_id: df}
+
+    def _results(self, scores, groups, limit):
+        phrases = [tokens for kind, tokens in groups if kind == "phrase"]
+        words = {token for kind, tokens in groups if kind != "prefix" for token in tokens}
+        prefixes = [tokens[0] for kind, tokens in groups if kind == "prefix"]
+        results = []
+        # Phrases are verified on the text, so keep reading batches until enough match
+        step = limit * 2 if phrases else limit
+        for start in range(0, len(scores), step):
+            batch = scores[start:start + step]
+            with self._lock:
+                rows = {row[0]: row[1:] for row in self._db.execute(
+                    f"SELECT id, file_name, position, role, message FROM entries WHERE id IN ({_marks(batch)})",
+                    [doc for _, doc in batch],
+                )}
+            for score, doc in batch:
+                if doc not in rows:
+                    continue
+                file_name, position, role, blob = rows[doc]
+                text = zlib.decompress(blob).decode("utf-8")
+                if phrases and not all(_contains(tokenize(text), phrase) for phrase in phrases):
+                    continue
+                results.append({
+                    "file_name": file_name, "position": position, "role": role,
+                    "snippet": snippet(text, words, prefixes), "score": score,
+                })
+                if len(results) == limit:
+                    return results
+            if not phrases:
+                break
+        return results
+
+    def _insert(self, file_name, start, messages):
+        with self._lock, self._db:
+            documents, tokens = 0, 0
+            df = Counter()
+            postings = []
+            for offset, msg in enumerate(messages):
+                text = msg.get("message")
+                if not text:
+                    continue
+                words = tokenize(text)
+                doc = self._db.execute(
+                    "INSERT INTO entries (file_name, position, role, length, message) VALUES (?, ?, ?, ?, ?)",
+                    (file_name, start + offset, msg["role"], len(words), zlib.compress(text.encode("utf-8"))),
+                ).lastrowid
+                for term, tf in Counter(words).items():
+                    term_id = self._term_id(term)
+                    postings.append((term_id, doc, tf))
+                    df[term_id] += 1
+                documents += 1
+                tokens += len(words)
+            # In key order, so the inserts walk the postings b-tree instead of jumping around it
+            postings.sort()
+            self._db.executemany("INSERT INTO postings (term_id, doc, tf) VALUES (?, ?, ?)", postings)
+            self._db.executemany("UPDATE terms SET df = df + ? WHERE id = ?", [(n, t) for t, n in df.items()])
+            self._db.execute("UPDATE stats SET docs = docs + ?, tokens = tokens + ?", (documents, tokens))
+
+    def _delete(self, file_name):
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id, length, message FROM entries WHERE file_name = ?", (file_name,)
+            ).fetchall()
+            if not rows:
+                return
+            df = Counter()
+            postings = []
+            for doc, _, blob in rows:
+                for term in set(tokenize(zlib.decompress(blob).decode("utf-8"))):
+                    term_id = self._term_id(term)
+                    postings.append((term_id, doc))
+                    df[term_id] += 1
+            self._db.executemany("DELETE FROM postings WHERE term_id = ? AND doc = ?", postings)
+            self._db.executemany("UPDATE terms SET df = df - ? WHERE id = ?", [(n, t) for t, n in df.items()])
+            self._db.execute(
+                "UPDATE stats SET docs = docs - ?, tokens = tokens - ?",
+                (len(rows), sum(length for _, length, _ in rows)),
+            )
+            self._db.execute("DELETE FROM entries WHERE file_name = ?", (file_name,))
+
+    def _reindex(self, file_name):
+        self._delete(file_name)
+        try:
+            messages = chat_store.read_messages(os.path.join(self.history_dir, file_name))
+        except (OSError, UnicodeDecodeError):
+            return
+        self._insert(file_name, 0, messages)
+
+    def _optimize(self):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM terms WHERE df <= 0")
+            self._term_ids.clear()
+            self._db.execute("VACUUM")
+
+    def _term_id(self, term):
+        """Id of ``term``, created if new (call with the lock held, inside a transaction)."""
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            row = self._db.execute("SELECT id FROM terms WHERE term = ?", (term,)).fetchone()
+            if row:
+                term_id = row[0]
+            else:
+                term_id = self._db.execute("INSERT INTO terms (term, df) VALUES (?, 0)", (term,)).lastrowid
+            self._term_ids[term] = term_id
+        return term_id
+
+
+def _marks(values):
+    return ", ".join("?" * len(values))
+
+
+def _contains(tokens, phrase):
+    size = len(phrase)
+    return any(tokens[i:i + size] == phrase for i in range(len(tokens) - size + 1))
+
+
+def snippet(text, words, prefixes=(), size=SNIPPET_WORDS):
+    """Up to ``size`` words of ``text`` around the first match, with matches highlighted."""
+    spans = list(_WORD.finditer(text))
+    if not spans:
+        return text[:200]
+
+    def matches(span):
+        token = normalize(span.group())
+        return token in words or any(token.startswith(prefix) for prefix in prefixes)
+
+    first = next((i for i, span in enumerate(spans) if matches(span)), 0)
+    begin = max(0, first - size // 4)
+    end = min(len(spans), begin + size)
+    parts = ["…" if begin else ""]
+    position = spans[begin].start()
+    for span in spans[begin:end]:
+        parts.append(text[position:span.start()])
+        parts.append(f"{HIGHLIGHT[0]}{span.group()}{HIGHLIGHT[1]}" if matches(span) else span.group())
+        position = span.end()
+    if end < len(spans):
+        parts.append("…")
+    else:
+        parts.append(text[position:])
+    return " ".join("".join(parts).split())
+
+
+def wait_idle():
+    """Block until every queued index update has been applied."""
+    _writer.submit(lambda: None).result()
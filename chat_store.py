@@ -0,0 +1,429 @@
+"""Append-only chat journal.
+
+Each chat session is a JSONL file: one header record followed by one record per
+message (role, message, timestamp, model). Saving a reply only appends the new
+messages, writes are batched by a background flusher, and fsyncs happen at most
+every FSYNC_INTERVAL seconds unless asked for. A crash can only tear the last
+line, which readers skip. The human-readable markdown is produced on demand by
+export_markdown / compact.
+
+Opening a session does not parse the whole file: load_index keeps a cached
+byte-offset index of message records (invalidated by mtime and size) so
+read_tail / read_range only touch the messages actually shown.
+"""
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+JOURNAL_EXT = ".jsonl"
+LEGACY_EXT = ".md"
+EXPORT_DIR = "exports"
+INDEX_DIR = ".index"
+
+# Seconds between background flushes of buffered records, and between fsyncs
+FLUSH_INTERVAL = 1.0
+FSYNC_INTERVAL = 5.0
+
+_journals = {}
+_journals_lock = threading.Lock()
+_flusher = None
+_compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-compact")
+
+
+class ChatJournal:
+    """Buffered appender for one session file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = []
+        self._lock = threading.Lock()
+        self._last_fsync = time.monotonic()
+        self._exists = os.path.exists(path)
+        self._needs_newline = self._exists and not _ends_with_newline(path)
+
+    @property
+    def is_new(self):
+        return not self._exists and not self._pending
+
+    def append(self, records):
+        """Buffer records; they reach disk on the next flush. Returns the bytes buffered."""
+        lines = [json.dumps(record, ensure_ascii=False) + "\n" for record in records]
+        with self._lock:
+            self._pending.extend(lines)
+        return sum(len(line.encode("utf-8")) for line in lines)
+
+    def flush(self, fsync=False):
+        """Write buffered records in one call; fsync when asked or when due."""
+        with self._lock:
+            if not self._pending:
+                return
+            data = "".join(self._pending)
+            self._pending = []
+            if self._needs_newline:
+                # Terminate a record torn by an earlier crash before appending
+                data = "\n" + data
+                self._needs_newline = False
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(data)
+                file.flush()
+                if fsync or time.monotonic() - self._last_fsync >= FSYNC_INTERVAL:
+                    os.fsync(file.fileno())
+                    self._last_fsync = time.monotonic()
+            self._exists = True
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        if file.tell() == 0:
+            return True
+        file.seek(-1, os.SEEK_END)
+        return file.read(1) == b"\n"
+
+
+def get_journal(path):
+    """Return the process-wide journal for ``path``."""
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = _journals[path] = ChatJournal(path)
+    _start_flusher()
+    return journal
+
+
+def append_messages(path, messages, model=None, emoji=None, sync=False):
+    """
+    Append new chat messages to a session journal.
+
+    Parameters:
+        path (str): Journal file path.
+        messages (list): Dicts with "role" and "message".
+        model (str): Model recorded on assistant messages.
+        emoji (str): Session emoji, stored in the header of a new journal.
+        sync (bool): Flush and fsync before returning instead of batching.
+
+    Returns:
+        int: Bytes appended to the journal.
+    """
+    journal = get_journal(path)
+    now = time.time()
+    records = []
+    if journal.is_new:
+        records.append({"session": emoji, "created": now})
+    for msg in messages:
+        record = {"role": msg["role"], "message": msg["message"], "timestamp": msg.get("timestamp", now)}
+        if msg["role"] == "assistant" and model:
+            record["model"] = msg.get("model", model)
+        records.append(record)
+    size = journal.append(records)
+    if sync:
+        journal.flush(fsync=True)
+    return size
+
+
+def flush_all(fsync=False):
+    """Flush every journal with buffered records."""
+    with _journals_lock:
+        journals = list(_journals.values())
+    for journal in journals:
+        try:
+            journal.flush(fsync=fsync)
+        except OSError:
+            pass
+
+
+def read_session(path):
+    """Return (emoji, messages) for a journal or a legacy markdown history."""
+    journal = _journals.get(path)
+    if journal is not None:
+        journal.flush()
+    if path.endswith(LEGACY_EXT):
+        return None, parse_markdown(path)
+    with open(path, "r", encoding="utf-8") as file:
+        return _parse_records(file)
+
+
+def _parse_records(lines):
+    emoji, messages = None, []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # torn trailing write
+        if "role" in record:
+            messages.append(record)
+        elif "session" in record:
+            emoji = record["session"]
+    return emoji, messages
+
+
+def read_messages(path):
+    return read_session(path)[1]
+
+
+def parse_markdown(path):
+    """Parse a history written in the old ``**Role:** message`` markdown format."""
+    messages = []
+    current_role = None
+    current_lines = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            for role in ("user", "assistant"):
+                marker = f"**{role.capitalize()}:**"
+                if line.startswith(marker):
+                    if current_role:
+                        messages.append({"role": current_role, "message": "".join(current_lines).strip()})
+                    current_role = role
+                    current_lines = [line[len(marker):].strip()]
+                    break
+            else:
+                current_lines.append(line)
+    if current_role:
+        messages.append({"role": current_role, "message": "".join(current_lines).strip()})
+    return messages
+
+
+def export_markdown(path, dest=None):
+    """Write the markdown rendering of a journal atomically; returns its path."""
+    emoji, messages = read_session(path)
+    if dest is None:
+        export_dir = os.path.join(os.path.dirname(path), EXPORT_DIR)
+        os.makedirs(export_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        dest = os.path.join(export_dir, stem + LEGACY_EXT)
+    tmp = dest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        file.write(f"# Chat Session {emoji or ''}\n\n")
+        for msg in messages:
+            file.write(f"**{msg['role'].capitalize()}:** {msg['message']}\n\n")
+    os.replace(tmp, dest)
+    return dest
+
+
+def compact(path):
+    """Rewrite a journal without torn records, then refresh its markdown export."""
+    if path.endswith(JOURNAL_EXT):
+        journal = get_journal(path)
+        with journal._lock:
+            tmp = path + ".tmp"
+            with open(path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+                for line in src:
+                    try:
+                        json.loads(line)
+                    except ValueError:
+                        continue
+                    dst.write(line if line.endswith("\n") else line + "\n")
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp, path)
+            journal._needs_newline = False
+        _remove_index(path)
+    return export_markdown(path)
+
+
+def compact_async(path):
+    """Run compact() on the background compactor; returns a Future."""
+    get_journal(path).flush()
+    return _compactor.submit(compact, path)
+
+
+def move(path, dest):
+    """Move a session file to ``dest`` (e.g. into another folder), dropping its journal and index."""
+    journal = _journals.get(path)
+    if journal is not None:
+        journal.flush()
+    with _journals_lock:
+        _journals.pop(path, None)
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    os.replace(path, dest)
+    _remove_index(path)
+
+
+def trim(path, keep):
+    """
+    Rewrite a journal with only its header and its last ``keep`` messages.
+
+    Returns:
+        tuple: (messages kept, new size in bytes)
+    """
+    journal = get_journal(path)
+    with journal._lock:
+        # Read under the journal lock, buffered records included, so no append lands in between
+        with open(path, "r", encoding="utf-8") as file:
+            emoji, messages = _parse_records(itertools.chain(file, journal._pending))
+        journal._pending = []
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            file.write(json.dumps({"session": emoji, "created": time.time()}, ensure_ascii=False) + "\n")
+            for record in messages[-keep:] if keep else []:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+        journal._needs_newline = False
+    _remove_index(path)
+    return min(len(messages), keep), os.path.getsize(path)
+
+
+def merge(paths, dest, emoji=None):
+    """
+    Append the messages of the journals ``paths`` to ``dest`` and delete them.
+
+    Each moved message records the file it came from under ``"source"``.
+
+    Returns:
+        tuple: (messages added, bytes added)
+    """
+    journal = get_journal(dest)
+    records = [{"session": emoji, "created": time.time()}] if journal.is_new else []
+    for path in paths:
+        source = os.path.splitext(os.path.basename(path))[0]
+        records.extend(dict(record, source=source) for record in read_session(path)[1])
+    added = sum(1 for record in records if "role" in record)
+    size = journal.append(records)
+    journal.flush(fsync=True)
+    for path in paths:
+        delete(path)
+    return added, size
+
+
+def delete(path):
+    """Delete a session file and forget its journal."""
+    with _journals_lock:
+        _journals.pop(path, None)
+    if os.path.exists(path):
+        os.remove(path)
+    _remove_index(path)
+
+
+def load_index(path):
+    """
+    Return the message offset index of a journal, rebuilding it if the file changed.
+
+    Returns:
+        dict: {"emoji", "offsets", "mtime", "size"} where offsets[i] is the byte
+        offset of message i.
+    """
+    journal = _journals.get(path)
+    if journal is not None:
+        journal.flush()
+    stat = os.stat(path)
+    index_path = _index_path(path)
+    try:
+        with open(index_path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+        if index["mtime"] == stat.st_mtime_ns and index["size"] == stat.st_size:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = {"emoji": None, "offsets": [], "mtime": stat.st_mtime_ns, "size": stat.st_size}
+    with open(path, "rb") as file:
+        position = 0
+        for line in file:
+            # Only complete lines count; a torn trailing write has no newline
+            if line.endswith(b"\n"):
+                if line.startswith(b'{"role"'):
+                    index["offsets"].append(position)
+                elif line.startswith(b'{"session"'):
+                    try:
+                        index["emoji"] = json.loads(line)["session"]
+                    except ValueError:
+                        pass
+            position += len(line)
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp = index_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(index, file)
+    os.replace(tmp, index_path)
+    return index
+
+
+def read_range(path, start, end, index=None):
+    """Return messages ``start`` to ``end`` (exclusive) of a journal."""
+    index = index or load_index(path)
+    offsets = index["offsets"]
+    end = min(end, len(offsets))
+    if start >= end:
+        return []
+    with open(path, "rb") as file:
+        file.seek(offsets[start])
+        data = file.read(offsets[end] - offsets[start]) if end < len(offsets) else file.read()
+    messages = []
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "role" in record:
+            messages.append(record)
+    return messages
+
+
+def read_tail(path, count, include=None):
+    """
+    Return (emoji, start, messages) for the last ``count`` messages of a journal.
+
+    With ``include``, reach further back if needed so message ``include`` is
+    loaded too (opening a chat at a search result).
+    """
+    index = load_index(path)
+    start = max(0, len(index["offsets"]) - count)
+    if include is not None:
+        start = max(0, min(start, include))
+    return index["emoji"], start, read_range(path, start, len(index["offsets"]), index)
+
+
+def _index_path(path):
+    return os.path.join(os.path.dirname(path), INDEX_DIR, os.path.basename(path) + ".json")
+
+
+def _remove_index(path):
+    try:
+        os.remove(_index_path(path))
+    except OSError:
+        pass
+
+
+def list_sessions(history_dir):
+    """Return the session file names (journals and legacy markdown) in ``history_dir``."""
+    return [
+        entry.name
+        for entry in os.scandir(history_dir)
+        if entry.is_file() and entry.name.endswith((JOURNAL_EXT, LEGACY_EXT))
+    ]
+
+
+def new_session_name(history_dir, emoji, first_prompt):
+    """Build a journal file name from the first prompt that does not collide."""
+    sanitized = "".join(c for c in first_prompt if c.isalnum() or c in (" ", "_", "-")).rstrip()
+    stem = f"{emoji}_{sanitized[:30].replace(' ', '_')}"
+    name = stem + JOURNAL_EXT
+    suffix = 2
+    while os.path.exists(os.path.join(history_dir, name)) or os.path.join(history_dir, name) in _journals:
+        name = f"{stem}_{suffix}{JOURNAL_EXT}"
+        suffix += 1
+    return name
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush_all()
+
+
+def _start_flusher():
+    global _flusher
+    if _flusher is None:
+        with _journals_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="chat-journal-flusher", daemon=True)
+                _flusher.start()
+
+
+atexit.register(flush_all, True)
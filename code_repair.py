@@ -0,0 +1,242 @@
+"""Bounded, parallel repair of generated code that fails to run.
+
+Each round asks the model for CANDIDATES corrected programs at once (with
+different temperatures so they differ; the scheduler lets all of them run
+side by side despite its per-user cap), runs every new candidate in the
+code_runner pool as soon as it arrives, and stops at the first one that exits
+cleanly. Candidates are deduplicated by the hash of their code, so the same
+fix is never executed twice. The search is bounded by MAX_ROUNDS and a
+wall-clock DEADLINE; every attempt is appended to LOG_FILE.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import code_runner
+import metrics
+import model_lifecycle
+import ollama_client
+import scheduler
+
+MAX_ROUNDS = 3
+CANDIDATES = 3
+DEADLINE = 180
+# Seconds to wait for killed runs to exit before their files are removed
+KILL_GRACE = 5
+LOG_FILE = os.path.join("logs", "repair.jsonl")
+
+# Most of the error is noise; the end of the traceback is what matters
+MAX_ERROR_CHARS = 4000
+
+_CODE_BLOCK = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", re.DOTALL)
+
+
+class RepairResult:
+    """Outcome of repair(): the accepted code and its RunResult, or the last failure."""
+
+    def __init__(self, code, result, rounds, generations, executions):
+        self.code = code
+        self.result = result
+        self.rounds = rounds
+        self.generations = generations
+        self.executions = executions
+
+    @property
+    def success(self):
+        return self.result is not None and self.result.ok
+
+
+def extract_code(text):
+    """Return the longest fenced code block of a reply, or the whole reply if it has none."""
+    blocks = _CODE_BLOCK.findall(text)
+    if blocks:
+        return max(blocks, key=len).strip() + "\n"
+    return text.strip() + "\n"
+
+
+def code_hash(code):
+    """Hash ignoring trailing whitespace, so cosmetic differences still count as duplicates."""
+    normalized = "\n".join(line.rstrip() for line in code.strip().splitlines())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def repair_prompt(request, code, error):
+    return (
+        f"The following Python program was written for this request:\n{request}\n\n"
+        f"```python\n{code}\n```\n\n"
+        f"Running it failed with:\n```\n{error[-MAX_ERROR_CHARS:]}\n```\n\n"
+        "Reply with the complete corrected program in a single ```python code block."
+    )
+
+
+def generate_candidate(model, prompt, temperature, user, cancelled, limit=None):
+    """
+    Ask ``model`` for one fix, waiting for a background slot in the scheduler.
+
+    ``limit`` is the number of candidates generated together, so none of them
+    waits behind the per-user cap.
+    """
+    settings = model_lifecycle.request_settings(model, prompt)
+    options = dict(settings["options"], temperature=temperature)
+    request_metrics = metrics.start_request(model, user=user, kind="repair")
+    final_chunk, status = None, "error"
+    try:
+        with scheduler.get_scheduler().slot(user, scheduler.BACKGROUND, cancelled=cancelled, limit=limit):
+            parts = []
+            stream = ollama_client.chat_stream(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                options=options,
+                keep_alive=settings["keep_alive"],
+                on_endpoint=request_metrics.admitted,
+            )
+            try:
+                for chunk in stream:
+                    if cancelled():
+                        status = "cancelled"
+                        return None
+                    token = chunk.get("message", {}).get("content", "")
+                    if token:
+                        request_metrics.token()
+                    parts.append(token)
+                    if chunk.get("done"):
+                        final_chunk = chunk
+            finally:
+                stream.close()
+        status = "done"
+    finally:
+        request_metrics.finish(final_chunk, status)
+    return extract_code("".join(parts))
+
+
+def log_attempt(entry, log_file=LOG_FILE):
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+    with open(log_file, "a", encoding="utf-8") as file:
+        file.write(json.dumps(dict(entry, time=time.time())) + "\n")
+
+
+def repair(request, code, error, model, user, rounds=MAX_ROUNDS, candidates=CANDIDATES,
+           deadline=DEADLINE, cwd=None, on_event=None, generate=generate_candidate):
+    """
+    Search for a fixed version of ``code`` that runs without error.
+
+    Parameters:
+        request (str): What the program was supposed to do.
+        code (str): The failing program.
+        error (str): Its stderr / kill reason.
+        model (str): Ollama model used for the fixes.
+        user (str): Scheduler user the generations are charged to.
+        on_event (callable): Called as on_event(message) from the calling
+            thread after every generation and run (for progress in the UI).
+        generate (callable): generate(model, prompt, temperature, user, cancelled, limit) -> code.
+
+    Returns:
+        RepairResult: ``success`` tells whether a candidate passed.
+    """
+    started = time.monotonic()
+    stop = threading.Event()
+    seen = {code_hash(code)}
+    generations = executions = 0
+    last_code, last_result = code, None
+    workdir = tempfile.mkdtemp(prefix="repair-")
+    notify = on_event or (lambda message: None)
+    running = []
+    pending = {}
+    round_number = 0
+
+    def remaining():
+        return deadline - (time.monotonic() - started)
+
+    def execute(candidate, digest):
+        path = os.path.join(workdir, f"{digest}.py")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(candidate)
+        execution = code_runner.start_script(
+            path, cwd=cwd, timeout=max(1.0, min(code_runner.WALL_TIMEOUT, remaining()))
+        )
+        running.append(execution)
+        if stop.is_set():
+            execution.kill("superseded")
+        return candidate, digest, execution.wait()
+
+    executor = ThreadPoolExecutor(max_workers=candidates * 2, thread_name_prefix="repair")
+    try:
+        for round_number in range(1, rounds + 1):
+            if remaining() <= 0:
+                notify("Repair deadline reached.")
+                break
+            prompt = repair_prompt(request, last_code, error)
+            running = []
+            pending = {
+                executor.submit(generate, model, prompt, 0.2 + 0.3 * i, user, stop.is_set, candidates): "generate"
+                for i in range(candidates)
+            }
+            winner = None
+            while pending and winner is None:
+                done, _ = wait(pending, timeout=max(0.0, remaining()), return_when=FIRST_COMPLETED)
+                if not done:
+                    notify("Repair deadline reached.")
+                    break
+                for future in done:
+                    kind = pending.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        log_attempt({"round": round_number, "stage": kind, "outcome": "error", "error": str(e)})
+                        notify(f"Round {round_number}: {kind} failed: {e}")
+                        continue
+                    if kind == "generate":
+                        generations += 1
+                        if not outcome:
+                            continue
+                        digest = code_hash(outcome)
+                        if digest in seen:
+                            log_attempt({"round": round_number, "hash": digest, "outcome": "duplicate"})
+                            notify(f"Round {round_number}: candidate {digest} is a duplicate, skipped")
+                            continue
+                        seen.add(digest)
+                        pending[executor.submit(execute, outcome, digest)] = "execute"
+                        continue
+
+                    candidate, digest, result = outcome
+                    executions += 1
+                    log_attempt({
+                        "round": round_number, "hash": digest, "outcome": "passed" if result.ok else "failed",
+                        "returncode": result.returncode, "killed": result.killed,
+                        "duration": round(result.duration, 3),
+                    })
+                    if result.ok and winner is None:
+                        winner = (candidate, result)
+                        notify(f"Round {round_number}: candidate {digest} passed in {result.duration:.1f}s")
+                    elif not result.ok:
+                        notify(f"Round {round_number}: candidate {digest} failed")
+                        if result.killed != "superseded":
+                            last_code, last_result = candidate, result
+                            error = result.stderr + (f"\nKilled: {result.killed}" if result.killed else "")
+            if winner is not None:
+                # Stop the candidates still generating or running
+                stop.set()
+                for execution in running:
+                    execution.kill("superseded")
+                return RepairResult(winner[0], winner[1], round_number, generations, executions)
+            if remaining() <= 0:
+                break
+        stop.set()
+        for execution in running:
+            execution.kill("superseded")
+        return RepairResult(last_code, last_result, round_number, generations, executions)
+    finally:
+        # Also reached when the caller is interrupted (Streamlit stopping the
+        # script): kill the runs and let them exit before removing their files
+        stop.set()
+        for execution in list(running):
+            execution.kill("superseded")
+        executor.shutdown(wait=False, cancel_futures=True)
+        wait([future for future, kind in pending.items() if kind == "execute"], timeout=KILL_GRACE)
+        shutil.rmtree(workdir, ignore_errors=True)
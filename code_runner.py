@@ -0,0 +1,371 @@
+"""Pre-warmed pool of Python processes for running generated code.
+
+Starting ``python script.py`` for every run pays for interpreter start-up and
+for importing numpy, pandas, matplotlib... before the user's code even begins.
+The pool keeps POOL_SIZE worker processes (code_runner_worker.py) that have
+already imported PRELOAD; each run is executed in a fresh fork of a warm
+worker, so it starts with those modules loaded but cannot affect later runs.
+Workers are replaced after MAX_RUNS runs. Scripts never run in the worker
+itself, so its memory does not grow with use; each RunResult reports the
+peak RSS of the child that ran the script.
+
+A run is an Execution: iterating it yields stdout/stderr lines as the script
+prints them. Every run is bounded by a wall-clock timeout (enforced here by
+killing the run's process group), and by CPU-time and address-space rlimits
+set in the child. A killed run keeps its partial output and records why it
+was killed.
+
+On platforms without fork/fd passing, runs fall back to a plain subprocess
+(wall-clock limit only, output shown when it exits).
+"""
+import json
+import os
+import queue
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+POOL_SIZE = int(os.environ.get("CODE_RUNNER_WORKERS", "2"))
+PRELOAD = os.environ.get("CODE_RUNNER_PRELOAD", "numpy,pandas,matplotlib.pyplot,scipy,sklearn").split(",")
+MAX_RUNS = 50
+START_TIMEOUT = 60
+
+# Per-run limits: wall-clock seconds, CPU seconds, address space beyond the
+# warm interpreter (bytes) and output kept per stream (bytes)
+WALL_TIMEOUT = float(os.environ.get("CODE_RUNNER_TIMEOUT", "60"))
+CPU_LIMIT = int(os.environ.get("CODE_RUNNER_CPU", "30"))
+MEMORY_LIMIT = int(os.environ.get("CODE_RUNNER_MEMORY_MB", "2048")) * 1024 * 1024
+MAX_OUTPUT = 10 * 1024 * 1024
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "code_runner_worker.py")
+MAX_MESSAGE = 65536
+
+STDOUT, STDERR = "stdout", "stderr"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class RunResult:
+    """
+    Output and exit status of one run; ``killed`` names the limit that stopped
+    it, if any, and ``peak_rss`` is the script's peak memory in bytes (None
+    when unknown, as in the subprocess fallback).
+    """
+
+    def __init__(self, stdout, stderr, returncode, killed=None, duration=0.0, peak_rss=None):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.killed = killed
+        self.duration = duration
+        self.peak_rss = peak_rss
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.killed is None
+
+
+class Execution:
+    """
+    A running script. Iterate to get ``(stream, line)`` pairs as they are
+    printed; ``result`` is set once iteration is over.
+
+    ``kill()`` stops the run from another thread.
+    """
+
+    def __init__(self, stdout_fd, stderr_fd, pid, wait, timeout=WALL_TIMEOUT,
+                 cpu_limit=CPU_LIMIT, max_output=MAX_OUTPUT, on_finish=None):
+        self.pid = pid
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.max_output = max_output
+        self.result = None
+        self.killed = None
+        self._fds = {stdout_fd: STDOUT, stderr_fd: STDERR}
+        self._wait = wait
+        self._on_finish = on_finish
+        self._output = {STDOUT: [], STDERR: []}
+        self._sizes = {STDOUT: 0, STDERR: 0}
+        self._drained = False
+        self._started = time.monotonic()
+
+    def __iter__(self):
+        deadline = None if self.timeout is None else self._started + self.timeout
+        partial = {STDOUT: b"", STDERR: b""}
+        try:
+            with selectors.DefaultSelector() as selector:
+                for fd in self._fds:
+                    selector.register(fd, selectors.EVENT_READ)
+                open_fds = len(self._fds)
+                while open_fds:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.kill(f"wall-clock limit ({self.timeout:g}s)")
+                        deadline = None
+                    for key, _ in selector.select(remaining if remaining and remaining > 0 else None):
+                        stream = self._fds[key.fd]
+                        data = os.read(key.fd, 65536)
+                        if not data:
+                            selector.unregister(key.fd)
+                            open_fds -= 1
+                            if partial[stream]:
+                                yield from self._emit(stream, partial[stream])
+                                partial[stream] = b""
+                            continue
+                        *lines, partial[stream] = (partial[stream] + data).split(b"\n")
+                        for line in lines:
+                            yield from self._emit(stream, line + b"\n")
+            self._drained = True
+        finally:
+            self._finish()
+
+    def kill(self, reason="killed"):
+        """Kill the run and everything it started."""
+        if self.killed is None:
+            self.killed = reason
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def wait(self):
+        """Run to completion without looking at the lines; return the RunResult."""
+        for _ in self:
+            pass
+        return self.result
+
+    def _emit(self, stream, data):
+        if self._sizes[stream] < self.max_output:
+            self._output[stream].append(data)
+            self._sizes[stream] += len(data)
+            yield stream, data.decode("utf-8", errors="replace")
+        elif self.killed is None:
+            self.kill(f"output limit ({self.max_output} bytes of {stream})")
+
+    def _finish(self):
+        if self.result is not None:
+            return
+        if not self._drained:
+            # Iteration was abandoned early: stop the run before collecting it
+            self.kill()
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        returncode, peak_rss = self._wait()
+        stdout = b"".join(self._output[STDOUT]).decode("utf-8", errors="replace")
+        stderr = b"".join(self._output[STDERR]).decode("utf-8", errors="replace")
+        killed = self.killed
+        if killed is None and returncode in (-signal.SIGXCPU, -signal.SIGKILL) and self.cpu_limit:
+            killed = f"CPU time limit ({self.cpu_limit}s)"
+        elif killed is None and "MemoryError" in stderr[-2000:]:
+            killed = "memory limit"
+        self.result = RunResult(stdout, stderr, returncode, killed, time.monotonic() - self._started, peak_rss)
+        if self._on_finish is not None:
+            self._on_finish(self)
+
+
+class CompletedExecution:
+    """Execution-like wrapper for the plain-subprocess fallback: the run is already over."""
+
+    def __init__(self, result):
+        self.result = result
+        self.killed = result.killed
+
+    def __iter__(self):
+        for stream, text in ((STDOUT, self.result.stdout), (STDERR, self.result.stderr)):
+            for line in text.splitlines(keepends=True):
+                yield stream, line
+
+    def kill(self, reason="killed"):
+        pass
+
+    def wait(self):
+        return self.result
+
+
+class Worker:
+    """One warm interpreter and the socket used to drive it."""
+
+    def __init__(self, preload=PRELOAD):
+        kind = getattr(socket, "SOCK_SEQPACKET", socket.SOCK_DGRAM)
+        self.channel, remote = socket.socketpair(socket.AF_UNIX, kind)
+        env = dict(os.environ, CODE_RUNNER_PRELOAD=",".join(preload))
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, str(remote.fileno())],
+            pass_fds=(remote.fileno(),),
+            stdin=subprocess.DEVNULL,
+            env=env,
+        )
+        remote.close()
+        self.runs = 0
+        self.ready = False
+
+    def wait_ready(self, timeout=START_TIMEOUT):
+        """Block until the worker has finished preloading."""
+        if not self.ready:
+            self.channel.settimeout(timeout)
+            try:
+                self._receive()
+            finally:
+                self.channel.settimeout(None)
+            self.ready = True
+
+    def start(self, path, cwd=None, argv=None, timeout=WALL_TIMEOUT, cpu_limit=CPU_LIMIT,
+              memory_limit=MEMORY_LIMIT, on_finish=None):
+        """Start ``path`` in a fork of this worker and return its Execution."""
+        self.wait_ready()
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        try:
+            request = {
+                "path": os.path.abspath(path), "cwd": cwd, "argv": argv,
+                "cpu_limit": cpu_limit, "memory_limit": memory_limit,
+            }
+            socket.send_fds(self.channel, [json.dumps(request).encode()], [stdout_w, stderr_w])
+            self.runs += 1
+            pid = self._receive()["started"]
+        except BaseException:
+            os.close(stdout_r)
+            os.close(stderr_r)
+            raise
+        finally:
+            os.close(stdout_w)
+            os.close(stderr_w)
+        return Execution(
+            stdout_r, stderr_r, pid, self._wait_finished,
+            timeout=timeout, cpu_limit=cpu_limit, on_finish=on_finish,
+        )
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        try:
+            self.channel.close()
+        finally:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def _wait_finished(self):
+        finished = self._receive()
+        return finished["returncode"], finished.get("rss")
+
+    def _receive(self):
+        data = self.channel.recv(MAX_MESSAGE)
+        if not data:
+            raise RuntimeError(f"Code runner worker exited (status {self.process.poll()})")
+        return json.loads(data)
+
+
+class WorkerPool:
+    """Fixed-size pool of warm workers; each run borrows one."""
+
+    def __init__(self, size=POOL_SIZE, preload=PRELOAD, max_runs=MAX_RUNS):
+        self.size = size
+        self.preload = preload
+        self.max_runs = max_runs
+        self._idle = queue.Queue()
+        self.stats = {"runs": 0, "recycled": 0, "failed": 0, "killed": 0}
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.put(Worker(preload))
+
+    def start(self, path, cwd=None, argv=None, **limits):
+        """
+        Start a script in a warm worker (blocks until one is free) and return its Execution.
+
+        ``limits`` are passed to Worker.start (timeout, cpu_limit, memory_limit).
+        The worker goes back to the pool when the Execution finishes.
+        """
+        worker = self._idle.get()
+
+        def finished(execution):
+            with self._lock:
+                self.stats["runs"] += 1
+                if execution.result.killed:
+                    self.stats["killed"] += 1
+            self._checkin(worker)
+
+        try:
+            return worker.start(path, cwd=cwd, argv=argv, on_finish=finished, **limits)
+        except Exception:
+            with self._lock:
+                self.stats["failed"] += 1
+            self._replace(worker)
+            raise
+
+    def run(self, path, cwd=None, argv=None, **limits):
+        """Run a script to completion and return its RunResult."""
+        return self.start(path, cwd=cwd, argv=argv, **limits).wait()
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().close()
+
+    def _checkin(self, worker):
+        if worker.runs >= self.max_runs or not worker.alive:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+
+    def _replace(self, worker):
+        with self._lock:
+            self.stats["recycled"] += 1
+        threading.Thread(target=worker.close, daemon=True).start()
+        self._idle.put(Worker(self.preload))
+
+
+def supported():
+    return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+
+def get_pool():
+    """Return the process-wide WorkerPool (workers start preloading immediately)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool()
+    return _pool
+
+
+def start_script(path, cwd=None, timeout=WALL_TIMEOUT, cpu_limit=CPU_LIMIT, memory_limit=MEMORY_LIMIT):
+    """Start a Python script under the run limits and return its Execution, in a warm worker when possible."""
+    if supported():
+        return get_pool().start(path, cwd=cwd, timeout=timeout, cpu_limit=cpu_limit, memory_limit=memory_limit)
+
+    started = time.monotonic()
+    try:
+        completed = subprocess.run(
+            [sys.executable, path], cwd=cwd, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout,
+        )
+        result = RunResult(completed.stdout, completed.stderr, completed.returncode)
+    except subprocess.TimeoutExpired as e:
+        result = RunResult(
+            _text(e.stdout), _text(e.stderr), -signal.SIGTERM, f"wall-clock limit ({timeout:g}s)"
+        )
+    result.duration = time.monotonic() - started
+    return CompletedExecution(result)
+
+
+def run_script(path, cwd=None, **limits):
+    """Run a Python script to completion and return its RunResult."""
+    return start_script(path, cwd=cwd, **limits).wait()
+
+
+def _text(data):
+    if isinstance(data, bytes):
+        return data.decode("utf-8", errors="replace")
+    return data or ""
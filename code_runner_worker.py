@@ -0,0 +1,136 @@
+"""Warm worker process for code_runner.
+
+Started by code_runner.WorkerPool with one end of a Unix socket pair as its
+only argument. It imports the heavy libraries listed in CODE_RUNNER_PRELOAD
+once, then serves run requests: each request carries the script path and the
+write ends of the caller's stdout/stderr pipes, and is executed in a freshly
+forked child so nothing a script does survives into the next run.
+
+Messages are single JSON datagrams:
+
+    caller -> worker   {"path": ..., "cwd": ..., "argv": [...],
+                        "cpu_limit": seconds, "memory_limit": bytes}  + fds [stdout, stderr]
+    worker -> caller   {"ready": true, "pid": ...}               once preloading is done
+                       {"started": child_pid}                    when the child is forked
+                       {"returncode": ..., "rss": ...}           when the child has exited
+                                                                 (rss: the child's peak, in bytes)
+"""
+import importlib
+import json
+import os
+import resource
+import runpy
+import socket
+import sys
+import traceback
+
+MAX_MESSAGE = 65536
+
+
+def preload(modules):
+    """Import ``modules`` (missing ones are skipped) so forked children inherit them."""
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception:
+            pass
+    return loaded
+
+
+def apply_limits(cpu_limit=None, memory_limit=None):
+    """
+    Set the child's rlimits. The memory limit is address space on top of what
+    the warm interpreter already maps, so preloaded libraries do not count.
+    """
+    if cpu_limit:
+        # SIGXCPU at the soft limit, SIGKILL one second later
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit + 1))
+    if memory_limit:
+        try:
+            with open("/proc/self/statm") as statm:
+                mapped = int(statm.read().split()[0]) * resource.getpagesize()
+        except OSError:
+            mapped = 0
+        resource.setrlimit(resource.RLIMIT_AS, (mapped + memory_limit, mapped + memory_limit))
+
+
+def run_child(request, stdout_fd, stderr_fd, channel):
+    """Body of the forked child: redirect output, run the script, exit with its status."""
+    channel.close()
+    os.setsid()
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    os.close(stdout_fd)
+    os.close(stderr_fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    # Unbuffered line output, as `python script.py` writing to a pipe with -u
+    sys.stdout = os.fdopen(1, "w", buffering=1, closefd=False)
+    sys.stderr = os.fdopen(2, "w", buffering=1, closefd=False)
+
+    status = 0
+    try:
+        apply_limits(request.get("cpu_limit"), request.get("memory_limit"))
+        if request.get("cwd"):
+            os.chdir(request["cwd"])
+        sys.argv = request.get("argv") or [request["path"]]
+        sys.path[0] = os.path.dirname(os.path.abspath(request["path"]))
+        runpy.run_path(request["path"], run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    finally:
+        os._exit(status)
+
+
+def serve(channel):
+    while True:
+        try:
+            data, fds, _, _ = socket.recv_fds(channel, MAX_MESSAGE, 2)
+        except OSError:
+            return
+        if not data:
+            # The pool closed its end: shut down
+            return
+        request = json.loads(data)
+        stdout_fd, stderr_fd = fds
+        pid = os.fork()
+        if pid == 0:
+            run_child(request, stdout_fd, stderr_fd, channel)
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        channel.send(json.dumps({"started": pid}).encode())
+        _, status, usage = os.wait4(pid, 0)
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        # The script ran in the child; this process itself stays at its warm size
+        channel.send(json.dumps({"returncode": returncode, "rss": usage.ru_maxrss * 1024}).encode())
+
+
+def main():
+    channel = socket.socket(fileno=int(sys.argv[1]))
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    modules = [m for m in os.environ.get("CODE_RUNNER_PRELOAD", "").split(",") if m]
+    loaded = preload(modules)
+    channel.send(json.dumps({"ready": True, "pid": os.getpid(), "preloaded": loaded}).encode())
+    serve(channel)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Conversation history for prompts, within a token budget.
+
+When there is no reusable KV ``context`` (a reopened chat, a regenerated
+answer, a cache replay), or the reusable one has grown past the budget, the
+prompt carries the history as text instead:
+
+    Summary of the earlier conversation:
+    <rolling summary>
+
+    Recent conversation:
+    User: ...
+    Assistant: ...
+
+The recent turns are taken newest first until the model's history budget is
+spent: ``"history_tokens"`` of its config.json entry (DEFAULT_HISTORY_TOKENS),
+never more than num_ctx leaves after the prompt and the reply. Token counts
+are cached per message in the session (``token_counts``); estimates are
+replaced by Ollama's exact eval_count when a reply finishes.
+
+Turns that fall out of the window are folded into a rolling summary by a
+small model (``"summary_model"``, by default the chat model itself) on a
+background thread after each reply, so no request ever waits on it; a
+request just uses the newest summary that is ready. Summaries are persisted
+beside the journal so a reopened chat keeps them.
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import chat_store
+import metrics
+import model_lifecycle
+import ollama_client
+import scheduler
+
+SUMMARY_DIR = ".summary"
+
+DEFAULT_HISTORY_TOKENS = 4096
+# Part of the budget kept for the summary, and the most the summarizer may write
+SUMMARY_TOKENS = 512
+# Transcript fed to the summarizer per update (newest messages first)
+SUMMARY_INPUT_TOKENS = 3072
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for someone who will continue it. Keep the topic, "
+    "decisions, names, numbers and open questions; drop pleasantries. At most {words} words.\n\n"
+    "{previous}"
+    "Conversation:\n{transcript}\n\nSummary:"
+)
+
+ROLES = {"user": "User", "assistant": "Assistant"}
+
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+_jobs = {}
+_jobs_lock = threading.Lock()
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary-writer")
+
+
+def history_budget(model, prompt_tokens=0):
+    """Tokens of history ``model`` may get with a prompt of ``prompt_tokens``."""
+    settings = model_lifecycle.model_settings(model)
+    cap = settings.get("history_tokens", DEFAULT_HISTORY_TOKENS)
+    room = settings.get("num_ctx", model_lifecycle.DEFAULT_NUM_CTX) - model_lifecycle.RESPONSE_RESERVE - prompt_tokens
+    return max(0, min(cap, room))
+
+
+def message_tokens(session, index, message):
+    """Token count of message ``index`` (absolute position in the chat), cached in the session."""
+    counts = session.setdefault("token_counts", {})
+    text = message["message"]
+    cached = counts.get(index)
+    if cached is not None and cached[0] == len(text):
+        return cached[1]
+    tokens = model_lifecycle.estimate_tokens(f"{ROLES.get(message['role'], message['role'])}: {text}")
+    counts[index] = (len(text), tokens)
+    return tokens
+
+
+def record_tokens(session, index, message, eval_count):
+    """Replace the estimate for a finished reply with Ollama's exact count."""
+    if eval_count:
+        session.setdefault("token_counts", {})[index] = (len(message["message"]), eval_count)
+
+
+def window(session, budget, upto=None):
+    """
+    Newest loaded messages that fit in ``budget`` tokens.
+
+    Returns:
+        tuple: (absolute index of the first message, messages, tokens).
+    """
+    history = session.get("chat_history", [])
+    upto = len(history) if upto is None else upto
+    offset = session.get("history_start", 0)
+    taken, tokens = [], 0
+    for i in range(upto - 1, -1, -1):
+        cost = message_tokens(session, offset + i, history[i])
+        if tokens + cost > budget:
+            break
+        taken.append(history[i])
+        tokens += cost
+    taken.reverse()
+    return offset + upto - len(taken), taken, tokens
+
+
+def build(session, model, prompt_tokens=0):
+    """
+    History text to put before the prompt of the latest user message (the last one in the chat).
+
+    Returns:
+        tuple: (text, tokens); ("", 0) when there is no earlier conversation.
+    """
+    adopt(session)
+    budget = history_budget(model, prompt_tokens)
+    start, recent, tokens = window(session, max(0, budget - SUMMARY_TOKENS),
+                                   upto=len(session.get("chat_history", [])) - 1)
+    parts = []
+    summary = session.get("history_summary")
+    if summary and start > 0:
+        parts.append(f"Summary of the earlier conversation:\n{summary['text']}")
+        tokens += summary["tokens"]
+    if recent:
+        parts.append("Recent conversation:\n" + transcript(recent))
+    if not parts:
+        return "", 0
+    return "\n\n".join(parts) + "\n\nUser: ", tokens
+
+
+def transcript(messages):
+    return "\n".join(f"{ROLES.get(msg['role'], msg['role'])}: {msg['message']}" for msg in messages)
+
+
+def summarize_in_background(session, model, file_path, user=None):
+    """
+    After a reply: fold the turns that no longer fit the window into the summary.
+
+    Does nothing while an update for this session is already running or when
+    the summary already reaches the window.
+    """
+    adopt(session)
+    summary_model = model_lifecycle.model_settings(model).get("summary_model", model)
+    start, _, _ = window(session, max(0, history_budget(model) - SUMMARY_TOKENS))
+    summary = session.get("history_summary") or {}
+    covers = summary.get("covers", 0)
+    if start <= covers or not session.get("current_chat_file"):
+        return None
+    key = session.get("session_key")
+    with _jobs_lock:
+        if key in _jobs:
+            return None
+        _jobs[key] = future = _summarizer.submit(
+            _summarize, summary_model, file_path, session["current_chat_file"], summary.get("text"), covers,
+            start, user,
+        )
+    return future
+
+
+def adopt(session):
+    """Take over a finished background summary for the open chat."""
+    key = session.get("session_key")
+    with _jobs_lock:
+        future = _jobs.get(key)
+        if future is None or not future.done():
+            return
+        del _jobs[key]
+    try:
+        entry = future.result()
+    except Exception:
+        return
+    current = session.get("history_summary") or {}
+    if entry and entry["file"] == session.get("current_chat_file") and entry["covers"] > current.get("covers", 0):
+        session["history_summary"] = entry
+
+
+def load(session, file_path):
+    """Restore the persisted summary of a chat that was just opened."""
+    reset(session)
+    try:
+        with open(_summary_path(file_path), "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return
+    if entry.get("file") == os.path.basename(file_path):
+        session["history_summary"] = entry
+
+
+def reset(session):
+    """Forget the summary and token counts (new chat, another chat opened)."""
+    session["history_summary"] = None
+    session["token_counts"] = {}
+
+
+def discard(file_path):
+    """Remove the persisted summary of a deleted, trimmed or moved chat."""
+    _writer.submit(_remove, _summary_path(file_path))
+
+
+def _summarize(model, file_path, file_name, previous, covers, end, user):
+    # Fold the backlog in oldest-first chunks that fit, so covers only ever
+    # claims messages the summary was actually given
+    entry = None
+    while covers < end:
+        messages = chat_store.read_range(file_path, covers, end)
+        if not messages:
+            break
+        taken, tokens = [], 0
+        for msg in messages:
+            tokens += model_lifecycle.estimate_tokens(msg["message"])
+            if tokens > SUMMARY_INPUT_TOKENS and taken:
+                break
+            taken.append(msg)
+        text, final_chunk = _summary_request(model, previous, taken, user)
+        if not text:
+            break
+        covers += len(taken)
+        entry = {
+            "file": file_name, "covers": covers, "text": text,
+            "tokens": (final_chunk or {}).get("eval_count") or model_lifecycle.estimate_tokens(text),
+        }
+        _write(_summary_path(file_path), entry)
+        previous = text
+    return entry
+
+
+def _summary_request(model, previous, messages, user):
+    prompt = SUMMARY_PROMPT.format(
+        words=SUMMARY_TOKENS * 3 // 4,
+        previous=f"Summary so far:\n{previous}\n\n" if previous else "",
+        transcript=transcript(messages),
+    )
+    settings = model_lifecycle.request_settings(model, prompt)
+    payload = {
+        "model": model, "prompt": prompt, "stream": True, "keep_alive": settings["keep_alive"],
+        "options": dict(settings["options"], num_predict=SUMMARY_TOKENS, temperature=0.2),
+    }
+    request_metrics = metrics.start_request(model, user=user, kind="summary")
+    parts, final_chunk, status = [], None, "error"
+    try:
+        with scheduler.get_scheduler().slot(user, scheduler.BACKGROUND):
+            for chunk in ollama_client.stream("/api/generate", payload, on_endpoint=request_metrics.admitted):
+                token = chunk.get("response", "")
+                if token:
+                    request_metrics.token()
+                    parts.append(token)
+                if chunk.get("done"):
+                    final_chunk = chunk
+        status = "done"
+    finally:
+        request_metrics.finish(final_chunk, status)
+    return "".join(parts).strip(), final_chunk
+
+
+def _summary_path(file_path):
+    return os.path.join(os.path.dirname(file_path), SUMMARY_DIR, os.path.basename(file_path) + ".json")
+
+
+def _write(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(entry, file)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,89 @@
+"""Reuse of Ollama's KV ``context`` across chat turns.
+
+/api/generate returns the encoded conversation as ``context`` in its final
+chunk. Sending it back with the next prompt lets Ollama evaluate only the new
+tokens instead of re-encoding the whole history. The context is kept in the
+session state next to current_chat_file (and persisted beside the journal so
+a reopened chat can continue), tagged with the model and the number of
+messages it covers; any mismatch means the history changed and it is dropped.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+CONTEXT_DIR = ".context"
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-context")
+
+
+def message_total(session):
+    """Number of messages in the open chat, including ones not loaded yet."""
+    return session.get("history_start", 0) + len(session.get("chat_history", []))
+
+
+def current(session, model):
+    """
+    Return the context to send with the next prompt, or None.
+
+    Call after the new user message has been appended: a valid context covers
+    every message except that one.
+    """
+    entry = session.get("conversation_context")
+    if not entry or entry["model"] != model or entry["messages"] != message_total(session) - 1:
+        return None
+    return entry["context"]
+
+
+def update(session, model, final_chunk, file_path=None):
+    """Store the context from a finished generation's final chunk."""
+    context = (final_chunk or {}).get("context")
+    if not context:
+        invalidate(session, file_path)
+        return
+    entry = {"model": model, "context": context, "messages": message_total(session)}
+    session["conversation_context"] = entry
+    if file_path:
+        _writer.submit(_write, _context_path(file_path), entry)
+
+
+def invalidate(session, file_path=None):
+    """Forget the stored context (regenerate, model change, history edit)."""
+    session["conversation_context"] = None
+    if file_path:
+        _writer.submit(_remove, _context_path(file_path))
+
+
+def discard(file_path):
+    """Remove the persisted context of a deleted chat."""
+    _writer.submit(_remove, _context_path(file_path))
+
+
+def load(session, file_path):
+    """Restore the persisted context of a chat that was just opened, if still valid."""
+    session["conversation_context"] = None
+    try:
+        with open(_context_path(file_path), "r", encoding="utf-8") as file:
+            entry = json.load(file)
+    except (OSError, ValueError):
+        return
+    if entry.get("messages") == message_total(session):
+        session["conversation_context"] = entry
+
+
+def _context_path(file_path):
+    return os.path.join(os.path.dirname(file_path), CONTEXT_DIR, os.path.basename(file_path) + ".json")
+
+
+def _write(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(entry, file)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
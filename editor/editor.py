@@ -1,68 +1,205 @@
-import streamlit as st
-from ollama import chat
-import ollama
-import subprocess
-import io
-import sys
-import matplotlib.pyplot as plt
-import numpy as np
 import os
+import sys
+
+# Shared modules (ollama_client, ...) live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import startup
+
+timer = startup.RerunTimer("editor")
+
+import streamlit as st
+import time
+import uuid
+from concurrent import futures
+
+import code_runner
+import file_index
+import file_viewer
+import metrics
+import model_lifecycle
+import ollama_client
+import scheduler
+import single_flight
+
+# Only needed once a generated program fails
+code_repair = startup.lazy_import("code_repair")
+
+timer.mark("imports")
+
+CODE_MODEL = 'llama3.2'
+
+# Live execution console: seconds between redraws and lines kept on screen
+OUTPUT_REFRESH = 0.2
+OUTPUT_LINES = 200
+
+# File viewer: lines per page and bytes shown for binary files
+VIEWER_LINES = 200
+HEX_BYTES = 512
+
+# Each session runs its code from its own file here, never one shared between users
+RUNS_DIR = ".editor_runs"
 
 st.title("LLM Code Generator")
 
+startup.init_session_state(st.session_state, {"session_key": lambda: uuid.uuid4().hex})
+
 # Function to display file and folder structure in the sidebar
 def display_files_in_sidebar():
-    # Get the current directory
-    current_dir = os.getcwd()
+    # Listings come from a cached index of the current directory, refreshed only on change
+    index = file_index.get_index(os.getcwd())
 
     # Display the current directory and subfolders
     st.sidebar.title("File Explorer")
 
-    # List directories in the current folder
-    folders = [f for f in os.listdir(current_dir) if os.path.isdir(f)]
-    files = [f for f in os.listdir(current_dir) if os.path.isfile(f)]
-
-    # Display folder names in the sidebar
-    folder_selection = st.sidebar.selectbox("Select a folder:", ["None"] + folders)
-    
-    # Display file names in the sidebar based on the folder selection
-    if folder_selection != "None":
-        folder_path = os.path.join(current_dir, folder_selection)
-        files = os.listdir(folder_path)
-        file_selection = st.sidebar.selectbox("Select a file:", files)
-    else:
-        file_selection = st.sidebar.selectbox("Select a file:", files)
+    # Fuzzy search over the whole tree
+    query = st.sidebar.text_input("Filter files:", "")
+    if query:
+        matches = index.fuzzy_filter(query)
+        return st.sidebar.selectbox("Select a file:", matches)
 
-    return folder_selection, file_selection
+    # Browse one folder at a time, descending as deep as needed
+    current = st.session_state.setdefault("explorer_dir", "")
+    entries = index.list_dir(current)
+    folders = [e.name for e in entries if e.is_dir]
+    files = [e.name for e in entries if not e.is_dir]
+
+    st.sidebar.caption(f"📁 ./{current}")
+    parent = [".."] if current else []
+    st.sidebar.selectbox("Select a folder:", ["None"] + parent + folders, key="explorer_folder", on_change=open_folder)
+
+    # Display file names in the sidebar for the open folder
+    file_selection = st.sidebar.selectbox("Select a file:", files)
+    return os.path.join(current, file_selection) if file_selection else None
+
+def open_folder():
+    # on_change of the folder selectbox: move into the chosen folder (or up)
+    choice = st.session_state.explorer_folder
+    current = st.session_state.get("explorer_dir", "")
+    if choice == "..":
+        st.session_state.explorer_dir = os.path.dirname(current)
+    elif choice != "None":
+        st.session_state.explorer_dir = os.path.join(current, choice)
+    st.session_state.explorer_folder = "None"
 
 # Function to display file content in a container
 def display_file_content(file_path):
-    with open(file_path, "r") as file:
-        file_content = file.read()
-        st.text_area("File Content", file_content, height=300)
+    # Only a window of the file is read (memory-mapped), whatever its size
+    try:
+        size = os.path.getsize(file_path)
+        binary = file_viewer.is_binary(file_path)
+    except OSError as e:
+        st.error(f"Cannot open {file_path}: {e}")
+        return
 
+    if binary:
+        st.caption(f"Binary file, {file_viewer.format_size(size)}")
+        st.code(file_viewer.hex_dump(file_path, length=HEX_BYTES), language="text")
+        return
 
-# Function to save the code to a file and execute it using subprocess
-def save_and_execute_code_with_subprocess(code_filename):
-    # Run the code using subprocess and capture output
-    result = subprocess.run(
-        ['python', code_filename],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    index = file_viewer.get_index(file_path)
+    columns = st.columns([2, 1])
+    tail = columns[1].checkbox("Tail", value=file_path.endswith(".log") or file_path.endswith("error.txt"),
+                               key=f"tail:{file_path}")
+    if tail:
+        lines = file_viewer.tail(file_path, VIEWER_LINES)
+        first = max(0, index.lines - len(lines))
+    else:
+        # Type a line number to seek; the +/- buttons page by VIEWER_LINES
+        start = columns[0].number_input(
+            "Start at line", min_value=1, max_value=max(1, index.lines), value=1, step=VIEWER_LINES,
+            key=f"line:{file_path}",
+        )
+        first = start - 1
+        lines = index.read_lines(first, VIEWER_LINES)
+    st.caption(
+        f"Lines {first + 1 if lines else 0}-{first + len(lines)} of {index.lines}, "
+        f"{file_viewer.format_size(size)}"
     )
-    
+    st.text_area("File Content", "\n".join(lines), height=300)
+
+
+# Function to execute the saved code in a pre-warmed Python worker
+def save_and_execute_code_with_subprocess(code_filename):
+    # Run the code in a fork of a worker that already imported numpy, matplotlib, ...
+    # under the wall-clock / CPU / memory limits of code_runner
+    execution = code_runner.start_script(code_filename)
+
+    # Stream stdout and stderr into the page as the program prints them
+    console = st.empty()
+    lines = []
+    last_render = 0.0
+    for stream, line in execution:
+        lines.append(line)
+        if time.monotonic() - last_render > OUTPUT_REFRESH:
+            console.code("".join(lines[-OUTPUT_LINES:]), language="text")
+            last_render = time.monotonic()
+    console.code("".join(lines[-OUTPUT_LINES:]), language="text")
+
+    result = execution.result
+    error = result.stderr
+    if result.killed:
+        st.warning(f"Execution stopped: {result.killed} (partial output shown)")
+        error += f"\nKilled: {result.killed}"
+
     # Return the standard output and error output
-    return result.stdout, result.stderr
+    return result.stdout, error
 
-def code_gen(user_input):
+def code_gen(user_input, priority=scheduler.INTERACTIVE):
     # if st.button("Generate Code"):
-    with st.spinner("Generating code..."):
+    # Generate once per session, model and prompt: reruns wait on the request
+    # already in flight, or reuse its result, instead of generating again
+    user = st.session_state.get("current_user") or st.session_state.session_key
+    progress = st.session_state.setdefault("generation_progress", {})
+    key = (st.session_state.session_key, CODE_MODEL, user_input)
+    future = single_flight.get_flight("code_gen").submit(
+        key, _generate_code, user_input, user, priority, progress
+    )
+    if not future.done():
+        status = st.empty()
+        with st.spinner("Generating code..."):
+            while not futures.wait([future], timeout=0.5).done:
+                ticket = progress.get("ticket")
+                if ticket is not None and not ticket.granted:
+                    status.info(f"⏳ Queued, position {scheduler.get_scheduler().position(ticket)}…")
+                else:
+                    status.empty()
+        status.empty()
+    try:
+        code = future.result()
+    except scheduler.SchedulerFull as e:
+        st.error(f"{e}. Please try again in a moment.")
+        return ""
+    except Exception as e:
+        st.error(f"Error generating code: {e}")
+        return ""
+
+    # Display the generated code
+    st.subheader("Generated Python Code:")
+    st.code(code, language='python')
+
+    # Keep the code to run in the session once per generation, so a repaired version is not overwritten on rerun
+    if st.session_state.get("editor_code_key") != key:
+        st.session_state.editor_code = code
+        st.session_state.editor_code_key = key
+
+    return code
+
+def _generate_code(user_input, user, priority, progress):
+    # Runs in a single_flight worker thread: no Streamlit calls in here
+    request_metrics = metrics.start_request(CODE_MODEL, user=user, kind="chat")
+    ticket, final_chunk, status = None, None, "error"
+    try:
+        # Inside the try, so a SchedulerFull still finishes the request's metrics
+        ticket = progress["ticket"] = scheduler.get_scheduler().submit(user, priority)
+        ticket.wait()
         # Get the code from Ollama
-        stream = chat(
-            model='llama3.2',
+        settings = model_lifecycle.request_settings(CODE_MODEL, user_input)
+        stream = ollama_client.chat_stream(
+            model=CODE_MODEL,
             messages=[{'role': 'tool', 'content': user_input}],
-            stream=True,  # True to get the response in chunks
+            options=settings["options"],
+            keep_alive=settings["keep_alive"],
+            on_endpoint=request_metrics.admitted,
         )
 
         # Initialize an empty string to store the code
@@ -70,63 +207,100 @@ def code_gen(user_input):
 
         # Loop through the stream chunks and accumulate the code
         for chunk in stream:
+            if chunk['message']['content']:
+                request_metrics.token()
             code += chunk['message']['content']  # Append the chunk to 'code'
-
-        # Display the generated code
-        st.subheader("Generated Python Code:")
-        st.code(code, language='python')
-
-        # Save the generated code to a file (optional for debugging)
-        with open("template.py", "w") as f:
-            f.write(code)
-        
+            if chunk.get("done"):
+                final_chunk = chunk
+        status = "done"
         return code
+    finally:
+        if ticket is not None:
+            scheduler.get_scheduler().release(ticket)
+        request_metrics.finish(final_chunk, status)
 
 def code_exec(user_input):
-    code = code_gen(user_input)
+    if not code_gen(user_input):
+        return
     # Button to execute the code
     if st.button("Execute Code"):
         with st.spinner("Executing code..."):
-            # Execute the code using subprocess and capture the output
-            output, error = save_and_execute_code_with_subprocess("template.py")
-            # print(output)
-            
-            # Show the text-based output (stdout)
+            # Execute the code, showing its output (stdout and stderr) as it runs
             st.subheader("Execution Output:")
-            st.write(output)
+            path = os.path.join(RUNS_DIR, f"{st.session_state.session_key}.py")
+            os.makedirs(RUNS_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                f.write(st.session_state.editor_code)
+            try:
+                output, error = save_and_execute_code_with_subprocess(path)
+            finally:
+                os.remove(path)
 
             # Show any errors (stderr)
             if error:
                 st.subheader("Error Output:")
-                os.mkdir("logs")
+                os.makedirs("logs", exist_ok=True)
                 with open("logs/error.txt", "w") as f:
                     f.write(error)
                 st.text(error)
-                while True:
-                    code_exec(user_input+ "Debug:"+ error)
-                    output, error = save_and_execute_code_with_subprocess("template.py")
-                    st.subheader("Execution Output:")
-                    st.write(output)
-            
-                
+                repair_code(user_input, st.session_state.editor_code, error)
+
+def repair_code(user_input, code, error):
+    # Look for a working fix: a few rounds of parallel candidates, within a deadline
+    user = st.session_state.get("current_user") or st.session_state.session_key
+    with st.status("Repairing code...", expanded=True) as status:
+        outcome = code_repair.repair(
+            user_input, code, error, model=CODE_MODEL, user=user, cwd=os.getcwd(), on_event=status.write
+        )
+        summary = (
+            f"{outcome.generations} candidates generated, {outcome.executions} executed "
+            f"in {outcome.rounds} round(s)"
+        )
+        if outcome.success:
+            status.update(label=f"Repaired: {summary}", state="complete")
+        else:
+            status.update(label=f"No working fix: {summary}", state="error")
+
+    if outcome.success:
+        st.subheader("Repaired Python Code:")
+        st.code(outcome.code, language='python')
+        st.session_state.editor_code = outcome.code
+        st.subheader("Execution Output:")
+        st.code(outcome.result.stdout, language="text")
+    return outcome
+
+
 def main():
     # Sidebar file explorer
-    folder, selected_file = display_files_in_sidebar()
+    file_path = display_files_in_sidebar()
+    with st.sidebar.expander("📊 Generation metrics"):
+        st.caption(metrics.format_summary(metrics.summary()))
 
     # Show the selected file path in the main window
-    if selected_file:
-        file_path = os.path.join(folder if folder != "None" else "", selected_file)
+    if file_path:
         st.write(f"Selected file: {file_path}")
         display_file_content(file_path)
         
+    # chat_input only returns the prompt on the rerun it was submitted in;
+    # keep it so "Execute Code" (another rerun) works on the same generation
     user_input = st.chat_input("Enter a prompt for the LLM:")
-    code = code_gen(user_input)
-    code_exec(user_input)
+    if user_input:
+        st.session_state.editor_prompt = user_input
+    prompt = st.session_state.get("editor_prompt")
+    if prompt:
+        code_exec(prompt)
 
 
 
 if __name__=="__main__":
+    startup.run_once("warm_up", model_lifecycle.warm_up_configured)
+    startup.run_once("metrics_server", metrics.start_http_server)
+    if code_runner.supported():
+        startup.run_once("code_runner_pool", code_runner.get_pool)
+    timer.mark("setup")
     main()
+    timer.mark("page")
+    startup.render_report(st, "editor", timer)
 
 
 
@@ -0,0 +1,193 @@
+"""Load-balanced pool of Ollama endpoints from config.json.
+
+Every entry of the ``"apis"`` section of config.json (see gen_config.py) is one
+Ollama instance. Requests go to the healthy endpoint with the fewest
+outstanding requests, never exceeding its ``max_concurrency``. An affinity key
+(the chat session) keeps a conversation on the instance that already holds its
+KV cache. A background thread probes every endpoint; endpoints that fail a
+probe or a request are ejected until a probe succeeds again.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_MAX_CONCURRENCY = 8
+HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 2
+AFFINITY_ENTRIES = 10000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class Endpoint:
+    """One Ollama instance and its live load."""
+
+    def __init__(self, name, url, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+
+    @property
+    def available(self):
+        return self.healthy and self.outstanding < self.max_concurrency
+
+
+class EndpointPool:
+    """Least-outstanding-requests balancer with health checks and affinity."""
+
+    def __init__(self, endpoints, health_interval=HEALTH_INTERVAL):
+        self.endpoints = endpoints
+        self.health_interval = health_interval
+        self._affinity = OrderedDict()
+        self._changed = threading.Condition()
+        self._health_thread = None
+
+    def acquire(self, affinity=None, timeout=None, cancelled=None):
+        """
+        Reserve a slot on an endpoint, waiting while every healthy one is at its cap.
+
+        Parameters:
+            affinity (str): Key that should keep landing on the same endpoint.
+            timeout (float): Give up after this many seconds (TimeoutError).
+            cancelled (callable): Polled while waiting; returning True aborts.
+
+        Returns:
+            Endpoint: Pass it back to release() when the request is over.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                endpoint = self._choose(affinity)
+                if endpoint is not None:
+                    endpoint.outstanding += 1
+                    if affinity is not None:
+                        self._affinity[affinity] = endpoint
+                        self._affinity.move_to_end(affinity)
+                        while len(self._affinity) > AFFINITY_ENTRIES:
+                            self._affinity.popitem(last=False)
+                    return endpoint
+                if cancelled is not None and cancelled():
+                    raise TimeoutError("Cancelled while waiting for an Ollama endpoint")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No Ollama endpoint available")
+                self._changed.wait(0.5 if remaining is None else min(0.5, remaining))
+
+    def release(self, endpoint, failed=False, error=None):
+        """Return a slot; ``failed`` ejects the endpoint until a health probe passes."""
+        with self._changed:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.healthy = False
+                endpoint.failures += 1
+                endpoint.last_error = str(error) if error else None
+            self._changed.notify_all()
+        if failed:
+            self.start_health_checks()
+
+    @contextmanager
+    def lease(self, affinity=None, timeout=None):
+        """``with pool.lease() as endpoint:`` around one request; connection errors eject."""
+        endpoint = self.acquire(affinity, timeout)
+        try:
+            yield endpoint
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.release(endpoint, failed=True, error=e)
+            raise
+        except BaseException:
+            self.release(endpoint)
+            raise
+        else:
+            self.release(endpoint)
+
+    def check_health(self):
+        """Probe every endpoint once; eject failures and readmit recoveries."""
+        for endpoint in self.endpoints:
+            try:
+                response = requests.get(f"{endpoint.url}/api/version", timeout=HEALTH_TIMEOUT)
+                healthy = response.status_code == 200
+                error = None if healthy else f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                healthy, error = False, str(e)
+            with self._changed:
+                endpoint.healthy = healthy
+                if not healthy:
+                    endpoint.failures += 1
+                    endpoint.last_error = error
+                self._changed.notify_all()
+
+    def start_health_checks(self):
+        """Start the background prober (only useful with more than one endpoint or after a failure)."""
+        with self._changed:
+            if self._health_thread is not None:
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        with self._changed:
+            return [
+                {
+                    "name": e.name, "url": e.url, "healthy": e.healthy, "outstanding": e.outstanding,
+                    "max_concurrency": e.max_concurrency, "failures": e.failures, "last_error": e.last_error,
+                }
+                for e in self.endpoints
+            ]
+
+    def _choose(self, affinity):
+        if affinity is not None:
+            endpoint = self._affinity.get(affinity)
+            if endpoint is not None and endpoint.available:
+                return endpoint
+        candidates = [e for e in self.endpoints if e.available]
+        if not candidates and not any(e.healthy for e in self.endpoints):
+            # Everything is ejected: fail open rather than refusing all traffic
+            candidates = [e for e in self.endpoints if e.outstanding < e.max_concurrency]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: e.outstanding / e.max_concurrency)
+
+    def _health_loop(self):
+        while True:
+            self.check_health()
+            time.sleep(self.health_interval)
+
+
+def load_endpoints(config_path=CONFIG_FILE, default_url=None):
+    """Build Endpoints from the ``"apis"`` section of config.json, or just ``default_url``."""
+    try:
+        with open(config_path, "r") as config_file:
+            apis = json.load(config_file).get("apis", {})
+    except (OSError, TypeError, ValueError):
+        apis = {}
+    endpoints = [
+        Endpoint(name, api["url"], api.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        for name, api in apis.items()
+        if api.get("url")
+    ]
+    if not endpoints and default_url:
+        endpoints = [Endpoint("default", default_url)]
+    return endpoints
+
+
+def get_pool(default_url=None, config_path=CONFIG_FILE):
+    """Return the process-wide pool, loading config.json (unless config_path is None) on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EndpointPool(load_endpoints(config_path, default_url))
+                if len(_pool.endpoints) > 1:
+                    _pool.start_health_checks()
+    return _pool
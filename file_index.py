@@ -0,0 +1,215 @@
+"""Cached file-tree index for the editor's file explorer.
+
+Directories are listed with os.scandir only when they are opened, and each
+listing is cached with its entries' stat data. A cached listing is reused
+while the directory's mtime is unchanged (one stat call instead of a scan);
+when watchdog is installed, filesystem events mark listings stale instead and
+even that stat is skipped. Names matching IGNORE_PATTERNS are left out, and
+fuzzy_filter() searches the file names of the whole tree from the cache.
+"""
+import fnmatch
+import os
+import threading
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+IGNORE_PATTERNS = (
+    ".git", "__pycache__", "*.pyc", ".venv", "venv", "node_modules",
+    "chat_history", "response_cache", "semantic_cache", ".index", ".context",
+)
+USE_WATCHDOG = os.environ.get("FILE_INDEX_WATCHDOG", "1") == "1"
+
+# Upper bound on the files fuzzy_filter looks at, so a huge tree stays responsive
+MAX_FILES = 50000
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class Entry:
+    """One directory entry with the stat data taken when it was scanned."""
+
+    __slots__ = ("name", "path", "is_dir", "size", "mtime")
+
+    def __init__(self, name, path, is_dir, size, mtime):
+        self.name = name
+        self.path = path
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+
+
+class _Listing:
+    __slots__ = ("mtime_ns", "entries", "stale")
+
+    def __init__(self, mtime_ns, entries):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+        self.stale = False
+
+
+class _Invalidator(FileSystemEventHandler):
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        self.index.invalidate(os.path.dirname(event.src_path))
+        if getattr(event, "dest_path", None):
+            self.index.invalidate(os.path.dirname(event.dest_path))
+        if event.is_directory:
+            self.index.invalidate(event.src_path)
+
+
+class FileIndex:
+    """Lazily built, incrementally refreshed index of the tree under ``root``."""
+
+    def __init__(self, root, ignore=IGNORE_PATTERNS, watch=USE_WATCHDOG):
+        self.root = os.path.abspath(root)
+        self.ignore = tuple(ignore)
+        self._listings = {}
+        self._lock = threading.Lock()
+        self._observer = None
+        self.stats = {"scans": 0, "stat_checks": 0, "cached": 0}
+        if watch and Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_Invalidator(self), self.root, recursive=True)
+                self._observer.daemon = True
+                self._observer.start()
+            except Exception:
+                # inotify limits reached, unsupported filesystem, ...: fall back to mtime checks
+                self._observer = None
+
+    @property
+    def watching(self):
+        return self._observer is not None
+
+    def list_dir(self, relative=""):
+        """
+        Return the Entries of a directory (relative to the root), folders first.
+
+        Served from the cache unless the directory changed since it was scanned.
+        """
+        path = self._absolute(relative)
+        with self._lock:
+            listing = self._listings.get(path)
+        if listing is not None and self.watching and not listing.stale:
+            self.stats["cached"] += 1
+            return listing.entries
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            self.invalidate(path)
+            return []
+        self.stats["stat_checks"] += 1
+        if listing is not None and not listing.stale and listing.mtime_ns == mtime_ns:
+            self.stats["cached"] += 1
+            return listing.entries
+        entries = self._scan(path)
+        with self._lock:
+            self._listings[path] = _Listing(mtime_ns, entries)
+        return entries
+
+    def invalidate(self, path):
+        """Mark the listing of ``path`` (absolute) stale."""
+        with self._lock:
+            listing = self._listings.get(os.path.abspath(path))
+            if listing is not None:
+                listing.stale = True
+
+    def walk(self, relative="", max_files=MAX_FILES):
+        """Yield every file Entry below ``relative``, using the cached listings."""
+        pending = [relative]
+        count = 0
+        while pending:
+            for entry in self.list_dir(pending.pop()):
+                if entry.is_dir:
+                    pending.append(entry.path)
+                else:
+                    yield entry
+                    count += 1
+                    if count >= max_files:
+                        return
+
+    def fuzzy_filter(self, query, limit=50):
+        """
+        Return relative paths of files whose path contains the characters of
+        ``query`` in order, best matches first (file-name hits and runs of
+        consecutive characters rank higher).
+        """
+        query = query.lower().replace(" ", "")
+        if not query:
+            return []
+        scored = []
+        for entry in self.walk():
+            score = fuzzy_score(query, entry.path.lower(), len(entry.path) - len(entry.name))
+            if score is not None:
+                scored.append((score, entry.path))
+        scored.sort(key=lambda item: (-item[0], len(item[1]), item[1]))
+        return [path for _, path in scored[:limit]]
+
+    def close(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _scan(self, path):
+        self.stats["scans"] += 1
+        entries = []
+        try:
+            with os.scandir(path) as iterator:
+                for item in iterator:
+                    if self._ignored(item.name):
+                        continue
+                    try:
+                        is_dir = item.is_dir()
+                        stat = item.stat()
+                    except OSError:
+                        continue
+                    entries.append(Entry(
+                        item.name, os.path.relpath(item.path, self.root), is_dir, stat.st_size, stat.st_mtime
+                    ))
+        except OSError:
+            return []
+        entries.sort(key=lambda e: (not e.is_dir, e.name.lower()))
+        return entries
+
+    def _ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _absolute(self, relative):
+        return os.path.normpath(os.path.join(self.root, relative))
+
+
+def fuzzy_score(query, text, name_start=0):
+    """Score of ``query`` as a subsequence of ``text``, or None if it does not match."""
+    score = 0
+    position = 0
+    previous = -2
+    for char in query:
+        found = text.find(char, position)
+        if found < 0:
+            return None
+        score += 1
+        if found == previous + 1:
+            score += 2
+        if found >= name_start:
+            score += 1
+        previous = found
+        position = found + 1
+    return score
+
+
+def get_index(root):
+    """Return the process-wide index of ``root``."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(root)
+        if index is None:
+            index = _indexes[root] = FileIndex(root)
+    return index
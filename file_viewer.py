@@ -0,0 +1,178 @@
+"""Paged, memory-mapped viewing of arbitrarily large files.
+
+Files are never read whole. A text file is memory-mapped and scanned once per
+version (size + mtime) to build a sparse line index: the byte offset of every
+CHECKPOINT-th line. Reading a page seeks to the nearest checkpoint and walks
+forward at most CHECKPOINT lines, so memory stays flat whatever the file size.
+A file that only grew (an appended log) extends its index from where the last
+scan stopped. tail() needs no index at all; it scans backwards from the end.
+Binary files are detected from their first block and shown as a hex dump.
+"""
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+CHECKPOINT = 1024
+SNIFF_BYTES = 8192
+MAX_INDEXES = 32
+ENCODING = "utf-8"
+
+# Control bytes that are normal in text (bell, backspace, tab, newlines, form feed, escape)
+_TEXT_CONTROLS = {7, 8, 9, 10, 12, 13, 27}
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+class LineIndex:
+    """Sparse line offsets of one version of a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.mtime_ns = 0
+        self.lines = 0
+        self.checkpoints = array("Q", [0])
+        self._scanned = 0
+        self._partial = False
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Bring the index up to date with the file, rescanning only what changed."""
+        stat = os.stat(self.path)
+        with self._lock:
+            if stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns:
+                return self
+            if stat.st_size <= self.size:
+                # Truncated or rewritten in place: start over (growth is treated as an append)
+                self.lines, self.checkpoints, self._scanned, self._partial = 0, array("Q", [0]), 0, False
+            self._scan(stat.st_size)
+            self.size, self.mtime_ns = stat.st_size, stat.st_mtime_ns
+        return self
+
+    def read_lines(self, start, count):
+        """Return lines ``start`` .. ``start + count`` (0-based) without their newlines."""
+        self.refresh()
+        if start >= self.lines or count <= 0 or not self.size:
+            return []
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            offset = self.checkpoints[start // CHECKPOINT]
+            for _ in range(start % CHECKPOINT):
+                offset = _next_line(view, offset)
+            lines = []
+            while len(lines) < count and offset < len(view):
+                end = view.find(b"\n", offset)
+                if end < 0:
+                    end = len(view)
+                lines.append(view[offset:end].rstrip(b"\r").decode(ENCODING, errors="replace"))
+                offset = end + 1
+        return lines
+
+    def _scan(self, size):
+        if not size:
+            return
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            size = min(size, len(view))
+            offset = self._scanned
+            if self._partial:
+                # The unterminated last line is rescanned now that more was appended
+                self.lines -= 1
+            self._partial = False
+            while offset < size:
+                end = view.find(b"\n", offset, size)
+                if end < 0:
+                    self.lines += 1
+                    self._partial = True
+                    break
+                self.lines += 1
+                offset = end + 1
+                # Also when the scan ends on the boundary: the next line starts there once the file grows
+                if self.lines % CHECKPOINT == 0:
+                    self.checkpoints.append(offset)
+            self._scanned = self._line_start(view, size)
+
+    def _line_start(self, view, size):
+        """Offset of the start of the last (possibly partial) line, where the next scan resumes."""
+        if view[size - 1:size] == b"\n":
+            return size
+        return view.rfind(b"\n", 0, size) + 1
+
+
+def _next_line(view, offset):
+    end = view.find(b"\n", offset)
+    return len(view) if end < 0 else end + 1
+
+
+def get_index(path):
+    """Return the (refreshed) line index of ``path``, cached per file."""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = LineIndex(path)
+        _indexes.move_to_end(path)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index.refresh()
+
+
+def is_binary(path):
+    """Guess from the first SNIFF_BYTES whether ``path`` is binary."""
+    with open(path, "rb") as file:
+        block = file.read(SNIFF_BYTES)
+    if not block:
+        return False
+    if b"\0" in block:
+        return True
+    try:
+        block.decode(ENCODING)
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut at the end of the block is fine
+        if e.start < len(block) - 3:
+            return True
+    controls = sum(1 for byte in block if byte < 32 and byte not in _TEXT_CONTROLS)
+    return controls > len(block) * 0.1
+
+
+def tail(path, count):
+    """Return the last ``count`` lines of ``path`` by scanning backwards from the end."""
+    if count <= 0 or not os.path.getsize(path):
+        return []
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        end = len(view)
+        if view[end - 1:end] == b"\n":
+            end -= 1
+        start = end
+        for _ in range(count):
+            newline = view.rfind(b"\n", 0, start)
+            if newline < 0:
+                start = 0
+                break
+            start = newline
+        else:
+            start += 1
+        data = view[start:end]
+    return data.decode(ENCODING, errors="replace").splitlines()
+
+
+def hex_dump(path, offset=0, length=512, width=16):
+    """Classic offset / hex / ASCII dump of ``length`` bytes starting at ``offset``."""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        data = file.read(length)
+    rows = []
+    for row in range(0, len(data), width):
+        chunk = data[row:row + width]
+        hex_part = " ".join(f"{byte:02x}" for byte in chunk)
+        text_part = "".join(chr(byte) if 32 <= byte < 127 else "." for byte in chunk)
+        rows.append(f"{offset + row:08x}  {hex_part:<{width * 3}} {text_part}")
+    return "\n".join(rows)
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
@@ -7,13 +7,24 @@ default_config = {
             "description": "Default physics book writer model",
             "system": """You are a Physics book Writer,
                          given a topic you will write a planned book.""",
-            "num_ctx": 100000
+            "num_ctx": 100000,
+            "keep_alive": "30m",
+            "warm_up": True,
+            "history_tokens": 4096,
+            "summary_model": "qwen2.5:0.5b"
+        },
+        "llama3.2": {
+            "description": "Code generator model used by editor/editor.py",
+            "num_ctx": 8192,
+            "keep_alive": "30m",
+            "warm_up": True
         }
     },
     "apis": {
         "default_api": {
             "url": "http://localhost:11434",
-            "description": "Local API for model generation"
+            "description": "Local API for model generation",
+            "max_concurrency": 8
         }
     }
 }
@@ -0,0 +1,266 @@
+"""Background generation jobs, decoupled from Streamlit reruns.
+
+Each chat session owns at most one GenerationJob. The job streams from Ollama
+in a worker thread and appends tokens to its own buffer; the UI only polls that
+buffer, so reruns (button clicks, sidebar navigation) never abandon a stream
+mid-flight, and cancelling a job closes the upstream connection at once.
+Jobs that call Ollama wait for a slot from the fair scheduler before a worker
+thread picks them up.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import metrics
+import ollama_client
+import scheduler
+
+# Worker threads shared by all sessions in this process
+MAX_WORKERS = 32
+
+# Running jobs nobody has polled for this long are treated as abandoned and
+# cancelled; finished jobs nobody collected are dropped.
+ABANDON_AFTER = 120
+
+QUEUED, RUNNING, DONE, CANCELLED, ERROR = "queued", "running", "done", "cancelled", "error"
+
+
+class GenerationJob:
+    """A single streaming request and the tokens received so far."""
+
+    def __init__(self, path, payload, base_url=None, replay=None, on_done=None, affinity=None, user=None,
+                 kind=None):
+        self.path = path
+        self.payload = payload
+        self.base_url = base_url
+        self.affinity = affinity
+        self.endpoint = base_url
+        self.replay = replay
+        self.on_done = on_done
+        self.chunks = []
+        self.status = QUEUED
+        self.error = None
+        self.parse_errors = 0
+        self.final_chunk = None
+        self.ticket = None
+        self.metrics = metrics.start_request(
+            payload.get("model"), user=user, endpoint="cache" if replay is not None else base_url,
+            kind=kind or path.rsplit("/", 1)[-1], replay=replay is not None,
+        )
+        self.created_at = time.time()
+        self.last_polled = self.created_at
+        self._response = None
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._finished.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def text(self):
+        """Return everything generated so far."""
+        self.last_polled = time.time()
+        return "".join(self.chunks)
+
+    def read(self, offset=0):
+        """Return the chunks appended since ``offset`` and the new offset."""
+        self.last_polled = time.time()
+        end = len(self.chunks)
+        return self.chunks[offset:end], end
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+    def queue_position(self):
+        """1-based position in the scheduler queue, 0 once the job is running."""
+        if self.ticket is None or self.status != QUEUED:
+            return 0
+        return scheduler.get_scheduler().position(self.ticket)
+
+    def cancel(self):
+        """Stop the job and close the upstream stream so Ollama frees the slot."""
+        with self._lock:
+            self._cancelled.set()
+            response = self._response
+        if response is not None:
+            ollama_client.abort(response)
+        if self.ticket is not None and scheduler.get_scheduler().release(self.ticket):
+            # Withdrawn before it got a slot: no worker will ever run it
+            self._finish(CANCELLED)
+
+    def run(self):
+        """Worker entry point: stream the request into the buffer."""
+        try:
+            self._run()
+        finally:
+            if self.ticket is not None:
+                scheduler.get_scheduler().release(self.ticket)
+
+    def _run(self):
+        if self.cancelled:
+            self._finish(CANCELLED)
+            return
+        if self.replay is not None:
+            # Served from a cache: feed the stored chunks through the same path
+            self.status = RUNNING
+            self.metrics.admitted()
+            for chunk in self.replay:
+                if self.cancelled:
+                    break
+                self._append(chunk)
+            self._finish(CANCELLED if self.cancelled else DONE)
+            return
+
+        pool = endpoint = None
+        failed = False
+        try:
+            base_url = self.base_url
+            if base_url is None:
+                # Wait for a slot on the least loaded healthy endpoint
+                pool = ollama_client.get_pool()
+                endpoint = pool.acquire(self.affinity, cancelled=lambda: self.cancelled)
+                base_url = self.endpoint = endpoint.url
+            self.metrics.admitted(base_url)
+            self.status = RUNNING
+            response = ollama_client.post_stream(self.path, self.payload, base_url=base_url)
+            with self._lock:
+                self._response = response
+            if self.cancelled:
+                ollama_client.abort(response)
+                return
+            with response:
+                ollama_client.check_response(response)
+                for chunk in ollama_client.iter_ndjson(response, on_error=self._on_parse_error):
+                    if self.cancelled:
+                        break
+                    self._append(chunk)
+        except Exception as e:
+            if not self.cancelled:
+                failed = isinstance(e, (requests.ConnectionError, requests.Timeout))
+                self.error = str(e)
+        finally:
+            if endpoint is not None:
+                pool.release(endpoint, failed=failed, error=self.error)
+            if self.cancelled:
+                self._finish(CANCELLED)
+            else:
+                self._finish(ERROR if self.error else DONE)
+
+    def _append(self, chunk):
+        if "response" in chunk:
+            token = chunk["response"]
+        else:
+            token = chunk.get("message", {}).get("content", "")
+        if token:
+            self.metrics.token()
+            self.chunks.append(token)
+        if chunk.get("done"):
+            self.final_chunk = chunk
+
+    def _on_parse_error(self, line):
+        self.parse_errors += 1
+
+    def _finish(self, status):
+        with self._lock:
+            self._response = None
+        self.status = status
+        self.metrics.finish(self.final_chunk, status)
+        self._finished.set()
+        if status == DONE and self.on_done is not None:
+            try:
+                self.on_done(self)
+            except Exception:
+                pass
+
+
+class GenerationManager:
+    """Process-wide registry of background jobs, one per chat session."""
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_key, path, payload, base_url=None, replay=None, on_done=None,
+              user=None, priority=scheduler.INTERACTIVE, kind=None, user_limit=None):
+        """
+        Start a job for ``session_key``, cancelling any job it already has.
+
+        Without ``base_url`` the job is routed through the endpoint pool with
+        the session as affinity key. ``replay`` is an iterable of already
+        decoded chunks to serve instead of calling Ollama; ``on_done`` is
+        called with the job when it completes. Jobs that call Ollama are
+        queued in the scheduler under ``user`` (default: the session) and
+        raise scheduler.SchedulerFull when the queue is full. ``kind`` labels
+        the job's metrics (default: the API path); ``user_limit`` raises the
+        scheduler's per-user cap for it (model comparison fan-out).
+        """
+        job = GenerationJob(
+            path, payload, base_url=base_url, replay=replay, on_done=on_done, affinity=session_key, user=user,
+            kind=kind,
+        )
+        with self._lock:
+            self._reap()
+            previous = self._jobs.get(session_key)
+        if previous is not None:
+            # Free this session's slot before queueing its replacement
+            previous.cancel()
+        if replay is None:
+            job.ticket = scheduler.get_scheduler().submit(
+                user or session_key, priority, on_grant=lambda: self._executor.submit(job.run), limit=user_limit
+            )
+        else:
+            self._executor.submit(job.run)
+        with self._lock:
+            self._jobs[session_key] = job
+        return job
+
+    def get(self, session_key):
+        """Return the job for ``session_key`` or None."""
+        with self._lock:
+            return self._jobs.get(session_key)
+
+    def cancel(self, session_key):
+        """Cancel the job for ``session_key``; it stays registered until popped."""
+        job = self.get(session_key)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def pop(self, session_key):
+        """Forget the job for ``session_key`` once its result has been collected."""
+        with self._lock:
+            return self._jobs.pop(session_key, None)
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.done)
+
+    def _reap(self):
+        now = time.time()
+        for key, job in list(self._jobs.items()):
+            if now - job.last_polled > ABANDON_AFTER:
+                job.cancel()
+                if job.done:
+                    del self._jobs[key]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Return the process-wide GenerationManager."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = GenerationManager()
+    return _manager
@@ -0,0 +1,226 @@
+"""SQLite catalog of saved chat sessions.
+
+The sidebar used to os.listdir() the history folder and draw buttons for every
+file on every rerun. The catalog keeps one row per session (title, emoji,
+owner, message count, size, last modified), is updated on every save and
+delete, and serves the sidebar one page at a time with keyset pagination.
+``accessed`` (last save or open) drives LRU eviction in history_shards.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+import chat_store
+
+CATALOG_FILE = "catalog.sqlite3"
+PAGE_SIZE = 20
+
+# Sidebar label -> (column, direction)
+SORT_ORDERS = {
+    "Newest": ("modified", "DESC"),
+    "Oldest": ("modified", "ASC"),
+    "Title": ("title", "ASC"),
+    "Largest": ("size", "DESC"),
+    "Most messages": ("message_count", "DESC"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    file_name TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    emoji TEXT,
+    owner TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    modified REAL NOT NULL,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_modified ON sessions (modified, file_name);
+CREATE INDEX IF NOT EXISTS sessions_title ON sessions (title, file_name);
+CREATE INDEX IF NOT EXISTS sessions_size ON sessions (size, file_name);
+CREATE INDEX IF NOT EXISTS sessions_message_count ON sessions (message_count, file_name);
+CREATE INDEX IF NOT EXISTS sessions_owner ON sessions (owner, modified);
+"""
+
+_ACCESSED_INDEX = "CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed, file_name)"
+
+_COLUMNS = ("file_name", "title", "emoji", "owner", "message_count", "size", "created", "modified", "accessed")
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class HistoryCatalog:
+    """Session metadata for one history folder."""
+
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        self.path = os.path.join(history_dir, CATALOG_FILE)
+        is_new = not os.path.exists(self.path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._migrate()
+        if is_new:
+            self.rebuild()
+
+    def record_save(self, file_name, title, emoji, owner, added_messages, added_bytes):
+        """Create or update the row for a session after messages were appended."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                INSERT INTO sessions (file_name, title, emoji, owner, message_count, size, created, modified, accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (file_name) DO UPDATE SET
+                    message_count = message_count + excluded.message_count,
+                    size = size + excluded.size,
+                    modified = excluded.modified,
+                    accessed = excluded.accessed
+                """,
+                (file_name, title, emoji, owner, added_messages, added_bytes, now, now, now),
+            )
+
+    def touch(self, file_name):
+        """Mark a session as just opened, for LRU eviction."""
+        with self._lock, self._db:
+            self._db.execute("UPDATE sessions SET accessed = ? WHERE file_name = ?", (time.time(), file_name))
+
+    def replace(self, row):
+        """Insert or overwrite a full row (a dict of _COLUMNS), e.g. after moving or rewriting a session."""
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO sessions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                tuple(row.get(column) for column in _COLUMNS),
+            )
+
+    def get(self, file_name):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM sessions WHERE file_name = ?", (file_name,)
+            ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def remove(self, file_name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE file_name = ?", (file_name,))
+
+    def remove_all(self, owner=None):
+        """Drop every row (or every row of ``owner``) and return the removed file names."""
+        where, params = ("WHERE owner = ?", (owner,)) if owner is not None else ("", ())
+        with self._lock, self._db:
+            names = [row[0] for row in self._db.execute(f"SELECT file_name FROM sessions {where}", params)]
+            self._db.execute(f"DELETE FROM sessions {where}", params)
+        return names
+
+    def owned_by(self, owner):
+        """Return the rows of ``owner`` (None: rows without an owner) as dicts."""
+        where, params = ("WHERE owner = ?", (owner,)) if owner is not None else ("WHERE owner IS NULL", ())
+        with self._lock:
+            return [dict(zip(_COLUMNS, row)) for row in self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM sessions {where}", params
+            )]
+
+    def count(self, owner=None):
+        where, params = ("WHERE owner = ?", (owner,)) if owner is not None else ("", ())
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM sessions {where}", params).fetchone()[0]
+
+    def totals(self):
+        """(number of sessions, total bytes)."""
+        with self._lock:
+            count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions").fetchone()
+        return count, size
+
+    def least_recent(self, limit, keep=()):
+        """The ``limit`` least recently accessed sessions, skipping file names in ``keep``."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM sessions ORDER BY accessed ASC, file_name ASC LIMIT ?",
+                (limit + len(keep),),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows if row[0] not in keep][:limit]
+
+    def modified_before(self, before):
+        """Sessions not written to since ``before`` (a timestamp), oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM sessions WHERE modified < ? ORDER BY modified ASC",
+                (before,),
+            ).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def page(self, sort="Newest", cursor=None, limit=PAGE_SIZE, owner=None):
+        """
+        Return one page of sessions.
+
+        Parameters:
+            sort (str): A key of SORT_ORDERS.
+            cursor (tuple): The ``next_cursor`` of the previous page, or None.
+            limit (int): Rows per page.
+            owner (str): Only list this user's sessions.
+
+        Returns:
+            tuple: (rows as dicts, next_cursor or None when this is the last page)
+        """
+        column, direction = SORT_ORDERS[sort]
+        comparison = "<" if direction == "DESC" else ">"
+        clauses, params = [], []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params.append(owner)
+        if cursor is not None:
+            clauses.append(f"({column}, file_name) {comparison} (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (
+            f"SELECT {', '.join(_COLUMNS)} FROM sessions {where} "
+            f"ORDER BY {column} {direction}, file_name {direction} LIMIT ?"
+        )
+        with self._lock:
+            rows = [dict(zip(_COLUMNS, row)) for row in self._db.execute(query, (*params, limit + 1))]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1][column], rows[-1]["file_name"])
+        return rows, next_cursor
+
+    def rebuild(self):
+        """Re-index every session file in the folder (used when the catalog is new)."""
+        rows = []
+        for file_name in chat_store.list_sessions(self.history_dir):
+            path = os.path.join(self.history_dir, file_name)
+            try:
+                emoji, messages = chat_store.read_session(path)
+                stat = os.stat(path)
+            except (OSError, UnicodeDecodeError):
+                continue
+            title = messages[0]["message"][:60] if messages else os.path.splitext(file_name)[0]
+            rows.append((
+                file_name, title, emoji, None, len(messages), stat.st_size, stat.st_mtime, stat.st_mtime, stat.st_mtime,
+            ))
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions")
+            self._db.executemany(f"INSERT INTO sessions ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _migrate(self):
+        """Add the ``accessed`` column to catalogs created before it existed."""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        with self._db:
+            if "accessed" not in columns:
+                self._db.execute("ALTER TABLE sessions ADD COLUMN accessed REAL")
+                self._db.execute("UPDATE sessions SET accessed = modified")
+            self._db.execute(_ACCESSED_INDEX)
+
+
+def get_catalog(history_dir):
+    """Return the process-wide catalog for ``history_dir``."""
+    with _catalogs_lock:
+        catalog = _catalogs.get(history_dir)
+        if catalog is None:
+            catalog = _catalogs[history_dir] = HistoryCatalog(history_dir)
+    return catalog
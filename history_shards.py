@@ -0,0 +1,263 @@
+"""Per-user partitions of the chat history folder.
+
+Every user gets their own shard directory with its own session files and
+catalog, so listing, deleting and name collisions only ever involve that
+user's sessions:
+
+    chat_history/users/3f/alice-3fa85f6457b2/<emoji>_<prompt>.jsonl
+                                             catalog.sqlite3
+
+The two-character bucket (from a hash of the user name) keeps any one
+directory small however many users there are. A shard holds at most
+MAX_SESSIONS sessions and MAX_BYTES of journals; saving past either limit
+evicts the least recently used (saved or opened) sessions.
+
+The compactor thread walks the shards opened by this process every
+COMPACT_INTERVAL seconds: sessions untouched for STALE_DAYS are trimmed to
+their last TRIM_MESSAGES messages, and stale sessions shorter than
+MERGE_BELOW messages are merged into one archive session per month. A
+session a page has open (mark_open within OPEN_GRACE seconds) is left alone.
+
+Each shard also keeps the full-text index of its messages (chat_search);
+deleting, trimming and merging keep it in step.
+
+Sessions saved before sharding (directly in the history folder) move into
+their owner's shard the first time that shard is opened. Sessions without a
+recorded owner (all of them, for chats saved before owners were recorded) go
+to the first shard opened, so the people who used the app before keep them.
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+
+import chat_search
+import chat_store
+import context_builder
+import conversation
+import history_catalog
+
+SHARDS_DIR = "users"
+ANONYMOUS = "anonymous"
+
+MAX_SESSIONS = int(os.environ.get("HISTORY_MAX_SESSIONS", "500"))
+MAX_BYTES = int(os.environ.get("HISTORY_MAX_MB", "256")) * 1024 * 1024
+
+COMPACT_INTERVAL = 600
+STALE_DAYS = float(os.environ.get("HISTORY_STALE_DAYS", "30"))
+TRIM_MESSAGES = 200
+MERGE_BELOW = 4
+ARCHIVE_EMOJI = "🗄️"
+# A session used by a page this recently counts as open and is never compacted
+OPEN_GRACE = 24 * 3600
+
+_shards = {}
+_shards_lock = threading.Lock()
+_compactor = None
+
+
+def shard_path(history_dir, user):
+    """Directory of ``user``'s shard under ``history_dir``."""
+    user = user or ANONYMOUS
+    digest = hashlib.sha256(user.encode("utf-8")).hexdigest()
+    slug = re.sub(r"[^A-Za-z0-9_-]", "", user)[:32] or "user"
+    return os.path.join(history_dir, SHARDS_DIR, digest[:2], f"{slug}-{digest[:12]}")
+
+
+class Shard:
+    """One user's sessions: files, catalog and quota."""
+
+    def __init__(self, history_dir, user):
+        self.history_dir = history_dir
+        self.user = user or ANONYMOUS
+        self.directory = shard_path(history_dir, self.user)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._opened = {}
+        self.catalog = history_catalog.HistoryCatalog(self.directory)
+        migrated = self._migrate_legacy()
+        # A new index indexes the whole folder itself; an existing one only lacks the moved files
+        self.search = chat_search.SearchIndex(self.directory)
+        for file_name in migrated:
+            self.search.reindex(file_name)
+
+    def path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def new_session_name(self, emoji, first_prompt):
+        return chat_store.new_session_name(self.directory, emoji, first_prompt)
+
+    def record_save(self, file_name, title, emoji, added_messages, added_bytes):
+        """Update the catalog after a save and evict old sessions if the shard is over quota."""
+        self.catalog.record_save(file_name, title, emoji, self.user, added_messages, added_bytes)
+        return self.enforce_quota(keep=(file_name,))
+
+    def touch(self, file_name):
+        self.catalog.touch(file_name)
+
+    def mark_open(self, file_name):
+        """Note that a page has ``file_name`` open (call on every rerun), so compaction skips it."""
+        self._opened[file_name] = time.time()
+
+    def is_open(self, file_name):
+        return time.time() - self._opened.get(file_name, 0) < OPEN_GRACE
+
+    def _compactable(self, file_name, cutoff):
+        """Whether ``file_name`` is still stale and not open, checked right before compacting it."""
+        if self.is_open(file_name):
+            return False
+        row = self.catalog.get(file_name)
+        return row is not None and (row["accessed"] or row["modified"]) < cutoff
+
+    def delete(self, file_name):
+        self.catalog.remove(file_name)
+        chat_store.delete(self.path(file_name))
+        conversation.discard(self.path(file_name))
+        context_builder.discard(self.path(file_name))
+        self.search.remove(file_name)
+
+    def enforce_quota(self, keep=()):
+        """Evict least recently used sessions (never those in ``keep``) until within quota."""
+        evicted = []
+        with self._lock:
+            count, size = self.catalog.totals()
+            while count > MAX_SESSIONS or size > MAX_BYTES:
+                rows = self.catalog.least_recent(max(1, count - MAX_SESSIONS), keep=keep)
+                if not rows:
+                    break
+                for row in rows:
+                    self.delete(row["file_name"])
+                    evicted.append(row["file_name"])
+                    count, size = count - 1, size - row["size"]
+                    if count <= MAX_SESSIONS and size <= MAX_BYTES:
+                        break
+        return evicted
+
+    def compact(self, now=None):
+        """
+        Trim and merge stale sessions, then re-apply the quota.
+
+        Returns:
+            dict: Numbers of sessions trimmed, merged and evicted.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - STALE_DAYS * 86400
+        stale = [
+            row for row in self.catalog.modified_before(cutoff)
+            if (row["accessed"] or row["modified"]) < cutoff
+            and row["file_name"].endswith(chat_store.JOURNAL_EXT) and not row["file_name"].startswith("archive-")
+            and not self.is_open(row["file_name"])
+        ]
+        stats = {"trimmed": 0, "merged": 0, "evicted": 0}
+
+        small = [row for row in stale if row["message_count"] < MERGE_BELOW]
+        by_month = {}
+        for row in small:
+            by_month.setdefault(time.strftime("%Y-%m", time.localtime(row["modified"])), []).append(row)
+        for month, rows in by_month.items():
+            # A session may have been opened since the listing
+            rows[:] = [row for row in rows if self._compactable(row["file_name"], cutoff)]
+            if len(rows) < 2:
+                continue
+            archive = f"archive-{month}{chat_store.JOURNAL_EXT}"
+            added, size = chat_store.merge([self.path(row["file_name"]) for row in rows], self.path(archive),
+                                           emoji=ARCHIVE_EMOJI)
+            for row in rows:
+                self.catalog.remove(row["file_name"])
+                conversation.discard(self.path(row["file_name"]))
+                context_builder.discard(self.path(row["file_name"]))
+                self.search.remove(row["file_name"])
+            self.search.reindex(archive)
+            existing = self.catalog.get(archive)
+            self.catalog.replace({
+                "file_name": archive, "title": f"Archived chats {month}", "emoji": ARCHIVE_EMOJI, "owner": self.user,
+                "message_count": (existing["message_count"] if existing else 0) + added,
+                "size": (existing["size"] if existing else 0) + size,
+                "created": existing["created"] if existing else now,
+                "modified": max(row["modified"] for row in rows),
+                "accessed": max(row["accessed"] or row["modified"] for row in rows),
+            })
+            stats["merged"] += len(rows)
+
+        merged = {row["file_name"] for month_rows in by_month.values() if len(month_rows) > 1 for row in month_rows}
+        for row in stale:
+            if row["file_name"] in merged or row["message_count"] <= TRIM_MESSAGES:
+                continue
+            if not self._compactable(row["file_name"], cutoff):
+                continue
+            kept, size = chat_store.trim(self.path(row["file_name"]), TRIM_MESSAGES)
+            # The trimmed file no longer matches a persisted KV context
+            conversation.discard(self.path(row["file_name"]))
+            context_builder.discard(self.path(row["file_name"]))
+            self.catalog.replace(dict(row, message_count=kept, size=size))
+            self.search.reindex(row["file_name"])
+            stats["trimmed"] += 1
+
+        stats["evicted"] = len(self.enforce_quota())
+        if any(stats.values()):
+            self.search.optimize()
+        return stats
+
+    def _migrate_legacy(self):
+        """Move this user's (and unowned) sessions out of the shared history folder; returns the moved file names."""
+        moved = []
+        if not os.path.exists(os.path.join(self.history_dir, history_catalog.CATALOG_FILE)) \
+                and not chat_store.list_sessions(self.history_dir):
+            return moved
+        legacy = history_catalog.get_catalog(self.history_dir)
+        rows = legacy.owned_by(None)
+        if self.user != ANONYMOUS:
+            rows += legacy.owned_by(self.user)
+        for row in rows:
+            source = os.path.join(self.history_dir, row["file_name"])
+            if not os.path.exists(source):
+                legacy.remove(row["file_name"])
+                continue
+            file_name = row["file_name"]
+            if os.path.exists(self.path(file_name)):
+                stem, ext = os.path.splitext(file_name)
+                file_name = f"{stem}_{hashlib.sha256(source.encode()).hexdigest()[:6]}{ext}"
+            try:
+                chat_store.move(source, self.path(file_name))
+            except OSError:
+                # Stays in the legacy folder and catalog; the next process to open a shard retries
+                continue
+            self.catalog.replace(dict(row, file_name=file_name, owner=self.user, accessed=row["accessed"] or row["modified"]))
+            legacy.remove(row["file_name"])
+            conversation.discard(source)
+            context_builder.discard(source)
+            moved.append(file_name)
+        return moved
+
+
+def get_shard(history_dir, user):
+    """Return the process-wide shard of ``user`` under ``history_dir`` and start the compactor."""
+    key = (history_dir, user or ANONYMOUS)
+    with _shards_lock:
+        shard = _shards.get(key)
+        if shard is None:
+            shard = _shards[key] = Shard(history_dir, user)
+    _start_compactor()
+    return shard
+
+
+def _compact_loop():
+    while True:
+        time.sleep(COMPACT_INTERVAL)
+        with _shards_lock:
+            shards = list(_shards.values())
+        for shard in shards:
+            try:
+                shard.compact()
+            except (OSError, ValueError):
+                pass
+
+
+def _start_compactor():
+    global _compactor
+    if _compactor is None:
+        with _shards_lock:
+            if _compactor is None:
+                _compactor = threading.Thread(target=_compact_loop, name="history-compactor", daemon=True)
+                _compactor.start()
@@ -0,0 +1,357 @@
+"""Per-request generation metrics.
+
+Every call to Ollama is wrapped in a RequestMetrics: it records the time spent
+waiting in the scheduler, time to first token (from admission), the gaps
+between tokens, client-side tokens/s and the timing fields of Ollama's final
+chunk (load, prompt eval and eval durations and token counts). Observations
+go into Prometheus-style histograms and counters labeled by model, endpoint
+and user; ``render_prometheus()`` formats them in the text exposition format,
+served on METRICS_PORT when that is set. With METRICS_JSONL set, one JSON line
+per finished request is appended to that file. ``summary()`` feeds the live
+sidebar panel from the most recent requests.
+"""
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import model_lifecycle
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_JSONL = os.environ.get("METRICS_JSONL", "")
+RECENT_REQUESTS = 200
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25, 0.5, 1, 2.5)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500)
+
+LABELS = ("model", "endpoint", "user")
+
+_HISTOGRAMS = {
+    "ollama_queue_wait_seconds": ("Time spent waiting for a scheduler slot and an endpoint", LATENCY_BUCKETS),
+    "ollama_time_to_first_token_seconds": ("Admission to first token", LATENCY_BUCKETS),
+    "ollama_inter_token_seconds": ("Gap between consecutive tokens", TOKEN_GAP_BUCKETS),
+    "ollama_request_duration_seconds": ("Admission to last chunk", LATENCY_BUCKETS),
+    "ollama_tokens_per_second": ("Client-side generation rate", RATE_BUCKETS),
+    "ollama_load_duration_seconds": ("Server-side model load time (load_duration)", LATENCY_BUCKETS),
+    "ollama_prompt_eval_duration_seconds": ("Server-side prompt evaluation time", LATENCY_BUCKETS),
+    "ollama_eval_duration_seconds": ("Server-side generation time", LATENCY_BUCKETS),
+    "ollama_eval_tokens_per_second": ("Server-side generation rate (eval_count / eval_duration)", RATE_BUCKETS),
+}
+_COUNTERS = {
+    "ollama_requests_total": "Finished requests by status",
+    "ollama_prompt_tokens_total": "Prompt tokens evaluated (prompt_eval_count)",
+    "ollama_eval_tokens_total": "Tokens generated (eval_count)",
+}
+
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-sink")
+_server = None
+_server_lock = threading.Lock()
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """All histograms and counters, keyed by metric name and label values."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._recent = deque(maxlen=RECENT_REQUESTS)
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(_HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def observe_many(self, name, labels, values):
+        with self._lock:
+            key = (name, labels)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(_HISTOGRAMS[name][1])
+            for value in values:
+                histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        with self._lock:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_recent(self, record):
+        with self._lock:
+            self._recent.append(record)
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def render_prometheus(self):
+        """The text exposition format of every metric."""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for name, (help_text, _) in _HISTOGRAMS.items():
+            series = [(labels, h) for (metric, labels), h in histograms if metric == name]
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, help_text in _COUNTERS.items():
+            series = [(labels, value) for (metric, labels), value in counters if metric == name]
+            if not series:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for labels, value in series:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_registry = Registry()
+
+
+class RequestMetrics:
+    """
+    Measurements of one generation request.
+
+    Call admitted() when it gets its scheduler slot (and endpoint), token()
+    for every non-empty token, and finish() with Ollama's final chunk.
+    A replay (a cached response streamed back) only counts in
+    ollama_requests_total, so it does not skew the latency histograms.
+    """
+
+    def __init__(self, model, user=None, endpoint=None, kind="generate", registry=None, replay=False):
+        self.model = model or "unknown"
+        self.user = user or "anonymous"
+        self.endpoint = endpoint or "unknown"
+        self.kind = kind
+        self.replay = replay
+        self.registry = registry or _registry
+        self.submitted = time.monotonic()
+        self.admitted_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+        self.tokens = 0
+        self.gaps = []
+        self.finished = False
+        self.finished_at = None
+
+    def admitted(self, endpoint=None):
+        if endpoint:
+            self.endpoint = endpoint
+        if self.admitted_at is None:
+            self.admitted_at = time.monotonic()
+
+    def token(self):
+        now = time.monotonic()
+        if self.admitted_at is None:
+            self.admitted_at = now
+        if self.first_token_at is None:
+            self.first_token_at = now
+        else:
+            self.gaps.append(now - self.last_token_at)
+        self.last_token_at = now
+        self.tokens += 1
+
+    def live(self):
+        """Progress so far: TTFT and elapsed time from submission, tokens and tokens/s."""
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        rate = None
+        if self.tokens > 1 and self.last_token_at > self.first_token_at:
+            rate = (self.tokens - 1) / (self.last_token_at - self.first_token_at)
+        return {
+            "ttft": None if self.first_token_at is None else self.first_token_at - self.submitted,
+            "elapsed": end - self.submitted,
+            "tokens": self.tokens,
+            "tokens_per_second": rate,
+        }
+
+    def finish(self, final_chunk=None, status="done"):
+        """Record everything measured; safe to call more than once (only the first counts)."""
+        if self.finished:
+            return None
+        self.finished = True
+        now = self.finished_at = time.monotonic()
+        admitted = self.admitted_at if self.admitted_at is not None else now
+        labels = (self.model, self.endpoint, self.user)
+        record = {
+            "time": time.time(), "kind": self.kind, "status": status,
+            "model": self.model, "endpoint": self.endpoint, "user": self.user,
+            "queue_wait": admitted - self.submitted,
+            "duration": now - admitted,
+            "ttft": None if self.first_token_at is None else self.first_token_at - admitted,
+            "tokens": self.tokens,
+            "tokens_per_second": None,
+        }
+        registry = self.registry
+        if self.replay:
+            record["replay"] = True
+            registry.increment("ollama_requests_total", labels + (status,))
+            registry.add_recent(record)
+            if METRICS_JSONL:
+                _writer.submit(_append_jsonl, METRICS_JSONL, record)
+            return record
+        registry.observe("ollama_queue_wait_seconds", labels, record["queue_wait"])
+        registry.observe("ollama_request_duration_seconds", labels, record["duration"])
+        if record["ttft"] is not None:
+            registry.observe("ollama_time_to_first_token_seconds", labels, record["ttft"])
+        if self.gaps:
+            registry.observe_many("ollama_inter_token_seconds", labels, self.gaps)
+            streaming = self.last_token_at - self.first_token_at
+            if streaming > 0:
+                record["tokens_per_second"] = (self.tokens - 1) / streaming
+                registry.observe("ollama_tokens_per_second", labels, record["tokens_per_second"])
+        timing = model_lifecycle.timing_report(final_chunk)
+        if timing:
+            record.update(
+                load=timing["load"], prompt_eval=timing["prompt_eval"], prompt_tokens=timing["prompt_tokens"],
+                eval=timing["eval"], eval_tokens=timing["eval_tokens"], eval_rate=timing["tokens_per_second"] or None,
+            )
+        for field, name in (("load", "ollama_load_duration_seconds"),
+                            ("prompt_eval", "ollama_prompt_eval_duration_seconds"),
+                            ("eval", "ollama_eval_duration_seconds"),
+                            ("eval_rate", "ollama_eval_tokens_per_second")):
+            if record.get(field) is not None:
+                registry.observe(name, labels, record[field])
+        if record.get("prompt_tokens"):
+            registry.increment("ollama_prompt_tokens_total", labels, record["prompt_tokens"])
+        if record.get("eval_tokens"):
+            registry.increment("ollama_eval_tokens_total", labels, record["eval_tokens"])
+        registry.increment("ollama_requests_total", labels + (status,))
+        registry.add_recent(record)
+        if METRICS_JSONL:
+            _writer.submit(_append_jsonl, METRICS_JSONL, record)
+        return record
+
+
+def _format_labels(labels, le=None):
+    names = LABELS + ("status",) if len(labels) > len(LABELS) else LABELS
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, labels)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _append_jsonl(path, record):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps(record) + "\n")
+
+
+def get_registry():
+    return _registry
+
+
+def start_request(model, user=None, endpoint=None, kind="generate", replay=False):
+    """Begin measuring a request (the queue wait starts now)."""
+    return RequestMetrics(model, user=user, endpoint=endpoint, kind=kind, replay=replay)
+
+
+def render_prometheus():
+    return _registry.render_prometheus()
+
+
+def summary(records=None):
+    """Medians / p95s over the recent generations (not cache replays), for the sidebar panel; None when there are none."""
+    records = [r for r in (records if records is not None else _registry.recent())
+               if r["status"] == "done" and not r.get("replay")]
+    if not records:
+        return None
+
+    def pick(field):
+        return sorted(r[field] for r in records if r.get(field) is not None)
+
+    def quantile(values, q):
+        return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+    ttft, rate, wait = pick("ttft"), pick("tokens_per_second"), pick("queue_wait")
+    return {
+        "requests": len(records),
+        "ttft_p50": quantile(ttft, 0.5), "ttft_p95": quantile(ttft, 0.95),
+        "tokens_per_second": statistics.median(rate) if rate else None,
+        "queue_wait_p95": quantile(wait, 0.95),
+    }
+
+
+def format_summary(stats):
+    """Two short lines for st.caption."""
+    if not stats:
+        return "No generations yet."
+
+    def seconds(value):
+        return "–" if value is None else f"{value:.2f}s"
+
+    rate = "–" if stats["tokens_per_second"] is None else f"{stats['tokens_per_second']:.1f}"
+    return (
+        f"{stats['requests']} requests · TTFT p50 {seconds(stats['ttft_p50'])} / p95 {seconds(stats['ttft_p95'])}  \n"
+        f"{rate} tok/s · queue wait p95 {seconds(stats['queue_wait_p95'])}"
+    )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port=METRICS_PORT):
+    """Serve /metrics on ``port`` in a daemon thread, once per process (no-op when port is 0)."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError:
+                # Another process (e.g. a second Streamlit app) already serves it
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
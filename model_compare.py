@@ -0,0 +1,129 @@
+"""Send one prompt to several configured models and compare them side by side.
+
+Every model gets its own GenerationJob (keyed ``<session>/compare/<model>``),
+so they stream concurrently and each can be stopped without touching the
+others. The fan-out asks the scheduler for one slot per model at once
+(``user_limit``) instead of the usual per-user cap, so the wall time is that
+of the slowest model rather than the sum. Comparisons skip the response cache:
+every column is a real generation with that model's config.json settings
+(system prompt, num_ctx, keep_alive), and shows TTFT from submission and its
+streaming tokens/s. render() draws the columns once; the page calls it from a
+timed fragment while the jobs run, and each column keeps its renderer and read
+offset on the Comparison across those reruns.
+
+Ollama has to keep the compared models loaded together
+(OLLAMA_MAX_LOADED_MODELS); otherwise they evict each other and load time
+dominates the numbers.
+"""
+import time
+
+import generation_manager
+import model_lifecycle
+import stream_renderer
+
+
+def available_models():
+    """Model names from the ``"models"`` section of config.json."""
+    return list(model_lifecycle.load_models_config())
+
+
+def job_key(session_key, model):
+    return f"{session_key}/compare/{model}"
+
+
+class Comparison:
+    """One prompt fanned out to ``models``."""
+
+    def __init__(self, session_key, prompt, models, user=None):
+        self.session_key = session_key
+        self.prompt = prompt
+        self.models = list(models)
+        self.started = time.monotonic()
+        self.jobs = {}
+        # Per model: [StreamRenderer, read offset], kept across the page's reruns
+        self.views = {}
+        manager = generation_manager.get_manager()
+        try:
+            for model in self.models:
+                self.jobs[model] = manager.start(
+                    job_key(session_key, model), "/api/generate", payload(model, prompt),
+                    user=user or session_key, kind="compare", user_limit=len(self.models),
+                )
+        except Exception:
+            # All or nothing: a half-started comparison would not compare anything
+            self.close()
+            raise
+
+    @property
+    def done(self):
+        return all(job.done for job in self.jobs.values())
+
+    def cancel(self, model):
+        job = self.jobs.get(model)
+        if job is not None:
+            job.cancel()
+
+    def close(self):
+        """Cancel whatever still runs and drop the jobs from the manager."""
+        manager = generation_manager.get_manager()
+        for model, job in self.jobs.items():
+            job.cancel()
+            if manager.get(job_key(self.session_key, model)) is job:
+                manager.pop(job_key(self.session_key, model))
+
+    def stats(self, model):
+        """Status, TTFT, elapsed seconds, tokens and tokens/s of one model's job."""
+        job = self.jobs[model]
+        return dict(job.metrics.live(), status=job.status, error=job.error)
+
+    def wall_time(self):
+        """Seconds from fan-out to the last model finishing (or now)."""
+        ends = [job.metrics.finished_at for job in self.jobs.values()]
+        end = max(ends) if ends and None not in ends else time.monotonic()
+        return end - self.started
+
+
+def payload(model, prompt):
+    """Generation request for ``model`` with its configured system prompt and sizing."""
+    settings = model_lifecycle.model_settings(model)
+    request = {"model": model, "prompt": prompt}
+    if settings.get("system"):
+        request["system"] = settings["system"]
+    request.update(model_lifecycle.request_settings(model, request.get("system", "") + prompt))
+    return request
+
+
+def format_stats(stats):
+    """One-line summary of Comparison.stats for a column header."""
+    parts = [stats["status"]]
+    if stats["ttft"] is not None:
+        parts.append(f"TTFT {stats['ttft']:.2f}s")
+    if stats["tokens_per_second"]:
+        parts.append(f"{stats['tokens_per_second']:.1f} tok/s")
+    parts.append(f"{stats['tokens']} tok in {stats['elapsed']:.1f}s")
+    return " · ".join(parts)
+
+
+def render(st, comparison, min_interval=stream_renderer.MIN_INTERVAL, min_bytes=stream_renderer.MIN_BYTES):
+    """Draw every model's column with what has streamed in so far (one redraw)."""
+    st.markdown(f"**Prompt:** {comparison.prompt}")
+    columns = st.columns(len(comparison.models))
+    for column, model in zip(columns, comparison.models):
+        job = comparison.jobs[model]
+        done = job.done
+        view = comparison.views.get(model)
+        if view is None:
+            view = comparison.views[model] = [
+                stream_renderer.StreamRenderer(None, min_interval=min_interval, min_bytes=min_bytes), 0
+            ]
+        with column:
+            st.subheader(model)
+            st.button(
+                "⏹️ Stop", key=f"compare_stop_{model}", on_click=comparison.cancel, args=(model,), disabled=done,
+            )
+            stats = comparison.stats(model)
+            st.caption(format_stats(stats) + (f" · {stats['error']}" if stats["error"] else ""))
+            chunks, view[1] = job.read(view[1])
+            view[0].tick(st.empty(), chunks, final=done)
+    slowest = max(comparison.stats(model)["elapsed"] for model in comparison.models)
+    st.caption(f"Wall time {comparison.wall_time():.2f}s · slowest model {slowest:.2f}s")
@@ -0,0 +1,150 @@
+"""Model warm-up, keep_alive and num_ctx sizing.
+
+Settings come from the ``"models"`` section of config.json:
+
+    "qwen2.5:0.5b": {"num_ctx": 100000, "keep_alive": "30m", "warm_up": true}
+
+``num_ctx`` is the upper bound; each request asks for the smallest bucket of
+NUM_CTX_BUCKETS that fits the estimated prompt, history and reply, so Ollama
+does not allocate a huge KV cache for a one-line prompt, and the few fixed
+sizes avoid reloading the model every time the context size changes.
+"""
+import json
+import threading
+
+import endpoints
+import ollama_client
+
+NUM_CTX_BUCKETS = (2048, 4096, 8192, 16384, 32768, 65536, 131072)
+DEFAULT_NUM_CTX = 8192
+DEFAULT_KEEP_ALIVE = "30m"
+
+# Tokens kept free for the reply, and the rough size of a token
+RESPONSE_RESERVE = 4096
+CHARS_PER_TOKEN = 4
+
+_config = None
+_warmed = set()
+_warm_lock = threading.Lock()
+
+
+def load_models_config(config_path=endpoints.CONFIG_FILE):
+    """Return the ``"models"`` section of config.json (cached after the first read)."""
+    global _config
+    if _config is None:
+        try:
+            with open(config_path, "r") as config_file:
+                _config = json.load(config_file).get("models", {})
+        except (OSError, ValueError):
+            _config = {}
+    return _config
+
+
+def model_settings(model):
+    return load_models_config().get(model, {})
+
+
+def estimate_tokens(text):
+    """Cheap token estimate, good enough to pick a bucket."""
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+def num_ctx_for(model, prompt_tokens):
+    """Smallest bucket that fits ``prompt_tokens`` plus the reply, capped at the model's num_ctx."""
+    limit = model_settings(model).get("num_ctx", DEFAULT_NUM_CTX)
+    # Sized as at least one prompt token, so the empty warm-up request loads the
+    # model with the num_ctx that short real prompts get and they do not reload it
+    needed = max(prompt_tokens, 1) + RESPONSE_RESERVE
+    for bucket in NUM_CTX_BUCKETS:
+        if bucket >= needed:
+            return min(bucket, limit)
+    return limit
+
+
+def request_settings(model, prompt_text="", context_tokens=0, history_tokens=0):
+    """
+    Return the ``options``/``keep_alive`` fields for a generation request.
+
+    Parameters:
+        model (str): Model name.
+        prompt_text (str): Prompt and system text sent with the request.
+        context_tokens (int): Length of a reused KV ``context``.
+        history_tokens (int): Tokens of conversation history included in the prompt.
+
+    Returns:
+        dict: {"options": {"num_ctx": ...}, "keep_alive": ...}
+    """
+    prompt_tokens = estimate_tokens(prompt_text) + context_tokens + history_tokens
+    return {
+        "options": {"num_ctx": num_ctx_for(model, prompt_tokens)},
+        "keep_alive": model_settings(model).get("keep_alive", DEFAULT_KEEP_ALIVE),
+    }
+
+
+def warm_up(model, base_url):
+    """Load ``model`` on one endpoint with the default context size (empty prompt = load only)."""
+    settings = request_settings(model)
+    response = ollama_client.get_session().post(
+        f"{base_url}/api/generate",
+        json={"model": model, "prompt": "", "stream": False, **settings},
+        timeout=(ollama_client.CONNECT_TIMEOUT, ollama_client.READ_TIMEOUT),
+    )
+    ollama_client.check_response(response)
+    return response.json()
+
+
+def warm_up_configured(models=None):
+    """
+    Preload the configured models on every endpoint, once per process, in the background.
+
+    Models with ``"warm_up": false`` in config.json are skipped unless listed in ``models``.
+    """
+    if models is None:
+        models = [name for name, settings in load_models_config().items() if settings.get("warm_up", True)]
+    with _warm_lock:
+        pending = [model for model in models if model not in _warmed]
+        _warmed.update(pending)
+    if pending:
+        threading.Thread(target=_warm_all, args=(pending,), name="model-warm-up", daemon=True).start()
+
+
+def _warm_all(models):
+    for endpoint in ollama_client.get_pool().endpoints:
+        for model in models:
+            try:
+                warm_up(model, endpoint.url)
+            except Exception:
+                pass
+
+
+def timing_report(final_chunk):
+    """
+    Split a final stream chunk's durations into load / prompt eval / eval.
+
+    Returns:
+        dict: Seconds and token counts, or None if the chunk has no timings.
+    """
+    if not final_chunk or "total_duration" not in final_chunk:
+        return None
+    ns = 1e9
+    eval_count = final_chunk.get("eval_count", 0)
+    eval_duration = final_chunk.get("eval_duration", 0) / ns
+    return {
+        "total": final_chunk.get("total_duration", 0) / ns,
+        "load": final_chunk.get("load_duration", 0) / ns,
+        "prompt_eval": final_chunk.get("prompt_eval_duration", 0) / ns,
+        "prompt_tokens": final_chunk.get("prompt_eval_count", 0),
+        "eval": eval_duration,
+        "eval_tokens": eval_count,
+        "tokens_per_second": eval_count / eval_duration if eval_duration else 0.0,
+    }
+
+
+def format_timing(report):
+    """One-line summary of a timing_report for the UI."""
+    if not report:
+        return ""
+    return (
+        f"load {report['load']:.2f}s · prompt {report['prompt_eval']:.2f}s ({report['prompt_tokens']} tok)"
+        f" · eval {report['eval']:.2f}s ({report['tokens_per_second']:.1f} tok/s)"
+    )
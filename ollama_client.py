@@ -0,0 +1,214 @@
+"""Shared Ollama HTTP client.
+
+main.py, chat.py and editor/editor.py all talk to Ollama through this module so
+that every Streamlit session reuses one pooled, keep-alive ``requests.Session``
+instead of opening a fresh TCP connection per message. Requests without an
+explicit ``base_url`` are routed through the endpoint pool built from
+config.json (see endpoints.py).
+"""
+import json
+import os
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import endpoints
+
+# API and connection pool configuration. Setting OLLAMA_API_URL pins every
+# request to that instance instead of the "apis" listed in config.json.
+OLLAMA_API_URL = os.environ.get("OLLAMA_API_URL", "http://localhost:11434")
+POOL_CONNECTIONS = int(os.environ.get("OLLAMA_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.environ.get("OLLAMA_POOL_MAXSIZE", "32"))
+CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+
+# Bytes requested per socket read while decoding a stream (iter_lines uses 512)
+READ_BUFFER_SIZE = int(os.environ.get("OLLAMA_READ_BUFFER_SIZE", "16384"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class OllamaError(Exception):
+    """Raised when Ollama answers with a non-200 status."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def configure(pool_connections=None, pool_maxsize=None, connect_timeout=None,
+              read_timeout=None, read_buffer_size=None):
+    """Override pool size, timeouts or read buffer; the pool is rebuilt lazily."""
+    global POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT, READ_BUFFER_SIZE, _session
+    with _session_lock:
+        if pool_connections is not None:
+            POOL_CONNECTIONS = pool_connections
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if connect_timeout is not None:
+            CONNECT_TIMEOUT = connect_timeout
+        if read_timeout is not None:
+            READ_TIMEOUT = read_timeout
+        if read_buffer_size is not None:
+            READ_BUFFER_SIZE = read_buffer_size
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _session = session
+    return _session
+
+
+def get_pool():
+    """Return the endpoint pool requests are balanced over."""
+    if "OLLAMA_API_URL" in os.environ:
+        return endpoints.get_pool(OLLAMA_API_URL, config_path=None)
+    return endpoints.get_pool(OLLAMA_API_URL)
+
+
+def post_stream(path, payload, base_url=None, timeout=None):
+    """POST ``payload`` to an Ollama endpoint and return the open streaming response.
+
+    The caller owns the response and must close it (``with response:``); closing
+    it early is what tells Ollama to stop generating.
+    """
+    url = f"{base_url or OLLAMA_API_URL}{path}"
+    return get_session().post(
+        url,
+        json=payload,
+        stream=True,
+        timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT),
+    )
+
+
+def abort(response):
+    """
+    Close a streaming response immediately, even while another thread is
+    blocked reading it. Shutting the socket down makes Ollama see the client
+    disconnect and stop generating, freeing its slot.
+    """
+    raw = getattr(response, "raw", None)
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        fp = getattr(getattr(raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+
+def check_response(response):
+    """Raise OllamaError if the response is not a 200."""
+    if response.status_code != 200:
+        raise OllamaError(response.text, response.status_code)
+
+
+def iter_ndjson(response, chunk_size=None, on_error=None):
+    """
+    Decode an Ollama NDJSON stream.
+
+    Parameters:
+        response (requests.Response): An open streaming response.
+        chunk_size (int): Bytes per read, defaults to READ_BUFFER_SIZE.
+        on_error (callable): Called with the raw line when it is not valid JSON.
+
+    Yields:
+        dict: One decoded object per line.
+    """
+    pending = b""
+    for data in response.iter_content(chunk_size=chunk_size or READ_BUFFER_SIZE):
+        if not data:
+            continue
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            chunk = _decode_line(line, on_error)
+            if chunk is not None:
+                yield chunk
+    chunk = _decode_line(pending, on_error)
+    if chunk is not None:
+        yield chunk
+
+
+def _decode_line(line, on_error):
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        if on_error:
+            on_error(line)
+        return None
+
+
+def stream(path, payload, base_url=None, affinity=None, on_endpoint=None):
+    """
+    Stream decoded chunks from ``path``, on a pooled endpoint unless ``base_url`` is given.
+
+    ``on_endpoint`` is called with the URL the request is sent to.
+    """
+    if base_url:
+        if on_endpoint is not None:
+            on_endpoint(base_url)
+        with post_stream(path, payload, base_url=base_url) as response:
+            check_response(response)
+            yield from iter_ndjson(response)
+        return
+    with get_pool().lease(affinity) as endpoint:
+        if on_endpoint is not None:
+            on_endpoint(endpoint.url)
+        with post_stream(path, payload, base_url=endpoint.url) as response:
+            check_response(response)
+            yield from iter_ndjson(response)
+
+
+def generate_stream(payload, base_url=None, affinity=None):
+    """Stream decoded chunks from ``/api/generate``."""
+    yield from stream("/api/generate", payload, base_url=base_url, affinity=affinity)
+
+
+def chat_stream(model, messages, options=None, keep_alive=None, base_url=None, affinity=None, on_endpoint=None):
+    """Stream decoded chunks from ``/api/chat``."""
+    payload = {"model": model, "messages": messages, "stream": True}
+    if options:
+        payload["options"] = options
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    yield from stream("/api/chat", payload, base_url=base_url, affinity=affinity, on_endpoint=on_endpoint)
+
+
+def embed(model, text, base_url=None):
+    """Return the embedding vector of ``text`` from ``/api/embed``."""
+    if base_url:
+        return _embed(model, text, base_url)
+    with get_pool().lease() as endpoint:
+        return _embed(model, text, endpoint.url)
+
+
+def _embed(model, text, base_url):
+    response = get_session().post(
+        f"{base_url}/api/embed",
+        json={"model": model, "input": text},
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    )
+    check_response(response)
+    return response.json()["embeddings"][0]
@@ -0,0 +1,185 @@
+"""Exact-match cache of generated responses.
+
+Entries are keyed on the full generation request (model, system prompt, prompt
+and options). Lookups go through a bounded in-memory LRU first, then a disk
+tier under CACHE_DIR that is evicted by total size and entry age. A hit is
+returned as decoded stream chunks so it can be replayed through the normal
+GenerationJob path.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = "response_cache"
+MEMORY_ENTRIES = 256
+DISK_MAX_BYTES = 256 * 1024 * 1024
+DISK_MAX_AGE = 7 * 24 * 3600
+
+# Characters per replayed chunk
+REPLAY_CHUNK = 64
+
+# Request fields that do not change the generated text
+_IGNORED_FIELDS = ("keep_alive", "stream")
+_IGNORED_OPTIONS = ("num_ctx",)
+
+# Fields of the final stream chunk that are not worth keeping
+_DROP_FINAL_FIELDS = ("context", "response", "message")
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def request_identity(payload):
+    """The part of a generation request that determines its output.
+
+    keep_alive only affects model residency, and num_ctx is derived from the
+    prompt length, so neither should split cache entries.
+    """
+    identity = {k: v for k, v in payload.items() if k not in _IGNORED_FIELDS}
+    if "options" in identity:
+        identity["options"] = {k: v for k, v in identity["options"].items() if k not in _IGNORED_OPTIONS}
+    return identity
+
+
+def cache_key(payload):
+    """Hash a generation request; every field that affects the output is part of the key."""
+    canonical = json.dumps(request_identity(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def replay_chunks(entry):
+    """Turn a cache entry back into NDJSON-style chunks ending with the final chunk."""
+    text = entry["text"]
+    for start in range(0, len(text), REPLAY_CHUNK):
+        yield {"response": text[start:start + REPLAY_CHUNK], "done": False}
+    final = dict(entry.get("final") or {})
+    final.update({"response": "", "done": True, "cached": True})
+    yield final
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) response cache with hit/miss counters."""
+
+    def __init__(self, directory=CACHE_DIR, memory_entries=MEMORY_ENTRIES,
+                 disk_max_bytes=DISK_MAX_BYTES, disk_max_age=DISK_MAX_AGE):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_max_age = disk_max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evicted": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    def get(self, key):
+        """Return the cached entry for ``key`` or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry):
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return entry
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or self._expired(entry):
+            if entry is not None:
+                self._remove(path)
+            with self._lock:
+                self._memory.pop(key, None)
+                self.stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self._remember(key, entry)
+            self.stats["hits"] += 1
+            self.stats["disk_hits"] += 1
+        return entry
+
+    def put(self, key, text, final=None):
+        """Store a completed response in both tiers."""
+        final = {k: v for k, v in (final or {}).items() if k not in _DROP_FINAL_FIELDS}
+        entry = {"text": text, "final": final, "created": time.time()}
+        with self._lock:
+            self._remember(key, entry)
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        with self._lock:
+            self._disk_bytes += os.path.getsize(path) - previous
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self.evict()
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def evict(self):
+        """Drop expired entries, then the oldest ones until the disk tier fits."""
+        now = time.time()
+        entries = sorted(self._disk_entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        for path, mtime, size in entries:
+            if total <= self.disk_max_bytes and now - mtime <= self.disk_max_age:
+                continue
+            self._remove(path)
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self.stats["evicted"] += evicted
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _expired(self, entry):
+        return time.time() - entry.get("created", 0) > self.disk_max_age
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _disk_entries(self):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+
+def get_cache(directory=CACHE_DIR):
+    """Return the process-wide cache for ``directory``."""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = ResponseCache(directory)
+    return cache
@@ -0,0 +1,207 @@
+"""Fair admission of generation requests across users.
+
+Every call to Ollama (chat replies, editor code generation, auto-repair) takes
+a slot from the process-wide Scheduler first. At most ``capacity`` requests run
+at once (by default the summed max_concurrency of the endpoint pool) and one
+user never holds more than PER_USER_LIMIT of them. Waiting requests are
+ordered by priority class (interactive before background), then by weighted
+fair queuing: each user has a virtual clock that advances by ``cost / weight``
+per request, so a user who keeps resubmitting falls behind users who have
+been waiting. The queue is bounded; beyond MAX_QUEUE new requests are refused
+with SchedulerFull instead of piling up as timeouts.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import ollama_client
+
+INTERACTIVE, BACKGROUND = 0, 1
+
+PER_USER_LIMIT = 2
+MAX_QUEUE = 64
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class SchedulerFull(Exception):
+    """Raised when the wait queue is full; the caller should ask the user to retry."""
+
+
+class Ticket:
+    """One request's place in the scheduler, from submission until release."""
+
+    def __init__(self, user, priority, start, finish, sequence, on_grant=None, limit=None):
+        self.user = user
+        self.priority = priority
+        self.start = start
+        self.finish = finish
+        self.sequence = sequence
+        self.on_grant = on_grant
+        self.limit = limit
+        self.submitted_at = time.monotonic()
+        self.granted_at = None
+        self.released = False
+        self._granted = threading.Event()
+
+    @property
+    def granted(self):
+        return self.granted_at is not None
+
+    @property
+    def wait_time(self):
+        """Seconds spent queued (so far, if still waiting)."""
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.submitted_at
+
+    def wait(self, timeout=None):
+        return self._granted.wait(timeout)
+
+    def _sort_key(self):
+        return self.priority, self.finish, self.sequence
+
+
+class Scheduler:
+    """Bounded, per-user capped, weighted fair queue in front of Ollama."""
+
+    def __init__(self, capacity, per_user_limit=PER_USER_LIMIT, max_queue=MAX_QUEUE):
+        self.capacity = capacity
+        self.per_user_limit = per_user_limit
+        self.max_queue = max_queue
+        self._waiting = []
+        self._running = {}
+        self._clocks = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "cancelled": 0}
+
+    def submit(self, user, priority=INTERACTIVE, cost=1.0, weight=1.0, on_grant=None, limit=None):
+        """
+        Queue a request for ``user`` and return its Ticket.
+
+        ``cost`` is the request's expected size and ``weight`` the user's share;
+        ``on_grant`` is called (outside the scheduler lock) once the request may
+        run; otherwise wait on the ticket. ``limit`` raises the per-user cap for
+        this request, for a fan-out whose parts must run side by side. Raises
+        SchedulerFull when the queue is at MAX_QUEUE.
+        """
+        with self._lock:
+            start = max(self._clocks.get(user, 0.0), self._virtual_time)
+            finish = start + cost / weight
+            ticket = Ticket(user, priority, start, finish, next(self._sequence), on_grant, limit)
+            if self._admissible(ticket):
+                self._clocks[user] = finish
+                granted = [self._grant(ticket)]
+            else:
+                if len(self._waiting) >= self.max_queue:
+                    self.stats["rejected"] += 1
+                    raise SchedulerFull(f"Server busy: {len(self._waiting)} requests already waiting")
+                self._clocks[user] = finish
+                self._waiting.append(ticket)
+                self.stats["queued"] += 1
+                granted = []
+        self._notify(granted)
+        return ticket
+
+    def release(self, ticket):
+        """
+        Give back a running slot, or withdraw a ticket that is still waiting.
+
+        Returns True only when a waiting ticket was withdrawn (it will never be granted).
+        """
+        withdrawn = False
+        with self._lock:
+            if ticket.released:
+                return False
+            ticket.released = True
+            if ticket.granted:
+                self._running[ticket.user] -= 1
+                if not self._running[ticket.user]:
+                    del self._running[ticket.user]
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+                self.stats["cancelled"] += 1
+                withdrawn = True
+            granted = self._dispatch()
+        self._notify(granted)
+        return withdrawn
+
+    def position(self, ticket):
+        """1-based place of a waiting ticket in dispatch order, 0 once it runs."""
+        with self._lock:
+            if ticket.granted or ticket not in self._waiting:
+                return 0
+            return sorted(self._waiting, key=Ticket._sort_key).index(ticket) + 1
+
+    @contextmanager
+    def slot(self, user, priority=INTERACTIVE, cost=1.0, weight=1.0, cancelled=None, limit=None):
+        """``with scheduler.slot(user):`` around a synchronous request."""
+        ticket = self.submit(user, priority, cost, weight, limit=limit)
+        try:
+            while not ticket.wait(0.5):
+                if cancelled is not None and cancelled():
+                    raise TimeoutError("Cancelled while queued")
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def queue_length(self):
+        with self._lock:
+            return len(self._waiting)
+
+    def running_count(self):
+        with self._lock:
+            return sum(self._running.values())
+
+    def _admissible(self, ticket):
+        return (
+            sum(self._running.values()) < self.capacity
+            and self._running.get(ticket.user, 0) < self._user_limit(ticket)
+        )
+
+    def _user_limit(self, ticket):
+        return max(self.per_user_limit, ticket.limit or 0)
+
+    def _grant(self, ticket):
+        self._running[ticket.user] = self._running.get(ticket.user, 0) + 1
+        self._virtual_time = max(self._virtual_time, ticket.start)
+        ticket.granted_at = time.monotonic()
+        self.stats["admitted"] += 1
+        return ticket
+
+    def _dispatch(self):
+        """Grant waiting tickets in fair order while there is capacity."""
+        granted = []
+        for ticket in sorted(self._waiting, key=Ticket._sort_key):
+            if sum(self._running.values()) >= self.capacity:
+                break
+            if self._running.get(ticket.user, 0) >= self._user_limit(ticket):
+                continue
+            self._waiting.remove(ticket)
+            granted.append(self._grant(ticket))
+        if not self._waiting and not self._running:
+            # Idle: reset the clocks so they do not grow without bound
+            self._clocks.clear()
+            self._virtual_time = 0.0
+        return granted
+
+    def _notify(self, granted):
+        for ticket in granted:
+            ticket._granted.set()
+            if ticket.on_grant is not None:
+                ticket.on_grant()
+
+
+def get_scheduler(capacity=None):
+    """Return the process-wide Scheduler, sized to the endpoint pool on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                if capacity is None:
+                    capacity = sum(e.max_concurrency for e in ollama_client.get_pool().endpoints) or 1
+                _scheduler = Scheduler(capacity)
+    return _scheduler
@@ -0,0 +1,198 @@
+"""Optional semantic response cache.
+
+Near-paraphrased prompts ("write a book on thermodynamics" / "plan a
+thermodynamics book") miss the exact-match cache. This cache embeds each prompt
+through Ollama's /api/embed, keeps the unit vectors of one partition (model,
+system prompt and options) in a contiguous memory-mapped NumPy matrix, and
+serves the stored answer of the most similar earlier prompt when its cosine
+similarity reaches THRESHOLD. Answers themselves stay in the exact-match
+response cache; rows here only point at their keys.
+
+Enable with SEMANTIC_CACHE=1.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import ollama_client
+import response_cache
+import startup
+
+# numpy is only imported once the cache is actually used
+np = startup.lazy_import("numpy")
+
+ENABLED = os.environ.get("SEMANTIC_CACHE", "0") == "1"
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "mxbai-embed-large:latest")
+CACHE_DIR = "semantic_cache"
+THRESHOLD = 0.92
+CAPACITY = 4096
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def partition_id(payload, embedding_model=EMBEDDING_MODEL):
+    """Hash everything in the request except the prompt itself, plus the embedding model."""
+    rest = {k: v for k, v in response_cache.request_identity(payload).items() if k != "prompt"}
+    rest["_embedding_model"] = embedding_model
+    return hashlib.sha256(json.dumps(rest, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class Partition:
+    """Vectors for one partition, backed by ``<id>.npy`` (memory-mapped) and ``<id>.json``."""
+
+    def __init__(self, directory, pid, capacity):
+        self.matrix_path = os.path.join(directory, pid + ".npy")
+        self.meta_path = os.path.join(directory, pid + ".json")
+        self.capacity = capacity
+        self.matrix = None
+        self.keys = []
+        self.last_used = np.zeros(capacity)
+        if os.path.exists(self.matrix_path) and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            self.matrix = np.lib.format.open_memmap(self.matrix_path, mode="r+")
+            self.keys = meta["keys"]
+            self.last_used[:len(meta["last_used"])] = meta["last_used"]
+
+    def search(self, vector):
+        """Return (row, similarity) of the closest stored vector, or (None, -1)."""
+        if self.matrix is None or not self.keys:
+            return None, -1.0
+        similarities = self.matrix[:len(self.keys)] @ vector
+        row = int(np.argmax(similarities))
+        return row, float(similarities[row])
+
+    def add(self, vector, key):
+        if self.matrix is None:
+            self.matrix = np.lib.format.open_memmap(
+                self.matrix_path, mode="w+", dtype=np.float32, shape=(self.capacity, vector.shape[0])
+            )
+        if len(self.keys) < self.capacity:
+            row = len(self.keys)
+            self.keys.append(key)
+            evicted = False
+        else:
+            row = int(np.argmin(self.last_used))
+            self.keys[row] = key
+            evicted = True
+        self.matrix[row] = vector
+        self.last_used[row] = time.time()
+        self.matrix.flush()
+        self.save_meta()
+        return evicted
+
+    def drop(self, row):
+        """Remove a row by moving the last row into its place."""
+        last = len(self.keys) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.keys[row] = self.keys[last]
+            self.last_used[row] = self.last_used[last]
+        self.keys.pop()
+        self.last_used[last] = 0
+        self.matrix.flush()
+        self.save_meta()
+
+    def save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump({"keys": self.keys, "last_used": self.last_used[:len(self.keys)].tolist()}, file)
+        os.replace(tmp, self.meta_path)
+
+
+class SemanticCache:
+    """Cosine-similarity lookup of earlier answers, one Partition per request shape."""
+
+    def __init__(self, directory=CACHE_DIR, threshold=THRESHOLD, capacity=CAPACITY,
+                 embedding_model=EMBEDDING_MODEL, base_url=None, embed=None):
+        self.directory = directory
+        self.threshold = threshold
+        self.capacity = capacity
+        self.embedding_model = embedding_model
+        self.base_url = base_url
+        self._embed = embed or (lambda text: ollama_client.embed(self.embedding_model, text, base_url=self.base_url))
+        self._partitions = {}
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0, "errors": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def lookup(self, payload, answers=None):
+        """Return the response-cache entry of a similar earlier prompt, or None."""
+        answers = answers or response_cache.get_cache()
+        vector = self._vector(payload["prompt"])
+        if vector is None:
+            return None
+        with self._lock:
+            partition = self._partition(partition_id(payload, self.embedding_model))
+            row, similarity = partition.search(vector)
+            if row is None or similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            key = partition.keys[row]
+        entry = answers.get(key)
+        with self._lock:
+            if entry is None:
+                # The answer was evicted from the response cache
+                if row < len(partition.keys) and partition.keys[row] == key:
+                    partition.drop(row)
+                self.stats["misses"] += 1
+                return None
+            partition.last_used[row] = time.time()
+            self.stats["hits"] += 1
+        return entry
+
+    def add(self, payload, key):
+        """Index the prompt of ``payload`` as pointing at response-cache ``key``."""
+        vector = self._vector(payload["prompt"])
+        if vector is None:
+            return
+        with self._lock:
+            partition = self._partition(partition_id(payload, self.embedding_model))
+            row, similarity = partition.search(vector)
+            if row is not None and similarity > 0.9999:
+                # Same prompt answered again (regeneration): repoint the row
+                partition.keys[row] = key
+                partition.save_meta()
+            elif partition.add(vector, key):
+                self.stats["evicted"] += 1
+
+    def _vector(self, text):
+        """Return the unit embedding of ``text``, or None if the embedding call failed."""
+        with self._lock:
+            vector = self._recent.get(text)
+        if vector is None:
+            # The embedding request runs outside the lock; only the memo is shared
+            try:
+                vector = np.asarray(self._embed(text), dtype=np.float32)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                return None
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+            with self._lock:
+                self._recent[text] = vector
+                while len(self._recent) > 64:
+                    self._recent.popitem(last=False)
+        return vector
+
+    def _partition(self, pid):
+        partition = self._partitions.get(pid)
+        if partition is None:
+            partition = self._partitions[pid] = Partition(self.directory, pid, self.capacity)
+        return partition
+
+
+def get_cache(directory=CACHE_DIR):
+    """Return the process-wide semantic cache for ``directory``."""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = SemanticCache(directory)
+    return cache
@@ -0,0 +1,69 @@
+"""Single-flight memoization of slow calls across Streamlit reruns.
+
+A rerun interrupts the script, but not the work it started. SingleFlight runs
+each call in a background thread and keeps its Future under a key, so a rerun
+that asks for the same key waits on the request already in flight instead of
+starting a duplicate, and later reruns get the finished result at once.
+Completed results stay in a bounded LRU; failed calls are forgotten so the
+next request retries.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_ENTRIES = 256
+MAX_WORKERS = 8
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class SingleFlight:
+    """Deduplicating, memoizing front of a thread pool."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_workers=MAX_WORKERS, name="single-flight"):
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"started": 0, "joined": 0, "memo_hits": 0}
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Return the Future for ``key``, starting ``fn(*args, **kwargs)`` only if none is usable."""
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None and not (future.done() and (future.cancelled() or future.exception())):
+                self._futures.move_to_end(key)
+                self.stats["memo_hits" if future.done() else "joined"] += 1
+                return future
+            future = self._executor.submit(fn, *args, **kwargs)
+            self._futures[key] = future
+            self.stats["started"] += 1
+            self._evict()
+            return future
+
+    def peek(self, key):
+        """Return the Future for ``key`` without starting anything, or None."""
+        with self._lock:
+            return self._futures.get(key)
+
+    def forget(self, key):
+        with self._lock:
+            self._futures.pop(key, None)
+
+    def _evict(self):
+        # Only finished entries are evicted; in-flight ones are still being waited on
+        for key in list(self._futures):
+            if len(self._futures) <= self.max_entries:
+                break
+            if self._futures[key].done():
+                del self._futures[key]
+
+
+def get_flight(name):
+    """Return the process-wide SingleFlight called ``name``."""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = _flights[name] = SingleFlight(name=name)
+    return flight
@@ -0,0 +1,185 @@
+"""Cold-start and per-rerun helpers for the Streamlit entry points.
+
+Streamlit executes the whole page script again on every interaction, so
+anything at module level runs once per click. The entry points use this module
+to keep that to the work the interaction needs:
+
+- lazy_import() defers a heavy dependency (numpy, the repair search, ...)
+  until an attribute of it is first used;
+- run_once() does process-wide setup (directories, warm-up, servers) on the
+  first run only;
+- init_session_state() fills missing session keys from a dict of factories,
+  once per browser session;
+- RerunTimer times the sections of one rerun (imports, setup, sidebar, ...).
+
+With PROFILE_RERUNS=1 (or ``?profile=1`` in the URL) render_report() shows
+the import times and the latest rerun breakdown in the sidebar.
+"""
+import importlib
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+
+PROFILE = os.environ.get("PROFILE_RERUNS", "0") == "1"
+RERUN_HISTORY = 50
+
+# Process start as far as this interpreter can tell: the first import of this module
+PROCESS_START = time.perf_counter()
+
+_import_times = {}
+_done = {}
+_once_lock = threading.Lock()
+_reruns = {}
+_first_runs = {}
+_reruns_lock = threading.Lock()
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            # Threads arriving during the import wait for it instead of seeing a half-initialized module
+            with self._lock:
+                if self._module is None:
+                    self._module = timed_import(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def timed_import(name):
+    """Import ``name``, recording how long the first import took."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_times.setdefault(name, time.perf_counter() - started)
+    return module
+
+
+def lazy_import(name):
+    """Return a proxy for module ``name`` that is only imported when first used."""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+
+def run_once(key, fn, *args, **kwargs):
+    """Call ``fn`` the first time ``key`` is seen in this process; return its (cached) result."""
+    if key in _done:
+        return _done[key]
+    with _once_lock:
+        if key not in _done:
+            _done[key] = fn(*args, **kwargs)
+    return _done[key]
+
+
+def init_session_state(state, defaults):
+    """
+    Set every missing key of ``defaults`` in ``state`` (st.session_state).
+
+    Values that are callables are factories, called only for missing keys. After
+    the first run of a session this is a single membership test.
+    """
+    marker = "_session_initialized"
+    if state.get(marker) == len(defaults):
+        return
+    for key, value in defaults.items():
+        if key not in state:
+            state[key] = value() if callable(value) else value
+    state[marker] = len(defaults)
+
+
+class RerunTimer:
+    """
+    Wall time of the sections of one script run.
+
+    Create it at the top of the script and call mark(name) after each section;
+    a section runs from the previous mark (or the start) to this one.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.started = self._last = time.perf_counter()
+        self.sections = []
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.sections.append((name, now - self._last))
+        self._last = now
+
+    def finish(self):
+        """Record this run in the page's history and return its total duration."""
+        now = time.perf_counter()
+        total = now - self.started
+        with _reruns_lock:
+            _first_runs.setdefault(self.page, now - PROCESS_START)
+            history = _reruns.setdefault(self.page, deque(maxlen=RERUN_HISTORY))
+            history.append((total, self.sections))
+        return total
+
+
+def import_report():
+    """(module, seconds) of every import made through this module, slowest first."""
+    return sorted(_import_times.items(), key=lambda item: item[1], reverse=True)
+
+
+def rerun_report(page):
+    """Median and latest run of ``page``, or None before its first finished run."""
+    with _reruns_lock:
+        history = list(_reruns.get(page, ()))
+    if not history:
+        return None
+    latest_total, latest_sections = history[-1]
+    return {
+        "cold_start": _first_runs.get(page),
+        "runs": len(history),
+        "median": statistics.median(total for total, _ in history),
+        "latest": latest_total,
+        "sections": latest_sections,
+    }
+
+
+def enabled(st):
+    """Whether the timing report is switched on for this page view."""
+    if PROFILE:
+        return True
+    try:
+        return st.query_params.get("profile") == "1"
+    except Exception:
+        return False
+
+
+def render_report(st, page, timer=None):
+    """Show import and rerun timings in a sidebar expander when profiling is enabled."""
+    if timer is not None:
+        timer.finish()
+    if not enabled(st):
+        return
+    with st.sidebar.expander("⏱️ Timings"):
+        report = rerun_report(page)
+        if report:
+            st.caption(
+                f"Rerun: latest {report['latest'] * 1000:.1f} ms, "
+                f"median {report['median'] * 1000:.1f} ms over {report['runs']} runs; "
+                f"first run finished {report['cold_start']:.2f} s after process start"
+            )
+            st.text("\n".join(f"{name:<24} {seconds * 1000:8.1f} ms" for name, seconds in report["sections"]))
+        imports = import_report()
+        if imports:
+            st.caption("Imports (first use)")
+            st.text("\n".join(f"{name:<24} {seconds * 1000:8.1f} ms" for name, seconds in imports))
@@ -0,0 +1,117 @@
+"""Coalesced markdown rendering for streamed responses.
+
+Re-rendering the whole markdown body on every token is quadratic in both string
+building and websocket traffic. StreamRenderer buffers chunks in a list and only
+pushes to the placeholder once enough time has passed or enough bytes have
+arrived, with a final flush when the stream ends. In a fragment that reruns on
+a timer, tick() renders into each rerun's fresh placeholder and, when nothing
+new is due, shows the already rendered text again instead of rebuilding it.
+"""
+import time
+
+# Default flush thresholds
+MIN_INTERVAL = 0.1
+MIN_BYTES = 1024
+
+
+class StreamRenderer:
+    """Accumulate streamed chunks and render them to a Streamlit placeholder."""
+
+    def __init__(self, placeholder, min_interval=MIN_INTERVAL, min_bytes=MIN_BYTES, clock=time.monotonic):
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.min_bytes = min_bytes
+        self.clock = clock
+        self._parts = []
+        self._pending_bytes = 0
+        self._last_flush = None
+        self.shown = ""
+        self.chunks = 0
+        self.renders = 0
+        self.skipped = 0
+        self.idle = 0
+
+    def write(self, chunk):
+        """Buffer one chunk, rendering only if a threshold has been reached."""
+        if not self._buffer(chunk):
+            return
+        if self._due():
+            self.flush()
+        else:
+            self.skipped += 1
+
+    def extend(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def flush_if_due(self):
+        """Render pending chunks if the time threshold has passed (for idle streams)."""
+        if self._pending_bytes and self._due():
+            self.flush()
+
+    def flush(self):
+        """Render everything buffered so far."""
+        text = self.shown = self.text()
+        self.placeholder.markdown(text)
+        self._pending_bytes = 0
+        self._last_flush = self.clock()
+        self.renders += 1
+
+    def close(self):
+        """Final flush at end of stream; returns the full text."""
+        if self._pending_bytes or not self.renders:
+            self.flush()
+        return self.text()
+
+    def tick(self, placeholder, chunks, final=False):
+        """
+        One timed redraw: render the new ``chunks`` into ``placeholder`` when due
+        (everything when ``final``), else show the last rendered text as is.
+
+        The timer is what paces a tick, so a tick that comes a little early
+        still renders; only a redraw within half an interval of the last
+        render (a rerun from a click right after a tick) is held back.
+        """
+        self.placeholder = placeholder
+        renders = self.renders
+        added = sum(self._buffer(chunk) for chunk in chunks)
+        if not added:
+            self.idle += 1
+        if final:
+            self.close()
+        elif self._pending_bytes and self._due(self.min_interval / 2):
+            self.flush()
+        # Everything that arrived since the last tick goes out in at most one render
+        self.skipped += added - (1 if added and self.renders > renders else 0)
+        if self.renders == renders and self.shown:
+            placeholder.markdown(self.shown)
+
+    def text(self):
+        """Return the accumulated text, collapsing the buffer into one part."""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def stats(self):
+        return {"chunks": self.chunks, "renders": self.renders, "skipped": self.skipped, "idle": self.idle}
+
+    def _buffer(self, chunk):
+        if not chunk:
+            return False
+        self._parts.append(chunk)
+        self._pending_bytes += len(chunk.encode("utf-8"))
+        self.chunks += 1
+        return True
+
+    def _due(self, min_interval=None):
+        if self._last_flush is None or self._pending_bytes >= self.min_bytes:
+            return True
+        return self.clock() - self._last_flush >= (self.min_interval if min_interval is None else min_interval)
+
+
+def format_stats(stats):
+    """One line of StreamRenderer.stats for st.caption."""
+    return (
+        f"{stats['chunks']} chunks in {stats['renders']} renders · {stats['skipped']} coalesced · "
+        f"{stats['idle']} idle redraws"
+    )